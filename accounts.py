@@ -0,0 +1,422 @@
+"""
+per-account state, and an engine for checking many accounts' results at once
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import re
+import json
+import hashlib
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+
+import messages
+import metrics
+from diff import diff_all
+from records import Transcript
+from scrape import scrape_results, BASE_URL
+from store import FileStore
+from notify import connections
+from notify.by_multiple import MultiNotifier
+
+
+# notification methods that can be named in an accounts file, mapped to the
+# module and class implementing them. modules are only imported when a method
+# is actually used, so that e.g. notify2 is not required unless requested
+NOTIFIER_METHODS = {
+    "email":       ("notify.by_email",       "SMTPGmailNotifier"),
+    "email_oauth": ("notify.by_email_oauth", "GmailAPINotifier"),
+    "wechat":      ("notify.by_wechat",      "ServerChanNotifier"),
+    "telegram":    ("notify.by_telegram",    "TelegramBotNotifier"),
+    "pushbullet":  ("notify.by_push",        "PushbulletNotifier"),
+    "ifttt":       ("notify.by_ifttt",       "IFTTTWebhookNotifier"),
+    "desktop":     ("notify.by_desktop",     "DesktopNotifier"),
+    "logfile":     ("notify.by_logfile",     "LogFileNotifier"),
+    "slack":       ("notify.by_slack",       "SlackAppNotifier"),
+}
+
+# the domain used to build default (self-)email addresses for students
+STUDENT_EMAIL_DOMAIN = "student.unimelb.edu.au"
+
+# usernames go into file names (results, cookies, profiles), so they may only
+# contain these characters (and can't be "." or "..")
+USERNAME_PATTERN = re.compile(r"[A-Za-z0-9._-]+")
+
+
+class Account:
+    """
+    A watched student account, with its own stored results and notifiers.
+    """
+    def __init__(self, username, password, notifier, results_filename=None,
+            degrees_to_watch="all", default_degree_name="degree",
+            parser="html.parser", sessions=None, base_url=BASE_URL,
+            outbox=None, store=None, limiter=None, digest=None,
+            stream=False):
+        """
+        :param username: The student's unimelb username.
+        :param password: The student's unimelb password.
+        :param notifier: The notifier to use for this student's messages.
+        :param results_filename: File to store results in between checks
+                                 (default: results-{username}.txt), if
+                                 using a `store.FileStore`.
+        :param degrees_to_watch: "all", or a set of degree indexes.
+        :param default_degree_name: Name to use for a single-degree student.
+        :param parser: The extraction backend to use (see
+                       `extract.get_extractor`).
+        :param sessions: A `session.SessionManager` for keeping this student
+                         logged in between checks, or None to log in afresh
+                         every time.
+        :param base_url: The address of the student portal.
+        :param outbox: An `outbox.Outbox` to queue this student's messages
+                       in (to be delivered by an `outbox.DeliveryWorker`), or
+                       None to send them straight through the notifier.
+        :param store: Where to store results between checks (default: a
+                      `store.FileStore`, using `results_filename`).
+        :param limiter: A `ratelimit.RateLimiter` to make this student's
+                        requests to the portal through (usually, shared with
+                        all the other students).
+        :param digest: A `digest.Digest` to collect this student's messages
+                       in, to be sent combined with other messages for the
+                       same channels (also through the outbox, if any), or
+                       None to send each message on its own.
+        :param stream: Whether to stop downloading results pages once the
+                       results have come in (see `scrape.read_content`).
+        """
+        self.username = username
+        self.password = password
+        self.notifier = notifier
+        if results_filename is None:
+            results_filename = f"results-{username}.txt"
+        self.results_filename = results_filename
+        self.degrees_to_watch = degrees_to_watch
+        self.default_degree_name = default_degree_name
+        self.parser = parser
+        self.sessions = sessions
+        self.base_url = base_url
+        self.outbox = outbox
+        if store is None:
+            store = FileStore()
+        self.store = store
+        self.limiter = limiter
+        self.digest = digest
+        self.stream = stream
+
+    def __repr__(self):
+        return f"Account({self.username!r})"
+
+
+def load_accounts(filename, notify_concurrently=False, notify_timeout=None,
+        **options):
+    """
+    Load a list of accounts from a JSON accounts file. The file should contain
+    a list of objects like the following (only "username" and "password" are
+    required; by default, each student gets a self-email):
+
+        {
+            "username": "mfarrugia",
+            "password": "hunter2",
+            "results_filename": "results-mfarrugia.txt",
+            "degrees": [0],
+            "notifiers": [
+                {"method": "email"},
+                {"method": "slack", "hook_url": "https://hooks.slack.com/..."}
+            ]
+        }
+
+    Each notifier object names a method from NOTIFIER_METHODS, and the rest of
+    its keys are passed as keyword arguments to that notifier's constructor
+    (except for an optional "timeout", see below).
+
+    If `notify_concurrently` is True, each student's notification methods are
+    all triggered at once, and each is given `notify_timeout` seconds (or its
+    own "timeout", if it has one) to send the message before it is counted as
+    failed.
+
+    Notifier objects that are exactly the same (e.g. a Slack webhook shared by
+    the whole cohort) make one notifier, shared by all of those students, so
+    that a `digest.Digest` can combine their messages.
+
+    Any other keyword arguments (e.g. `parser`, `sessions`, `base_url`,
+    `limiter` or `stream`) are passed on to every `Account`.
+    """
+    with open(filename) as accountsfile:
+        entries = json.load(accountsfile)
+    return make_accounts(entries, notify_concurrently, notify_timeout,
+        **options)
+
+
+def make_accounts(entries, notify_concurrently=False, notify_timeout=None,
+        cache=None, **options):
+    """
+    Make accounts from a list of accounts file objects (see `load_accounts`).
+
+    :param cache: A dict of notifiers to share with these accounts (see
+                  `make_notifier`), e.g. to add accounts to a running cohort
+                  whose messages are combined in a digest.
+    """
+    accounts = []
+    if cache is None:
+        cache = {}
+    for entry in entries:
+        username = check_username(entry["username"])
+        password = entry["password"]
+        notifier = MultiNotifier(concurrent=notify_concurrently,
+            timeout=notify_timeout)
+        for spec in entry.get("notifiers", [{"method": "email"}]):
+            spec = dict(spec)
+            timeout = spec.pop("timeout", None)
+            notifier.add_notifier(make_notifier(username, password, spec,
+                cache), timeout=timeout)
+        degrees = entry.get("degrees", "all")
+        if degrees != "all":
+            degrees = set(degrees)
+        accounts.append(Account(username, password, notifier,
+            results_filename=entry.get("results_filename"),
+            degrees_to_watch=degrees,
+            default_degree_name=entry.get("default_degree_name", "degree"),
+            **options))
+    return accounts
+
+
+def check_username(username):
+    """
+    :return: The username, if it's safe to use in file names.
+    :raises ValueError: If it isn't.
+    """
+    if not isinstance(username, str) \
+            or not USERNAME_PATTERN.fullmatch(username) \
+            or username in {".", ".."}:
+        raise ValueError(f"Invalid username {username!r} (use only letters, "
+            "digits, '.', '_' and '-')")
+    return username
+
+
+def make_notifier(username, password, spec, cache=None):
+    """
+    Construct a notifier from an accounts file notifier object (see
+    `load_accounts`), importing its module on demand.
+
+    :param cache: A dict of the notifiers made so far (by their complete
+                  constructor arguments), to reuse rather than duplicate.
+    """
+    kwargs = dict(spec)
+    method = kwargs.pop("method")
+    if method not in NOTIFIER_METHODS:
+        raise ValueError(f"Unknown notification method {method!r} "
+            f"for account {username!r}")
+    module_name, class_name = NOTIFIER_METHODS[method]
+    if method in {"email", "email_oauth"}:
+        # like the single-student script, default to a self-email
+        kwargs.setdefault("address", f"{username}@{STUDENT_EMAIL_DOMAIN}")
+    if method == "email":
+        kwargs.setdefault("password", password)
+        # (the "timeout" in the spec is the deadline for the whole message,
+        # so wait on the server as long as the HTTP notifiers wait for a
+        # response, see `notify.connections.set_timeout`)
+        kwargs["timeout"] = connections.TIMEOUT[1]
+    key = json.dumps([method, kwargs], sort_keys=True)
+    if cache is not None and key in cache:
+        return cache[key]
+    module = importlib.import_module(module_name)
+    notifier = getattr(module, class_name)(**kwargs)
+    if cache is not None:
+        cache[key] = notifier
+    return notifier
+
+
+def poll_and_notify(account):
+    """
+    Check for updated results, and send a notification if a change is detected.
+
+    :return: True if a change was detected, otherwise False.
+    """
+    metrics.count("polls_total")
+    try:
+        with metrics.timer("poll_seconds"):
+            return poll(account)
+    except Exception:
+        metrics.count("poll_failures_total")
+        raise
+
+
+def poll(account):
+    """The guts of `poll_and_notify`."""
+    # load the previous results from the store
+    with metrics.timer("stage_seconds", stage="load"):
+        old_results = account.store.load(account)
+    if not old_results:
+        # the first run, there probably won't be any stored results
+        # imagine a default
+        old_results = {account.default_degree_name: Transcript()}
+
+    # check the results page for the latest results. results pages which
+    # haven't changed since last time come back as the old results themselves
+    with metrics.timer("stage_seconds", stage="scrape"):
+        if account.sessions is None:
+            new_results = scrape(account, previous=old_results)
+        else:
+            with account.sessions.use(account.username) as session:
+                new_results = scrape(account, session, previous=old_results)
+
+    # compare the results for each degree:
+    degrees = new_results.keys() | old_results.keys()
+    updated = []
+    found = False
+    for degree in degrees:
+        if degree not in new_results:
+            # maybe by error, the degree seems to have been removed
+            # this is more likely to have been a scraper error than an actual
+            # change, so we'll ignore it, and forward the old results
+            print("Missing results for", degree)
+            new_results[degree] = old_results[degree] 
+        elif new_results[degree] is old_results.get(degree):
+            # the results page hasn't changed at all. ignore it!
+            print("No change for", degree)
+        elif degree not in old_results:
+            # still unlikely during results period; but a new degree has
+            # appeared! send the initialisation message
+            print("Found new results for", degree)
+            metrics.count("changes_detected_total")
+            found = True
+            results = new_results[degree]
+            send(account, messages.initial_message(degree, results),
+                change_key(None, results))
+        elif no_results(new_results[degree]):
+            # maybe by error, the degree seems to have had its data removed
+            # this is more likely to have been a scraper error than an actual
+            # change, so we'll ignore it, and forward the old results
+            print("Missing results for", degree)
+            new_results[degree] = old_results[degree]
+            # note: in the case where there were just no results yet, this
+            # will behave correctly by not notifying the user
+        else:
+            # more likely, we have seen the degree before, but the results may
+            # have changed (we'll compare all such degrees together, below)
+            updated.append(degree)
+
+    pairs = [(old_results[degree], new_results[degree]) for degree in updated]
+    with metrics.timer("stage_seconds", stage="diff"):
+        diffs = diff_all(pairs)
+    for degree, changes in zip(updated, diffs):
+        if not changes.is_empty():
+            # send a notification with the difference
+            print("Found updated results for", degree)
+            metrics.count("changes_detected_total")
+            found = True
+            send(account, messages.update_message(degree, changes),
+                change_key(old_results[degree], new_results[degree]))
+        else:
+            # no change to results for this degree (though the page did
+            # change somehow, so we'll save its new fingerprint). ignore it!
+            print("No change for", degree)
+
+    # update the stored results for next time (unless nothing changed at all)
+    changed = [d for d in new_results if new_results[d] is not old_results.get(d)]
+    if changed:
+        with metrics.timer("stage_seconds", stage="save"):
+            account.store.save(account, new_results, changed)
+    return found
+
+
+def send(account, message, change=None):
+    """
+    Send a (subject, text) message to an account's student, via their digest
+    or outbox if they have one, or otherwise directly through their notifier.
+
+    :param change: Identifies the change the message reports (see
+                   `change_key`), so that the outbox can tell a repeat of
+                   the message from a new change.
+    """
+    if account.digest is not None:
+        account.digest.add(account, *message, change=change)
+    elif account.outbox is not None:
+        account.outbox.enqueue(account, *message, change=change)
+    else:
+        account.notifier.notify(*message)
+
+
+def change_key(old, new):
+    """
+    :return: A hash identifying a change from the `old` results (None for
+             none) to the `new` ones (ignoring the pages' fingerprints).
+    """
+    old = None if old is None else (old.wam, tuple(old.results))
+    new = (new.wam, tuple(new.results))
+    return hashlib.sha256(repr((old, new)).encode()).hexdigest()
+
+
+def no_results(results):
+    """Are these results empty (no WAM, and no subject results)?"""
+    return results.wam is None and not results.results
+
+
+def scrape(account, session=None, previous=None):
+    """Scrape the latest results for an account."""
+    forms = account.sessions.forms if account.sessions is not None else None
+    return scrape_results(account.username, account.password,
+        degrees_to_watch=account.degrees_to_watch,
+        default_degree_name=account.default_degree_name,
+        parser=account.parser,
+        session=session,
+        previous=previous,
+        base_url=account.base_url,
+        limiter=account.limiter,
+        stream=account.stream,
+        forms=forms)
+
+
+def sweep(accounts, task=poll_and_notify, max_workers=8):
+    """
+    Run `task` (by default, a results check) for every account, using a pool
+    of at most `max_workers` threads, so that a sweep of the whole cohort
+    takes roughly as long as the slowest account rather than all of them.
+
+    Accounts' checks are safe to run side by side. Each account's results
+    are its own (in its own results file, or its own rows of a shared
+    `store.SQLiteStore`, which takes a lock around each transaction), and
+    everything else that accounts may share is locked where it needs to be:
+    notifiers shared by several accounts (see `make_accounts`, e.g. an SMTP
+    notifier locks its connection), the outbox, the digest, the session
+    manager and the rate limiter.
+
+    :return: A dict mapping each account whose task raised an exception to
+             that exception (empty if every task succeeded).
+    """
+    failures = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {account: pool.submit(task, account) for account in accounts}
+        for account, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                failures[account] = e
+    print(f"{len(accounts)-len(failures)} accounts checked, "
+        f"{len(failures)} failed.")
+    return failures
+
+
+def notify_all(accounts, subject, text, max_workers=8):
+    """
+    Send a message (e.g. a test message) to every account's student, but
+    only once through each notifier, so that a notifier shared by several
+    accounts (e.g. a Slack webhook for the whole cohort, see
+    `make_accounts`) gets one copy rather than one per account.
+
+    :return: A dict mapping each account whose message failed to the
+             exception (see `sweep`).
+    """
+    seen = set()
+    senders = {}
+    for account in accounts:
+        multi = account.notifier
+        sender = MultiNotifier(concurrent=getattr(multi, "concurrent", False),
+            timeout=getattr(multi, "timeout", None))
+        for notifier in getattr(multi, "notifiers", [multi]):
+            if notifier not in seen:
+                seen.add(notifier)
+                sender.add_notifier(notifier,
+                    timeout=getattr(multi, "timeouts", {}).get(notifier))
+        if sender.notifiers:
+            senders[account] = sender
+    return sweep(list(senders), lambda account: senders[account].notify(
+        subject, text), max_workers=max_workers)
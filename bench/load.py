@@ -0,0 +1,127 @@
+"""
+load test the whole checking pipeline against the stand-in portal
+
+usage: python3 -m bench.load [--base-url http://127.0.0.1:8080]
+                             [--students 1000] [--workers 64] [--sweeps 3]
+                             [--rate N] [--in-flight N] [--error-rate P]
+                             [--stream] [--tail-bytes N] [--hedge]
+                             [--record FILE | --replay FILE]
+
+with --serve, a stand-in portal (see bench/portal.py) is started in-process
+instead of connecting to a separately running one. with --record, all of the
+traffic is recorded to a cassette (see cassette.py), and with --replay, a
+recorded cassette is played back instead of connecting to any portal at all
+(so that versions of the script can be compared on identical traffic)
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import contextlib
+
+import metrics
+from accounts import Account, sweep, poll_and_notify
+from session import SessionManager
+from cassette import Cassette
+from extract import start_workers
+from ratelimit import RateLimiter
+from bench.portal import Cohort, Portal, PASSWORD
+from bench.run import NullNotifier, Sink
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8080")
+    parser.add_argument("--students", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=64)
+    parser.add_argument("--sweeps", type=int, default=3)
+    parser.add_argument("--parser", default="fast",
+        help="extraction backend (BS4_PARSER) to use")
+    parser.add_argument("--serve", action="store_true",
+        help="run a stand-in portal in-process (at --base-url's port)")
+    parser.add_argument("--latency", type=float, default=0.05,
+        help="(with --serve) seconds of delay before every response")
+    parser.add_argument("--jitter", type=float, default=0,
+        help="(with --serve) up to this many more seconds of random delay")
+    parser.add_argument("--error-rate", type=float, default=0,
+        help="(with --serve) fraction of requests to answer with a 503")
+    parser.add_argument("--rate", type=float,
+        help="limit on requests per second to the portal")
+    parser.add_argument("--in-flight", type=int,
+        help="limit on requests waiting on a response at once")
+    parser.add_argument("--hedge", action="store_true",
+        help="hedge slow requests for results pages")
+    parser.add_argument("--stream", action="store_true",
+        help="stop downloading results pages once the results are in")
+    parser.add_argument("--tail-bytes", type=int, default=0,
+        help="(with --serve) size of the script after the results on each "
+        "results page")
+    cassettes = parser.add_mutually_exclusive_group()
+    cassettes.add_argument("--record", metavar="FILE",
+        help="record the traffic to this cassette file")
+    cassettes.add_argument("--replay", metavar="FILE",
+        help="replay the traffic from this cassette file (no network)")
+    args = parser.parse_args()
+
+    # (any parser worker processes are started before the portal's threads)
+    start_workers(args.parser)
+    if args.serve:
+        port = int(args.base_url.rpartition(":")[2])
+        portal = Portal(("127.0.0.1", port), Cohort(args.students,
+            tail_bytes=args.tail_bytes),
+            latency=args.latency, jitter=args.jitter,
+            error_rate=args.error_rate)
+        threading.Thread(target=portal.serve_forever, daemon=True).start()
+
+    results_dir = tempfile.mkdtemp()
+    cassette = None
+    if args.record is not None:
+        cassette = Cassette(args.record, "record")
+    elif args.replay is not None:
+        cassette = Cassette(args.replay, "replay")
+    sessions = SessionManager(transport=cassette and cassette.adapter)
+    limiter = RateLimiter(rate=args.rate, burst=args.rate or 1,
+        max_in_flight=args.in_flight, hedge=args.hedge)
+    accounts = [Account(f"student{i:05d}", PASSWORD, NullNotifier(),
+            results_filename=f"{results_dir}/student{i:05d}.txt",
+            parser=args.parser, sessions=sessions, base_url=args.base_url,
+            limiter=limiter, stream=args.stream)
+        for i in range(args.students)]
+
+    report = []
+    for n in range(args.sweeps):
+        downloaded = downloaded_bytes()
+        latencies = []
+        def check(account):
+            start = time.perf_counter()
+            try:
+                poll_and_notify(account)
+            finally:
+                latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(Sink()):
+            failures = sweep(accounts, task=check, max_workers=args.workers)
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        report.append({"sweep": n, "accounts": len(accounts),
+            "failures": len(failures), "seconds": elapsed,
+            "accounts_per_second": len(accounts) / elapsed,
+            "bytes_downloaded": downloaded_bytes() - downloaded,
+            "p50_poll_seconds": latencies[len(latencies) // 2],
+            "p99_poll_seconds": latencies[int(len(latencies) * 0.99)]})
+        print(json.dumps(report[-1]), file=sys.stderr)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+def downloaded_bytes():
+    return metrics.METRICS.counters.get(("bytes_downloaded_total", ()), 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+synthetic (but realistically shaped) my.unimelb pages for benchmarking and
+load testing, standing in for real, personal results pages
+
+run `python3 -m bench.pages` to regenerate the fixture files in
+bench/fixtures from these templates
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import os
+import html
+import random
+import base64
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+GRADES = [("H1", 80, 100), ("H2A", 75, 79), ("H2B", 70, 74), ("H3", 65, 69),
+    ("P", 50, 64), ("N", 0, 49)]
+PERIODS = ["Summer Term", "Semester 1", "Winter Term", "Semester 2"]
+SUBJECT_NAMES = ["Algorithms and Complexity", "Models of Computation",
+    "Declarative Programming", "Programming Language Implementation",
+    "Foundations of Algorithms", "Linear Algebra", "Real Analysis",
+    "Probability", "Statistics", "Principles of Finance", "Discrete Maths",
+    "Artificial Intelligence", "Distributed Systems", "Computer Systems"]
+
+
+def page(title, content, viewstate_bytes=8000, seed=0, tail_bytes=0):
+    """
+    Wrap some page content in the ASP.NET boilerplate of the student portal,
+    including a (random, incompressible) __VIEWSTATE of the given size, and
+    optionally a script of (about) `tail_bytes` bytes after the content, like
+    the client-side state that follows the content on some pages.
+    """
+    rng = random.Random(seed)
+    viewstate = base64.b64encode(rng.randbytes(viewstate_bytes)).decode()
+    validation = base64.b64encode(rng.randbytes(64)).decode()
+    tail = ""
+    if tail_bytes:
+        tail = ('\n<script type="text/javascript">\n//<![CDATA[\nvar state = "'
+            + base64.b64encode(rng.randbytes(tail_bytes * 3 // 4)).decode()
+            + '";\n//]]>\n</script>')
+    return f"""<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head><title>{html.escape(title)}</title>
+<link href="/student/styles/main.css" rel="stylesheet" type="text/css" />
+<style type="text/css">.UMWAMText {{ font-size: 1.2em; }}</style>
+<script type="text/javascript">
+//<![CDATA[
+var theForm = document.forms['aspnetForm'];
+function __doPostBack(eventTarget, eventArgument) {{
+    if (!theForm.onsubmit || (theForm.onsubmit() != false)) {{
+        theForm.__EVENTTARGET.value = eventTarget;
+        theForm.__EVENTARGUMENT.value = eventArgument;
+        theForm.submit();
+    }}
+}}
+//]]>
+</script>
+</head>
+<body>
+<form name="aspnetForm" method="post" action="ResultsDtls10.aspx?f=%24S1.EST.RSLTDTLS.WEB" id="aspnetForm">
+<div>
+<input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="" />
+<input type="hidden" name="__EVENTARGUMENT" id="__EVENTARGUMENT" value="" />
+<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{viewstate}" />
+</div>
+<div id="header"><ul class="nav">
+<li><a href="/student/Default.aspx">Home</a></li>
+<li><a href="/student/SM/ResultsDtls10.aspx?f=$S1.EST.RSLTDTLS.WEB">Results</a></li>
+<li><a href="/student/Logout.aspx">Log out</a></li>
+</ul></div>
+<div id="content">
+<h1 id="ctl00_h1PageTitle">{html.escape(title)}</h1>
+{content}
+</div>{tail}
+<div>
+<input type="hidden" name="__VIEWSTATEGENERATOR" id="__VIEWSTATEGENERATOR" value="5A3B2C1D" />
+<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="{validation}" />
+</div>
+</form>
+<div id="footer"><p>&copy; The University of Melbourne</p></div>
+</body>
+</html>
+"""
+
+
+def login_page(errors=False, **kwargs):
+    """The login form, optionally showing login validation errors."""
+    content = ""
+    if errors:
+        content += ('<div id="ctl00_Content_valErrors" class="UMErrors">'
+            '<ul><li>Your login attempt was not successful. Please try again.'
+            '</li></ul></div>\n')
+    content += """<table class="UMLogin">
+<tr><td>Username</td><td><input name="ctl00$Content$txtUserName$txtText" type="text" id="ctl00_Content_txtUserName_txtText" /></td></tr>
+<tr><td>Password</td><td><input name="ctl00$Content$txtPassword$txtText" type="password" id="ctl00_Content_txtPassword_txtText" /></td></tr>
+<tr><td></td><td><a id="ctl00_Content_cmdLogin" href="javascript:__doPostBack('ctl00$Content$cmdLogin','')">Login</a></td></tr>
+</table>"""
+    return page("Login", content, **kwargs)
+
+
+def plans_page(degree_names, **kwargs):
+    """The "Choose a Study Plan" page, listing a student's degrees."""
+    rows = "".join(f"""<tr class="{"UMGridRow" if i % 2 == 0 else "UMGridAltRow"}">
+<td><a href="javascript:__doPostBack('ctl00$Content$grdResultPlans','ViewResults${i}')">View Results</a></td><td>{1000 + i}</td><td>{html.escape(name)}</td><td>Admitted</td>
+</tr>
+""" for i, name in enumerate(degree_names))
+    content = f"""<table class="UMGrid" cellspacing="0" border="0" id="ctl00_Content_grdResultPlans" style="border-collapse:collapse;">
+<tr class="UMGridHeader"><th scope="col">&nbsp;</th><th scope="col">Code</th><th scope="col">Study Plan</th><th scope="col">Status</th></tr>
+{rows}</table>"""
+    return page("Results > Choose a Study Plan", content, **kwargs)
+
+
+def results_page(wam, results, **kwargs):
+    """
+    A degree's results page.
+
+    :param wam: The WAM text, or None for no WAM yet.
+    :param results: A list of result rows (see `random_results`), or None for
+                    no results table at all.
+    """
+    content = ""
+    if wam is not None:
+        content += (f'<p class="UMWAMText">Your Weighted Average Mark (WAM) '
+            f'is: <b>{wam}</b></p>\n')
+    if results is not None:
+        rows = "".join(f"""<tr class="{"UMGridRow" if i % 2 == 0 else "UMGridAltRow"}">
+<td>{r["year"]}</td><td>{r["period"]}</td><td>{r["code"]}</td><td>{html.escape(r["name"])}</td><td>1</td><td>{r["mark"]}</td><td>{r["grade"]}</td><td>&nbsp;</td><td>{r["credits"]}</td>
+</tr>
+""" for i, r in enumerate(results))
+        content += f"""<table class="UMGrid" cellspacing="0" border="0" id="ctl00_Content_grdResultDetails" style="border-collapse:collapse;">
+<tr class="UMGridHeader"><th scope="col">Year</th><th scope="col">Study Period</th><th scope="col">Subject</th><th scope="col">Description</th><th scope="col">Version</th><th scope="col">Mark</th><th scope="col">Grade</th><th scope="col">Grade Input Date</th><th scope="col">Credit Points</th></tr>
+{rows}</table>"""
+    return page("Results > Results Details", content, **kwargs)
+
+
+def random_results(n, seed=0):
+    """Generate `n` plausible (anonymous) subject result rows."""
+    rng = random.Random(seed)
+    results = []
+    for i in range(n):
+        grade, low, high = rng.choice(GRADES)
+        results.append({
+            "year": str(2015 + i // 8),
+            "period": PERIODS[(i // 2) % len(PERIODS)],
+            "code": f"{rng.choice(['COMP', 'MAST', 'FNCE', 'SWEN'])}{rng.randint(10000, 99999)}",
+            "name": rng.choice(SUBJECT_NAMES) + (" & Lab" if i % 7 == 0 else ""),
+            "mark": str(rng.randint(low, high)),
+            "grade": grade,
+            "credits": rng.choice(["12.500", "25.000", "6.250"]),
+        })
+    return results
+
+
+def wam_of(results):
+    """The (credit-weighted) WAM of some result rows, formatted as text."""
+    total = sum(float(r["credits"]) for r in results)
+    if not total:
+        return None
+    return "{:.3f}".format(sum(int(r["mark"]) * float(r["credits"])
+        for r in results) / total)
+
+
+# the fixture corpus: name -> page content
+def fixtures():
+    corpus = {
+        "login": login_page(),
+        "login-errors": login_page(errors=True),
+        "plans": plans_page(["Bachelor of Science", "Diploma in Languages"]),
+        "results-nowam": results_page(None, random_results(2, seed=2)),
+        "results-none": results_page(None, None),
+    }
+    for n in [5, 50, 500]:
+        results = random_results(n, seed=n)
+        corpus[f"results-{n}"] = results_page(wam_of(results), results)
+    return corpus
+
+
+def load_fixture(name):
+    """Read a fixture page's raw content from bench/fixtures."""
+    with open(os.path.join(FIXTURES_DIR, f"{name}.html"), 'rb') as f:
+        return f.read()
+
+
+if __name__ == '__main__':
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    for name, content in fixtures().items():
+        path = os.path.join(FIXTURES_DIR, f"{name}.html")
+        print("Writing", path)
+        with open(path, 'w') as f:
+            f.write(content)
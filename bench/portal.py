@@ -0,0 +1,296 @@
+"""
+a local stand-in for the student portal, emulating the ASP.NET login and
+results page flow that the scraper relies on, for load testing without
+hammering the real thing
+
+usage: python3 -m bench.portal [--port 8080] [--students 1000] [...]
+                               [--write-accounts accounts-sim.json]
+
+then point the script at it by setting BASE_URL = "http://127.0.0.1:8080"
+(or run `python3 -m bench.load`). the simulated students are named
+student00000, student00001, ..., all with the password "password"
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import sys
+import json
+import time
+import random
+import secrets
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bench import pages
+
+
+RESULTS_PATH = "/student/sm/resultsdtls10.aspx"
+LOGIN_PATH = "/student/login.aspx"
+LOGIN_QUERY = ("f=$S1.EST.RSLTDTLS.WEB&ReturnUrl=%2fstudent%2fSM%2f"
+    "ResultsDtls10.aspx%3ff%3d%24S1.EST.RSLTDTLS.WEB")
+SESSION_COOKIE = "ASP.NET_SessionId"
+PASSWORD = "password"
+
+
+class Cohort:
+    """
+    The simulated students. Each student's transcript is generated on demand
+    from their number (so thousands of students cost almost no memory), and
+    their results are "released" one subject at a time as time passes.
+    """
+    def __init__(self, nstudents=1000, nsubjects=24, multi_every=5,
+            initial=None, release_interval=None, viewstate_bytes=8000,
+            tail_bytes=0):
+        """
+        :param nstudents: Number of students.
+        :param nsubjects: Number of subjects in each degree's transcript.
+        :param multi_every: Every this-many students has a double degree
+                            (0 for no double degree students).
+        :param initial: Number of subjects with published results at the
+                        start (default: all of them).
+        :param release_interval: Seconds between the release of each further
+                                 subject's result, per degree (default: no
+                                 releases, results never change).
+        :param viewstate_bytes: Size of each page's (random) __VIEWSTATE.
+        :param tail_bytes: Size of the (random) script following the results
+                           on each results page.
+        """
+        self.nstudents = nstudents
+        self.nsubjects = nsubjects
+        self.multi_every = multi_every
+        self.initial = nsubjects if initial is None else initial
+        self.release_interval = release_interval
+        self.viewstate_bytes = viewstate_bytes
+        self.tail_bytes = tail_bytes
+        self.start = time.monotonic()
+
+    def username(self, i):
+        return f"student{i:05d}"
+
+    def number(self, username):
+        """:return: The student's number, or None if there's no such student."""
+        if not username.startswith("student") or not username[7:].isdigit():
+            return None
+        i = int(username[7:])
+        return i if i < self.nstudents else None
+
+    def degrees(self, i):
+        if self.multi_every and i % self.multi_every == 0:
+            return ["Bachelor of Science", "Diploma in Languages"]
+        return ["Bachelor of Arts"]
+
+    def results(self, i, degree_index):
+        """The student's currently published results for one degree."""
+        results = pages.random_results(self.nsubjects,
+            seed=i * 10 + degree_index)
+        published = self.initial
+        if self.release_interval:
+            elapsed = time.monotonic() - self.start
+            published += int(elapsed // self.release_interval)
+        return results[:min(published, self.nsubjects)]
+
+    def results_page(self, i, degree_index):
+        results = self.results(i, degree_index)
+        return pages.results_page(pages.wam_of(results), results or None,
+            viewstate_bytes=self.viewstate_bytes, seed=random.random(),
+            tail_bytes=self.tail_bytes)
+
+
+class Portal(ThreadingHTTPServer):
+    """The stand-in portal server, holding the cohort and login sessions."""
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, cohort, latency=0.0, jitter=0.0,
+            error_rate=0.0):
+        """
+        :param address: (host, port) to listen on.
+        :param cohort: The simulated students.
+        :param latency: Seconds to wait before every response.
+        :param jitter: Up to this many more seconds of (uniformly random)
+                       extra waiting before every response.
+        :param error_rate: Probability of a response being a 503 error.
+        """
+        super().__init__(address, PortalHandler)
+        self.cohort = cohort
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.sessions = {}  # session id: logged in student's number (or None)
+        self.lock = threading.Lock()
+        self.requests = {"GET": 0, "POST": 0, "logins": 0, "errors": 0}
+
+    def count(self, kind):
+        with self.lock:
+            self.requests[kind] += 1
+
+    def handle_error(self, request, client_address):
+        # clients that stop reading part way through a page (see
+        # `scrape.read_content`) just hang up, which is fine
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class PortalHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # don't print a line for every request, there are going to be a lot
+        pass
+
+    def do_GET(self):
+        self.server.count("GET")
+        self.handle_page(form=None)
+
+    def do_POST(self):
+        self.server.count("POST")
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode()
+        form = {k: v[0] for k, v in parse_qs(body, keep_blank_values=True)
+            .items()}
+        self.handle_page(form)
+
+    def handle_page(self, form):
+        server = self.server
+        time.sleep(server.latency + random.uniform(0, server.jitter))
+        if random.random() < server.error_rate:
+            server.count("errors")
+            return self.respond(503, "<html><body>Service Unavailable"
+                "</body></html>", {"Retry-After": "1"})
+
+        session_id = self.session_id()
+        with server.lock:
+            student = server.sessions.get(session_id)
+        path = urlsplit(self.path).path.lower()
+        cohort = server.cohort
+
+        if path == LOGIN_PATH:
+            if form is None:
+                return self.respond(200, pages.login_page())
+            if "__VIEWSTATE" not in form or \
+                    form.get("__EVENTTARGET") != "ctl00$Content$cmdLogin":
+                return self.respond(400, "<html><body>Invalid postback"
+                    "</body></html>")
+            server.count("logins")
+            i = cohort.number(form.get("ctl00$Content$txtUserName$txtText", ""))
+            if i is None or form.get("ctl00$Content$txtPassword$txtText") \
+                    != PASSWORD:
+                return self.respond(200, pages.login_page(errors=True))
+            # a successful login starts a new session
+            session_id = secrets.token_hex(12)
+            with server.lock:
+                server.sessions[session_id] = i
+            return_url = parse_qs(urlsplit(self.path).query) \
+                .get("ReturnUrl", ["/student/SM/ResultsDtls10.aspx"])[0]
+            return self.redirect(unquote(return_url), session_id)
+
+        if path == RESULTS_PATH:
+            if student is None:
+                return self.redirect(f"/student/login.aspx?{LOGIN_QUERY}")
+            degrees = cohort.degrees(student)
+            if form is not None and \
+                    form.get("__EVENTTARGET") == "ctl00$Content$grdResultPlans":
+                argument = form.get("__EVENTARGUMENT", "")
+                index = argument.rpartition("$")[2]
+                if not argument.startswith("ViewResults$") or \
+                        not index.isdigit() or int(index) >= len(degrees):
+                    return self.respond(400, "<html><body>Invalid postback"
+                        "</body></html>")
+                return self.respond(200, cohort.results_page(student,
+                    int(index)))
+            if len(degrees) > 1:
+                return self.respond(200, pages.plans_page(degrees,
+                    viewstate_bytes=cohort.viewstate_bytes,
+                    seed=random.random()))
+            return self.respond(200, cohort.results_page(student, 0))
+
+        self.respond(404, "<html><body>Not Found</body></html>")
+
+    def session_id(self):
+        for cookie in self.headers.get_all("Cookie", []):
+            for part in cookie.split(";"):
+                name, _, value = part.strip().partition("=")
+                if name == SESSION_COOKIE:
+                    return value
+        return None
+
+    def redirect(self, location, session_id=None):
+        headers = {"Location": location}
+        if session_id is not None:
+            headers["Set-Cookie"] = f"{SESSION_COOKIE}={session_id}; " \
+                "path=/; HttpOnly"
+        self.respond(302, "<html><body>Object moved</body></html>", headers)
+
+    def respond(self, status, content, headers={}):
+        body = content.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def write_accounts(filename, cohort, log_filename):
+    """
+    Write an accounts file (see `accounts.load_accounts`) for the simulated
+    cohort, with everyone notified via one shared log file.
+    """
+    accounts = [{
+        "username": cohort.username(i),
+        "password": PASSWORD,
+        "results_filename": f"results-sim/{cohort.username(i)}.txt",
+        "notifiers": [{"method": "logfile", "filepath": log_filename}],
+    } for i in range(cohort.nstudents)]
+    with open(filename, 'w') as f:
+        json.dump(accounts, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--students", type=int, default=1000)
+    parser.add_argument("--subjects", type=int, default=24,
+        help="subjects per degree")
+    parser.add_argument("--multi-every", type=int, default=5,
+        help="every this-many students has a double degree (0 for none)")
+    parser.add_argument("--initial", type=int,
+        help="subjects with results at the start (default: all)")
+    parser.add_argument("--release-interval", type=float,
+        help="seconds between releases of each further subject's result")
+    parser.add_argument("--latency", type=float, default=0.0,
+        help="seconds of delay before every response")
+    parser.add_argument("--jitter", type=float, default=0.0,
+        help="up to this many seconds of random extra delay")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+        help="probability of responding with a 503 error")
+    parser.add_argument("--viewstate-bytes", type=int, default=8000)
+    parser.add_argument("--tail-bytes", type=int, default=0,
+        help="size of the script after the results on each results page")
+    parser.add_argument("--write-accounts", metavar="FILE",
+        help="write an accounts file for the simulated students and exit")
+    args = parser.parse_args()
+
+    cohort = Cohort(args.students, args.subjects, args.multi_every,
+        args.initial, args.release_interval, args.viewstate_bytes,
+        args.tail_bytes)
+    if args.write_accounts:
+        write_accounts(args.write_accounts, cohort, "notifications-sim.log")
+        print("Wrote", args.students, "accounts to", args.write_accounts)
+        return
+
+    portal = Portal((args.host, args.port), cohort, args.latency,
+        args.jitter, args.error_rate)
+    print(f"Stand-in portal listening on http://{args.host}:{args.port}")
+    try:
+        portal.serve_forever()
+    except KeyboardInterrupt:
+        print("Served", portal.requests)
+
+
+if __name__ == '__main__':
+    main()
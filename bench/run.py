@@ -0,0 +1,370 @@
+"""
+offline benchmarks for the scraping, extraction, diffing and notification
+pipeline, using the synthetic pages in bench/fixtures (no network needed)
+
+usage: python3 -m bench.run [--backends html.parser fast ...] [--repeat N]
+                            [--only NAME] [--output FILE] [--compare FILE]
+
+results are written as JSON (to stdout, or to --output), so that runs from
+different versions, or with different parser backends, can be compared with
+--compare
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import os
+import sys
+import json
+import time
+import timeit
+import argparse
+import platform
+import tempfile
+import contextlib
+import statistics
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import diff
+import messages
+import extract
+from accounts import Account, poll_and_notify
+from bench.pages import load_fixture
+
+
+DEFAULT_BACKENDS = ["html.parser", "lxml", "fast", "stream"]
+SIZES = [5, 50, 500]
+FIXTURES = ["login", "login-errors", "plans", "results-none",
+    "results-nowam"] + [f"results-{n}" for n in SIZES]
+
+
+class Sink:
+    """A stdout replacement that discards the (many) progress messages."""
+    def write(self, text):
+        pass
+    def flush(self):
+        pass
+
+
+class FixtureResponse:
+    def __init__(self, content):
+        self.content = content
+        self.status_code = 200
+        self.headers = {}
+
+
+class FixtureSession:
+    """
+    Stands in for a logged-in `requests.Session`, serving fixture pages: GETs
+    get the next of `get_pages`, and POSTs (degree postbacks) get the next of
+    `post_pages`, in a cycle.
+    """
+    def __init__(self, get_pages, post_pages=()):
+        self.get_pages = list(get_pages)
+        self.post_pages = list(post_pages)
+        self.ngets = 0
+        self.nposts = 0
+
+    def get(self, url, **kwargs):
+        page = self.get_pages[self.ngets % len(self.get_pages)]
+        self.ngets += 1
+        return FixtureResponse(page)
+
+    def post(self, url, data=None, **kwargs):
+        page = self.post_pages[self.nposts % len(self.post_pages)]
+        self.nposts += 1
+        return FixtureResponse(page)
+
+
+class FixtureSessions:
+    """Stands in for a `session.SessionManager`, always using one session."""
+    def __init__(self, session):
+        self.session = session
+        self.forms = None
+
+    @contextlib.contextmanager
+    def use(self, username):
+        yield self.session
+
+
+class NullNotifier:
+    def __init__(self):
+        self.nsent = 0
+
+    def notify(self, subject, text):
+        self.nsent += 1
+
+
+def measure(fn, repeat):
+    """
+    Time `fn`, calling it enough times per sample for the sample to take at
+    least 0.2 seconds, and taking `repeat` samples.
+
+    :return: A dict of per-call timing statistics (in milliseconds).
+    """
+    timer = timeit.Timer(fn)
+    with contextlib.redirect_stdout(Sink()):
+        number, _ = timer.autorange()
+        samples = [t / number * 1000 for t in timer.repeat(repeat, number)]
+    return {
+        "calls": number * repeat,
+        "min_ms": min(samples),
+        "median_ms": statistics.median(samples),
+        "mean_ms": statistics.mean(samples),
+    }
+
+
+def available_backends(backends):
+    usable = []
+    for backend in backends:
+        try:
+            extract.get_extractor(backend).read(b"<html></html>")
+        except Exception as e:
+            print(f"Skipping backend {backend}: {e}", file=sys.stderr)
+            continue
+        usable.append(backend)
+    return usable
+
+
+def disagreements(backends):
+    """
+    Read every fixture with every backend, so that a backend that's fast
+    because it's wrong doesn't go unnoticed.
+
+    :return: A list of (fixture, backend, attribute) for each attribute of a
+             `Page` that differs from what the first backend read.
+    """
+    found = []
+    if not backends:
+        return found
+    for fixture in FIXTURES:
+        content = load_fixture(fixture)
+        pages = {}
+        with contextlib.redirect_stdout(Sink()):
+            for backend in backends:
+                page = extract.get_extractor(backend).read(content)
+                pages[backend] = {**vars(page), "results": page.results()}
+        expected = pages[backends[0]]
+        for backend in backends[1:]:
+            found.extend((fixture, backend, attribute)
+                for attribute, value in pages[backend].items()
+                if value != expected[attribute])
+    return found
+
+
+def transcript_pair(n):
+    """
+    Old and new `Transcript`s for an n-subject transcript, where the new one
+    has a changed mark, a new subject, and a removed subject.
+    """
+    with contextlib.redirect_stdout(Sink()):
+        page = extract.get_extractor("fast").read(load_fixture(f"results-{n}"))
+        new = page.results()
+    results = list(new.results)
+    results[0] = results[0]._replace(mark="0", grade="N")
+    results.append(results.pop(1))
+    old = new._replace(results=tuple(results))
+    new = new._replace(wam="99.000", results=new.results[:-1])
+    return old, new
+
+
+# # #
+# the benchmarks. each yields (name, params, fn) triples to be timed
+#
+
+def bench_parse_page(backends):
+    for backend in backends:
+        extractor = extract.get_extractor(backend)
+        for fixture in ["results-none", "results-nowam"] + \
+                [f"results-{n}" for n in SIZES]:
+            content = load_fixture(fixture)
+            yield "parse_page", {"backend": backend, "fixture": fixture}, \
+                lambda: extractor.read(content).results()
+
+
+def bench_hidden_fields(backends):
+    for backend in backends:
+        extractor = extract.get_extractor(backend)
+        for fixture in ["login", "plans"]:
+            content = load_fixture(fixture)
+            yield "hidden_fields", {"backend": backend, "fixture": fixture}, \
+                lambda: extractor.read(content).hidden_fields
+
+
+def bench_parse_sweep(backends):
+    # a sweep's worth of results pages, read by many checking threads at once,
+    # in the threads themselves or in a pool of worker processes
+    content = load_fixture("results-500")
+    for backend in backends:
+        for mode in [backend, extract.PROCESSES_PREFIX + backend]:
+            extractor = extract.get_extractor(mode)
+            # (start any workers here, before the sweep's threads)
+            extract.start_workers(mode)
+            yield "parse_sweep", {"backend": backend, "processes":
+                mode != backend, "pages": 64, "cores": os.cpu_count()}, \
+                lambda: parse_sweep(extractor, content, 64)
+            if mode != backend:
+                # (one pool at a time, so that the next is forked cleanly)
+                extractor.stop()
+
+
+def parse_sweep(extractor, content, pages, max_workers=16):
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        list(pool.map(extractor.read_transcript, [content] * pages))
+
+
+def bench_results_diff(backends):
+    for n in SIZES:
+        old, new = transcript_pair(n)
+        yield "results_diff", {"size": n}, \
+            lambda: diff.diff(old, new)
+
+
+def bench_cohort_diff(backends):
+    for n in SIZES:
+        # a sweep of 1000 students, of whom one in 20 has an update (and the
+        # rest have had their pages re-read, finding the same results)
+        old, new = transcript_pair(n)
+        same = new._replace(results=tuple(list(new.results)))
+        pairs = [(old, new) if i % 20 == 0 else (new, same)
+            for i in range(1000)]
+        yield "cohort_diff", {"size": n, "students": len(pairs)}, \
+            lambda: diff.diff_all(pairs)
+
+
+def bench_update_message(backends):
+    for n in SIZES:
+        changes = diff.diff(*transcript_pair(n))
+        yield "update_message", {"size": n}, \
+            lambda: messages.update_message("degree", changes)
+
+
+def bench_flatten_results(backends):
+    for n in SIZES:
+        _, new = transcript_pair(n)
+        yield "flatten_results", {"size": n}, \
+            lambda: messages.flatten_results(new)
+
+
+def bench_poll_and_notify(backends):
+    for backend in backends:
+        for n in SIZES:
+            page = load_fixture(f"results-{n}")
+            other = load_fixture(f"results-{n}").replace(b"<b>", b"<b>1", 1)
+            for case, session in [
+                    # nothing changes (the steady state)
+                    ("unchanged", FixtureSession([page])),
+                    # the page alternates, so every poll finds an update
+                    ("changed", FixtureSession([page, other])),
+                    # a double-degree student, nothing changing
+                    ("multi", FixtureSession([load_fixture("plans")],
+                        [page, load_fixture("results-5")]))]:
+                yield "poll_and_notify", \
+                    {"backend": backend, "size": n, "case": case}, \
+                    poll_fixture(session, backend)
+
+
+def poll_fixture(session, backend):
+    """Make an end-to-end poll function for a fixture session."""
+    results_dir = tempfile.mkdtemp()
+    account = Account("student", "password", NullNotifier(),
+        results_filename=os.path.join(results_dir, "results.txt"),
+        parser=backend, sessions=FixtureSessions(session))
+    # the first poll establishes the stored results
+    with contextlib.redirect_stdout(Sink()):
+        poll_and_notify(account)
+    return lambda: poll_and_notify(account)
+
+
+def bench_startup(backends):
+    # how long until a one-shot (e.g. cron) run is ready to start checking
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for name, code in [("python", "pass"), ("headless", "import headless")]:
+        yield "startup", {"script": name}, \
+            lambda code=code: subprocess.run([sys.executable, "-c", code],
+                cwd=root, check=True)
+
+
+BENCHMARKS = [bench_parse_page, bench_hidden_fields, bench_parse_sweep,
+    bench_results_diff, bench_cohort_diff, bench_update_message,
+    bench_flatten_results, bench_poll_and_notify, bench_startup]
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def key(result):
+    return (result["benchmark"],) + tuple(sorted(result["params"].items()))
+
+
+def compare(results, baseline_filename):
+    """Print each benchmark's speed-up relative to a previous run."""
+    with open(baseline_filename) as f:
+        baseline = {key(r): r for r in json.load(f)["results"]}
+    for result in results:
+        before = baseline.get(key(result))
+        if before is None:
+            continue
+        ratio = before["median_ms"] / result["median_ms"]
+        params = " ".join(f"{k}={v}" for k, v in result["params"].items())
+        print(f"{result['benchmark']:>16} {params:<48} {ratio:6.2f}x",
+            file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backends", nargs="+", default=DEFAULT_BACKENDS,
+        help="extraction backends (BS4_PARSER values) to benchmark")
+    parser.add_argument("--repeat", type=int, default=5,
+        help="number of timing samples per benchmark")
+    parser.add_argument("--only", action="append",
+        help="only run the named benchmark(s), e.g. parse_page")
+    parser.add_argument("--output", help="write the JSON results here")
+    parser.add_argument("--compare", help="JSON results of a previous run "
+        "to compare against")
+    args = parser.parse_args()
+
+    backends = available_backends(args.backends)
+    wrong = disagreements(backends)
+    if wrong:
+        for fixture, backend, attribute in wrong:
+            print(f"Backend {backend} disagrees with {backends[0]} about "
+                f"{attribute} on fixture {fixture}", file=sys.stderr)
+        sys.exit(1)
+    results = []
+    for benchmark in BENCHMARKS:
+        for name, params, fn in benchmark(backends):
+            if args.only and name not in args.only:
+                continue
+            stats = measure(fn, args.repeat)
+            results.append({"benchmark": name, "params": params, **stats})
+            print(f"{name:>16} {json.dumps(params):<60} "
+                f"{stats['median_ms']:10.4f} ms", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backends": backends,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
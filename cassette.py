@@ -0,0 +1,408 @@
+"""
+record the HTTP traffic of real checks (to the student portal, and from the
+notifiers) to a cassette file, with credentials redacted, and replay it later
+at full speed without touching the network: for profiling and benchmarking
+against real page shapes offline, reproducing parser breakage from a captured
+page, and comparing versions on identical traffic
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import io
+import re
+import json
+import time
+import base64
+import hashlib
+import itertools
+import threading
+from http.client import HTTPMessage
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3 import HTTPResponse
+from urllib3._collections import HTTPHeaderDict
+
+
+# headers, form fields and query parameters whose names match this hold
+# credentials, so their values are never written to a cassette
+SENSITIVE = re.compile(r"auth|cookie|token|key|secret|pass|session", re.I)
+# form fields and query parameters also can't give away who the student is
+SENSITIVE_FIELDS = re.compile(SENSITIVE.pattern + r"|user", re.I)
+
+# form fields whose values change from one visit to the next (the portal's
+# ASP.NET form state), ignored when matching requests during replay
+VOLATILE = re.compile(r"^__(VIEWSTATE|EVENTVALIDATION)")
+
+# how many keep-alive connections to hold open to each host while recording
+POOL_SIZE = 32
+
+REDACTED = "REDACTED"
+
+# notification methods (see accounts.NOTIFIER_METHODS) whose messages go over
+# HTTP, and so through the cassette, and those that never leave this machine
+HTTP_METHODS = {"wechat", "telegram", "pushbullet", "ifttt", "slack"}
+LOCAL_METHODS = {"desktop", "logfile"}
+# the options that stop other notification methods from sending anything
+# while replaying (any others, e.g. email_oauth, are refused)
+OFFLINE_OPTIONS = {"email": {"debug": True}}
+
+# the track for the notifiers' requests (the others are named after hashes of
+# students' usernames)
+NOTIFIERS_TRACK = "(notifiers)"
+
+
+class ReplayMissError(requests.ConnectionError):
+    """Represent a request with no recorded response to replay"""
+
+
+class Cassette:
+    """
+    A file of recorded HTTP interactions (one JSON object per line), each
+    belonging to a "track" (e.g. one student's session, or the notifiers), so
+    that each track's responses are replayed in the order they were recorded.
+    Streamed responses (see `scrape.read_content`) are recorded only as far
+    as they were read, so record without streaming (stream_pages) to capture
+    whole pages.
+
+    In "record" mode, every request sent through one of the cassette's
+    adapters (see `adapter`) really goes out, and is appended to the file
+    along with its response. In "replay" mode, the adapters never touch the
+    network: each request is answered with the next recorded response (on
+    the same track) to a matching request, going back to the first once
+    they've all been used, so that a cassette can be replayed many times.
+
+    Credentials are redacted before anything is written (or matched): the
+    values of any headers, form fields or query parameters that look like
+    they hold credentials or usernames (see SENSITIVE and SENSITIVE_FIELDS),
+    and anywhere else that any of the secrets given to `redact` or
+    `redact_entries` turn up.
+    """
+    def __init__(self, filename, mode="record"):
+        """
+        :param filename: The cassette file (appended to when recording).
+        :param mode: "record" or "replay".
+        """
+        if mode not in {"record", "replay"}:
+            raise ValueError(f"Unknown cassette mode {mode!r}")
+        self.filename = filename
+        self.mode = mode
+        self.secrets = set()
+        self.lock = threading.Lock()
+        self.responses = {}  # match key: itertools.cycle of responses
+        if mode == "replay":
+            self.load()
+
+    def redact(self, *secrets):
+        """Never write these strings to the cassette."""
+        self.secrets.update(secret for secret in secrets if secret)
+
+    def redact_entries(self, entries):
+        """
+        Never write the usernames, passwords, or notifier settings (e.g.
+        Slack hook URLs or bot tokens), of these accounts file entries (see
+        `accounts.load_accounts`) to the cassette.
+        """
+        for entry in entries:
+            self.redact(entry.get("username"), entry.get("password"))
+            for spec in entry.get("notifiers", []):
+                self.redact(*(value for key, value in spec.items()
+                    if key != "method" and isinstance(value, str)))
+
+    def prepare_entries(self, entries):
+        """
+        Get accounts file entries ready to be checked through the cassette:
+        their secrets are redacted (see `redact_entries`), and, when
+        replaying, their notifiers are kept off the network (emails are
+        printed instead of sent).
+
+        :return: The entries to make the accounts from.
+        :raises ValueError: If replaying, and an entry uses a notification
+                            method that can't be kept off the network.
+        """
+        self.redact_entries(entries)
+        if self.mode != "replay":
+            return entries
+        offline = []
+        for entry in entries:
+            specs = []
+            # (by default, each student gets a self-email)
+            for spec in entry.get("notifiers", [{"method": "email"}]):
+                method = spec.get("method")
+                if method in OFFLINE_OPTIONS:
+                    spec = {**spec, **OFFLINE_OPTIONS[method]}
+                elif method not in HTTP_METHODS | LOCAL_METHODS:
+                    raise ValueError(f"Can't replay a cassette with "
+                        f"notification method {method!r}, which would send "
+                        f"real messages")
+                specs.append(spec)
+            offline.append({**entry, "notifiers": specs})
+        return offline
+
+    def adapter(self, track, inner=None):
+        """
+        :param track: The name of the track to record to or replay from
+                      (e.g. a student's username, which is hashed).
+        :param inner: When recording, the adapter to really send requests
+                      through (by default, a new `HTTPAdapter`).
+        :return: A `requests` transport adapter to mount on a session.
+        """
+        if track != NOTIFIERS_TRACK:
+            track = hashlib.sha256(track.encode()).hexdigest()[:16]
+        if self.mode == "replay":
+            return Player(self, track)
+        if inner is None:
+            inner = HTTPAdapter(pool_connections=POOL_SIZE,
+                pool_maxsize=POOL_SIZE)
+        return Recorder(self, track, inner)
+
+    def record(self, track, request, response, content, seconds):
+        interaction = {
+            "track": track,
+            "seconds": seconds,
+            "request": {
+                "method": request.method,
+                "url": self.redact_url(request.url),
+                "headers": self.redact_headers(request.headers.items()),
+                "body": self.redact_body(request.body,
+                    request.headers.get("Content-Type")),
+            },
+            "response": {
+                "status": response.status_code,
+                "reason": response.reason,
+                # (the body is stored decoded)
+                "headers": self.redact_headers((name, value)
+                    for name, value in response.raw.headers.items()
+                    if name.lower() not in {"content-encoding",
+                        "content-length", "transfer-encoding"}),
+                **encode_body(self.redact_text(content)),
+            },
+        }
+        line = json.dumps(interaction) + "\n"
+        with self.lock:
+            with open(self.filename, 'a') as cassettefile:
+                cassettefile.write(line)
+
+    def load(self):
+        recorded = {}
+        with open(self.filename) as cassettefile:
+            for line in cassettefile:
+                interaction = json.loads(line)
+                track = interaction["track"]
+                request = interaction["request"]
+                response = interaction["response"]
+                # (recorded responses can be matched closely, by the stable
+                # parts of the request, or failing that, by its URL alone)
+                content_type = dict((name.lower(), value)
+                    for name, value in request["headers"]).get("content-type")
+                for key in self.keys(track, request["method"], request["url"],
+                        request["body"], content_type):
+                    recorded.setdefault(key, []).append(response)
+        self.responses = {key: itertools.cycle(responses)
+            for key, responses in recorded.items()}
+
+    def replay(self, track, request):
+        """:return: The next recorded response matching a request."""
+        url = self.redact_url(request.url)
+        content_type = request.headers.get("Content-Type")
+        body = self.redact_body(request.body, content_type)
+        with self.lock:
+            for key in self.keys(track, request.method, url, body,
+                    content_type):
+                if key in self.responses:
+                    return next(self.responses[key])
+        raise ReplayMissError(f"No recorded response for {request.method} "
+            f"{url} (track {track!r}) in {self.filename}")
+
+    def keys(self, track, method, url, body, content_type):
+        """:return: The keys to match a (redacted) request by, in order."""
+        if body is not None and is_form(content_type):
+            body = urlencode([(name, value) for name, value in parse_qsl(body,
+                keep_blank_values=True) if not VOLATILE.match(name)])
+        return [(track, method, url, body), (track, method, url)]
+
+    def redact_text(self, content):
+        """:return: `content` (bytes) with the secrets blanked out."""
+        for secret in self.secrets:
+            content = content.replace(secret.encode(), REDACTED.encode())
+        return content
+
+    def redact_url(self, url):
+        for secret in self.secrets:
+            url = url.replace(secret, REDACTED)
+        scheme, netloc, path, query, fragment = urlsplit(url)
+        if query:
+            query = urlencode(redact_fields(parse_qsl(query,
+                keep_blank_values=True)))
+        return urlunsplit((scheme, netloc, path, query, fragment))
+
+    def redact_headers(self, headers):
+        redacted = []
+        for name, value in headers:
+            if name.lower() == "set-cookie":
+                # (keep the cookie's name and attributes, so that replayed
+                # sessions still end up with a cookie)
+                value = re.sub(r"^([^=]*)=[^;]*", rf"\1={REDACTED}", value)
+            elif SENSITIVE.search(name):
+                value = REDACTED
+            else:
+                value = self.redact_text(value.encode()).decode()
+            redacted.append([name, value])
+        return redacted
+
+    def redact_body(self, body, content_type):
+        """:return: A request body, redacted, as text (or None)."""
+        if body is None:
+            return None
+        if isinstance(body, bytes):
+            body = body.decode(errors="replace")
+        body = self.redact_text(body.encode()).decode()
+        if is_form(content_type):
+            body = urlencode(redact_fields(parse_qsl(body,
+                keep_blank_values=True)))
+        return body
+
+
+def is_form(content_type):
+    return content_type is not None \
+        and "x-www-form-urlencoded" in content_type
+
+
+def redact_fields(fields):
+    return [(name, REDACTED if SENSITIVE_FIELDS.search(name) else value)
+        for name, value in fields]
+
+
+def encode_body(content):
+    try:
+        return {"body": content.decode()}
+    except UnicodeDecodeError:
+        return {"body_base64": base64.b64encode(content).decode()}
+
+
+def decode_body(response):
+    if "body_base64" in response:
+        return base64.b64decode(response["body_base64"])
+    return response["body"].encode()
+
+
+class Recorder(BaseAdapter):
+    """
+    A transport adapter that sends requests through another adapter, and
+    records them (and their responses) to a cassette. Streamed responses are
+    recorded once they're closed (or read to the end), with only as much of
+    the body as was read, so as not to download any more than usual.
+    """
+    def __init__(self, cassette, track, inner):
+        super().__init__()
+        self.cassette = cassette
+        self.track = track
+        self.inner = inner
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        response = self.inner.send(request, **kwargs)
+        def record(content):
+            self.cassette.record(self.track, request, response, content,
+                time.perf_counter() - start)
+        if kwargs.get("stream"):
+            response.raw = Tee(response.raw, record)
+        else:
+            record(response.content)
+        return response
+
+    def close(self):
+        self.inner.close()
+
+
+class Tee:
+    """
+    Stands in for a streamed response's underlying urllib3 response, keeping
+    a copy of whatever is read from it, and passing the copy to `done` when
+    the response is closed or read to the end.
+    """
+    def __init__(self, raw, done):
+        self.raw = raw
+        self.done = done
+        self.chunks = []
+
+    def stream(self, amt=2**16, decode_content=None):
+        for chunk in self.raw.stream(amt, decode_content=decode_content):
+            self.chunks.append(chunk)
+            yield chunk
+        self.finish()
+
+    def read(self, *args, **kwargs):
+        data = self.raw.read(*args, **kwargs)
+        if data:
+            self.chunks.append(data)
+        else:
+            self.finish()
+        return data
+
+    def close(self):
+        self.raw.close()
+        self.finish()
+
+    def finish(self):
+        if self.done is not None:
+            done, self.done = self.done, None
+            done(b"".join(self.chunks))
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+class Player(BaseAdapter):
+    """
+    A transport adapter that answers requests from a cassette's recordings,
+    without any network access.
+    """
+    def __init__(self, cassette, track):
+        super().__init__()
+        self.cassette = cassette
+        self.track = track
+
+    def send(self, request, **kwargs):
+        recorded = self.cassette.replay(self.track, request)
+        content = decode_body(recorded)
+        headers = HTTPHeaderDict()
+        message = HTTPMessage()
+        for name, value in recorded["headers"]:
+            headers.add(name, value)
+            message[name] = value
+        raw = HTTPResponse(body=io.BytesIO(content), headers=headers,
+            status=recorded["status"], reason=recorded["reason"],
+            preload_content=False, decode_content=False)
+        # (requests reads the cookies from the underlying http.client
+        # response's headers)
+        raw._original_response = RecordedResponse(message)
+        response = requests.Response()
+        response.status_code = recorded["status"]
+        response.reason = recorded["reason"]
+        response.headers = CaseInsensitiveDict(headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = raw
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        requests.cookies.extract_cookies_to_jar(response.cookies, request, raw)
+        return response
+
+    def close(self):
+        pass
+
+
+class RecordedResponse:
+    """Stands in for the `http.client.HTTPResponse` behind a response."""
+    def __init__(self, msg):
+        self.msg = msg
+
+    def isclosed(self):
+        return True
+
+    def close(self):
+        pass
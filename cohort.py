@@ -0,0 +1,147 @@
+"""
+watch the my.unimelb results pages of a whole cohort of student accounts at
+once, notifying each student (via their own notification methods) of changes
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+from datetime import datetime
+
+import messages
+import metrics
+from profiling import Profiler
+from accounts import load_accounts, notify_all, sweep, poll_and_notify
+from scheduler import Scheduler
+from session import SessionManager
+from outbox import Outbox, DeliveryWorker
+from digest import Digest, DigestWorker
+from store import FileStore, SQLiteStore
+from ratelimit import RateLimiter
+from notify.connections import set_timeout
+from extract import start_workers
+
+# # #
+# SCRIPT CONFIGURATION
+#
+
+print("Configuring script...")
+
+# most of the settings are shared with the other scripts, and described (with
+# their defaults) in settings.py. change them there, or set any of them again
+# below to change them just for this script
+from settings import *
+
+# the accounts to watch, and how to notify each of them, are listed in this
+# JSON file (see README and `accounts.load_accounts` for the format). keep
+# this file safe, it contains everyone's passwords!
+ACCOUNTS_FILENAME = "accounts.json"
+
+# set this to True if you would like the script to repeatedly check the results
+# pages, or False if you only want it to run once
+CHECK_REPEATEDLY = True
+
+PARSER = "processes:" + BS4_PARSER if PARSE_IN_PROCESSES else BS4_PARSER
+OUTBOX = Outbox(OUTBOX_FILENAME) if OUTBOX_FILENAME else None
+DIGEST = Digest() if DIGEST_INTERVAL is not None else None
+STORE = SQLiteStore(RESULTS_DATABASE) if RESULTS_DATABASE else FileStore()
+PROFILER = Profiler(PROFILE_DIR, cycles=PROFILE_CYCLES,
+    memory_top=PROFILE_MEMORY_TOP)
+LIMITER = RateLimiter(
+    rate=MAX_REQUESTS_PER_SECOND,
+    burst=MAX_REQUESTS_PER_SECOND or 1,
+    max_in_flight=MAX_REQUESTS_IN_FLIGHT,
+    endpoints={"login": (MAX_LOGINS_PER_SECOND, 1)},
+    timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+    hedge=HEDGE_REQUESTS)
+set_timeout(CONNECT_TIMEOUT, READ_TIMEOUT)
+
+print("Loading accounts from", ACCOUNTS_FILENAME)
+ACCOUNTS = load_accounts(ACCOUNTS_FILENAME,
+    notify_concurrently=NOTIFY_CONCURRENTLY,
+    notify_timeout=NOTIFY_TIMEOUT,
+    parser=PARSER,
+    sessions=SessionManager(COOKIE_DIR),
+    base_url=BASE_URL,
+    outbox=OUTBOX,
+    store=STORE,
+    limiter=LIMITER,
+    digest=DIGEST,
+    stream=STREAM_PAGES)
+print("Loaded", len(ACCOUNTS), "accounts.")
+
+# let's get to it!
+
+def main():
+    """Run the checking script, once or forever, depending on configuration."""
+    # if parsing in worker processes, start them before any threads
+    start_workers(PARSER)
+    # if asked, keep track of where the time goes
+    if METRICS_PORT is not None:
+        metrics.serve(METRICS_PORT)
+    if METRICS_FILENAME is not None:
+        dumper = metrics.MetricsDumper(METRICS_FILENAME, interval=5*60)
+        dumper.start()
+    if PROFILE_CYCLES_ON_SIGNAL:
+        PROFILER.install_signal_handler(PROFILE_CYCLES_ON_SIGNAL)
+    check = PROFILER.wrap(poll_and_notify)
+
+    # send each student a test message to make sure their notification
+    # configuration works
+    hello = messages.hello_message(delay=DELAY_BETWEEN_CHECKS,
+        max_delay=MAX_DELAY_BETWEEN_CHECKS, stable_after=STABLE_AFTER,
+        release_windows=RELEASE_WINDOWS, release_delay=DELAY_DURING_RELEASE)
+    notify_all(ACCOUNTS, *hello, max_workers=MAX_WORKERS)
+
+    # if we're using an outbox, deliver its messages in the background
+    if OUTBOX is not None:
+        worker = DeliveryWorker(OUTBOX, ACCOUNTS)
+        worker.start()
+
+    # conduct the first sweep! unlike the single-student script, one student's
+    # problems (e.g. a wrong password) shouldn't stop everyone else's checks,
+    # so just report any failures
+    report(sweep(ACCOUNTS, task=check, max_workers=MAX_WORKERS))
+    if DIGEST is not None:
+        DIGEST.flush()
+
+    if CHECK_REPEATEDLY:
+        print("Completed a sweep at", datetime.now().strftime("%H:%M:%S"))
+        print("Scheduling each student's next check.")
+        print("--------------------------------------")
+        scheduler = make_scheduler(check)
+        for account in ACCOUNTS:
+            scheduler.schedule(account, changed=False)
+        # from here on, each student is checked on their own schedule (with
+        # their messages sent in batches, if we're making a digest)
+        if DIGEST is not None:
+            DigestWorker(DIGEST, DIGEST_INTERVAL * 60).start()
+        scheduler.run()
+
+    # (we only get here if checking once.) give any queued messages one last
+    # chance to go out before we stop
+    if OUTBOX is not None:
+        worker.stop()
+        OUTBOX.deliver_due(ACCOUNTS)
+    if METRICS_FILENAME is not None:
+        dumper.stop()
+
+
+def make_scheduler(check):
+    return Scheduler(
+        task=check,
+        delay=DELAY_BETWEEN_CHECKS * 60,
+        max_delay=MAX_DELAY_BETWEEN_CHECKS * 60,
+        stable_after=STABLE_AFTER * 60 * 60,
+        release_windows=RELEASE_WINDOWS,
+        release_delay=DELAY_DURING_RELEASE * 60,
+        max_workers=MAX_WORKERS)
+
+
+def report(failures):
+    """Print the exceptions encountered during a sweep, by account."""
+    for account, e in failures.items():
+        print(f"Exception encountered for {account.username}:")
+        print(f"{e.__class__.__name__}: {e}")
+
+
+if __name__ == '__main__':
+    main()
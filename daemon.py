@@ -0,0 +1,432 @@
+"""
+run WAM Spam as a long-running daemon, with a local control API for adding,
+removing, pausing and checking accounts (and seeing how their checks are
+going), all without a restart
+
+usage: python3 daemon.py [--config wamspam.json] [--control-port 8765]
+
+configured like headless.py (see there), with some extra settings:
+"control_port", the port to serve the control API on (on localhost only),
+and "control_token", a secret which every request must give in an
+"Authorization: Bearer {token}" header. if no token is configured, a new one
+is made up at startup, and written to "control_token_file" (readable only by
+the daemon's user). accounts added or removed through the API are written
+back to the "accounts_file", if there is one, so that they are still there
+after a restart.
+
+accounts added through the API can't name their own results file, and can
+only use the notification methods in API_NOTIFIER_METHODS (so, e.g., not a
+log file anywhere the daemon can write).
+
+the control API speaks JSON:
+
+    GET    /accounts                   every account's status
+    GET    /accounts/{username}        one account's status
+    POST   /accounts                   add an account (the body is an entry
+                                       of an accounts file, optionally with
+                                       "hello": true to send a test message)
+    DELETE /accounts/{username}        stop watching an account
+    POST   /accounts/{username}/pause  stop checking an account for now
+    POST   /accounts/{username}/resume start checking it again
+    POST   /accounts/{username}/poll   check an account straight away
+
+for example:
+
+    curl -H "Authorization: Bearer $(cat control-token)" \\
+        -X POST localhost:8765/accounts/mfarrugia/poll
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import os
+import sys
+import json
+import hmac
+import time
+import signal
+import secrets
+import argparse
+import tempfile
+import functools
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from accounts import check_username, make_accounts
+from headless import (load_config, load_entries, make_cassette, make_options,
+    make_hello, make_scheduler, make_task, ConfigError, EXIT_OK, EXIT_BAD_CONFIG)
+
+
+# the notification methods that accounts added through the API may use (the
+# others write to local files, or prompt on the daemon's terminal)
+API_NOTIFIER_METHODS = {"email", "wechat", "telegram", "pushbullet", "ifttt",
+    "slack"}
+
+
+class AccountError(Exception):
+    """Represent a control request that can't be carried out"""
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class Daemon:
+    """
+    Keeps track of the watched accounts (and how their checks have gone),
+    and adds, removes, pauses, resumes or checks them on request, while a
+    `scheduler.Scheduler` checks them as they come due.
+    """
+    def __init__(self, scheduler, options, notify_options, entries,
+            accounts_file=None, cassette=None, hello=None):
+        """
+        :param scheduler: The scheduler checking the accounts (its task is
+                          wrapped to record each check's outcome).
+        :param options: Keyword arguments for new `accounts.Account`s (see
+                        `headless.make_options`).
+        :param notify_options: Keyword arguments for their notifiers.
+        :param entries: The accounts to start with (as accounts file
+                        entries).
+        :param accounts_file: Where to save the entries when they change (or
+                              None not to save them).
+        :param cassette: The `cassette.Cassette` the accounts' requests are
+                         recorded to or replayed from (if any), to keep
+                         their credentials out of (and, when replaying, their
+                         notifiers off the network).
+        :param hello: The (subject, text) of the test message to send to new
+                      accounts that ask for one.
+        """
+        self.scheduler = scheduler
+        scheduler.task = self.wrap(scheduler.task)
+        self.options = options
+        self.notify_options = notify_options
+        self.accounts_file = accounts_file
+        self.cassette = cassette
+        self.hello = hello
+        # (the accounts list is shared with the outbox's delivery worker, so
+        # it's changed in place)
+        self.accounts = []
+        self.entries = {}
+        self.statuses = {}
+        self.notifiers = {}  # shared by all the accounts, see make_accounts
+        self.lock = threading.RLock()
+        for entry in entries:
+            self.add(entry, save=False)
+
+    def wrap(self, task):
+        """
+        :return: A version of `task` (e.g. `accounts.poll_and_notify`) which
+                 records how each check went.
+        """
+        @functools.wraps(task)
+        def recorded(account):
+            status = self.statuses.get(account.username)
+            if status is None:
+                # (removed just as its check came due)
+                return False
+            status["checking"] = True
+            status["last_check"] = time.time()
+            start = time.perf_counter()
+            try:
+                changed = task(account)
+            except Exception as e:
+                status["failures"] += 1
+                status["last_result"] = "failed"
+                status["last_error"] = f"{e.__class__.__name__}: {e}"
+                raise
+            else:
+                status["last_result"] = "changed" if changed else "unchanged"
+                status["last_error"] = None
+                return changed
+            finally:
+                status["checks"] += 1
+                status["last_check_seconds"] = time.perf_counter() - start
+                status["checking"] = False
+        return recorded
+
+    def find(self, username):
+        with self.lock:
+            for account in self.accounts:
+                if account.username == username:
+                    return account
+        raise AccountError(f"No account {username!r}", status=404)
+
+    def add(self, entry, hello=False, save=True):
+        """
+        Start watching a new account (checking it straight away).
+
+        :param entry: The account's details (as an accounts file entry).
+        :return: The new account.
+        """
+        if not isinstance(entry, dict) or "username" not in entry \
+                or "password" not in entry:
+            raise AccountError("Give at least a username and a password")
+        with self.lock:
+            if entry["username"] in self.entries:
+                raise AccountError(f"Already watching {entry['username']!r}",
+                    status=409)
+            try:
+                prepared = [entry]
+                if self.cassette is not None:
+                    prepared = self.cassette.prepare_entries(prepared)
+                account, = make_accounts(prepared, cache=self.notifiers,
+                    **self.notify_options, **self.options)
+            except (ValueError, KeyError, TypeError, ImportError) as e:
+                raise AccountError(f"Couldn't set up account: "
+                    f"{e.__class__.__name__}: {e}")
+            self.entries[account.username] = entry
+            self.statuses[account.username] = {"username": account.username,
+                "checking": False, "last_check": None,
+                "last_check_seconds": None, "last_result": None,
+                "last_error": None, "checks": 0, "failures": 0}
+            self.accounts.append(account)
+            if save:
+                self.save()
+        print(f"Watching {account.username}")
+        if hello and self.hello is not None:
+            try:
+                account.notifier.notify(*self.hello)
+            except Exception as e:
+                print(f"Sending hello to {account.username} failed:")
+                print(f"{e.__class__.__name__}: {e}")
+        self.scheduler.add(account)
+        return account
+
+    def remove(self, username):
+        """Stop watching an account (and forget its session)."""
+        with self.lock:
+            account = self.find(username)
+            self.scheduler.remove(account)
+            self.accounts.remove(account)
+            del self.entries[username]
+            del self.statuses[username]
+            self.save()
+        if account.sessions is not None:
+            account.sessions.forget(username)
+        print(f"Stopped watching {username}")
+
+    def pause(self, username):
+        self.scheduler.pause(self.find(username))
+        print(f"Paused {username}")
+
+    def resume(self, username):
+        self.scheduler.resume(self.find(username))
+        print(f"Resumed {username}")
+
+    def poll(self, username):
+        self.scheduler.check_now(self.find(username))
+
+    def status(self, username):
+        """:return: A JSON-serialisable summary of an account's checks."""
+        account = self.find(username)
+        status = dict(self.statuses[username])
+        status["paused"] = account in self.scheduler.paused
+        status["next_check"] = self.scheduler.next_check_time(account)
+        return status
+
+    def save(self):
+        """Write the accounts back to the accounts file (atomically)."""
+        if self.accounts_file is None:
+            return
+        directory = os.path.dirname(os.path.abspath(self.accounts_file))
+        # (mkstemp makes the file readable by us alone, which suits a file
+        # full of passwords)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".accounts-")
+        try:
+            with os.fdopen(fd, 'w') as accountsfile:
+                json.dump(list(self.entries.values()), accountsfile, indent=4)
+            os.replace(tmp, self.accounts_file)
+        except:
+            os.remove(tmp)
+            raise
+
+
+class ControlHandler(BaseHTTPRequestHandler):
+    """Serves the control API (see the module docstring)."""
+    ACTIONS = {"pause": Daemon.pause, "resume": Daemon.resume,
+        "poll": Daemon.poll}
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+    def handle_request(self, verb):
+        daemon = self.server.control
+        if not hmac.compare_digest(
+                self.headers.get("Authorization", "").encode(),
+                f"Bearer {self.server.token}".encode()):
+            self.reply(401, {"error": "Give the control token"})
+            return
+        parts = self.path.strip("/").split("/")
+        try:
+            if parts[0] != "accounts" or len(parts) > 3:
+                raise AccountError(f"No such path {self.path}", status=404)
+            if verb == "GET" and len(parts) == 1:
+                with daemon.lock:
+                    usernames = [account.username
+                        for account in daemon.accounts]
+                self.reply(200, [daemon.status(username)
+                    for username in usernames])
+            elif verb == "GET" and len(parts) == 2:
+                self.reply(200, daemon.status(parts[1]))
+            elif verb == "POST" and len(parts) == 1:
+                entry = self.read_json()
+                check_entry(entry)
+                hello = entry.pop("hello", False)
+                account = daemon.add(entry, hello=hello)
+                self.reply(201, daemon.status(account.username))
+            elif verb == "DELETE" and len(parts) == 2:
+                daemon.remove(parts[1])
+                self.reply(200, {"removed": parts[1]})
+            elif verb == "POST" and len(parts) == 3 \
+                    and parts[2] in self.ACTIONS:
+                self.ACTIONS[parts[2]](daemon, parts[1])
+                self.reply(200, daemon.status(parts[1]))
+            else:
+                raise AccountError(f"Can't {verb} {self.path}", status=405)
+        except AccountError as e:
+            self.reply(e.status, {"error": str(e)})
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError as e:
+            raise AccountError(f"Couldn't read JSON body: {e}")
+
+    def reply(self, status, body):
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # don't clutter the script's own output
+
+
+def check_entry(entry):
+    """
+    Refuse an account sent over the API that would have the daemon write to
+    files of the sender's choosing (or otherwise do more than send
+    messages).
+    """
+    if not isinstance(entry, dict):
+        raise AccountError("Give the account as a JSON object")
+    try:
+        check_username(entry.get("username"))
+    except ValueError as e:
+        raise AccountError(str(e))
+    if "results_filename" in entry:
+        raise AccountError("Can't set results_filename through the API")
+    notifiers = entry.get("notifiers", [])
+    if not isinstance(notifiers, list) or not all(isinstance(spec, dict)
+            for spec in notifiers):
+        raise AccountError("Give the notifiers as a list of objects")
+    for spec in notifiers:
+        if spec.get("method") not in API_NOTIFIER_METHODS:
+            raise AccountError(f"Can't use notification method "
+                f"{spec.get('method')!r} through the API (use one of "
+                f"{', '.join(sorted(API_NOTIFIER_METHODS))})")
+
+
+def make_token(filename):
+    """
+    Make up a new control token, and write it to a file that only this user
+    can read.
+
+    :return: The token.
+    """
+    token = secrets.token_urlsafe(32)
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # (in case the file was already there, with laxer permissions)
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, 'w') as tokenfile:
+        tokenfile.write(token + "\n")
+    return token
+
+
+def serve(daemon, port, token, address="127.0.0.1"):
+    """
+    Serve the control API at http://{address}:{port}/, from a background
+    thread, to requests that give the token.
+
+    :return: The server (call its `shutdown` method to stop it).
+    """
+    server = ThreadingHTTPServer((address, port), ControlHandler)
+    server.daemon_threads = True
+    server.control = daemon
+    server.token = token
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--config", default=os.environ.get("WAMSPAM_CONFIG"),
+        help="JSON config file (default: $WAMSPAM_CONFIG, if set)")
+    parser.add_argument("--control-port", type=int,
+        help="port for the control API (overrides control_port)")
+    args = parser.parse_args(argv)
+
+    try:
+        config = load_config(args.config)
+        if args.control_port is not None:
+            config["control_port"] = args.control_port
+        entries = load_entries(config)
+        cassette = make_cassette(config)
+        options, notify_options = make_options(config, cassette)
+        scheduler = make_scheduler(config, task=make_task(config))
+        daemon = Daemon(scheduler, options, notify_options, entries,
+            accounts_file=config["accounts_file"], cassette=cassette,
+            hello=make_hello(config))
+        token = config["control_token"]
+        if token is None:
+            try:
+                token = make_token(config["control_token_file"])
+            except OSError as e:
+                raise ConfigError(f"Couldn't write control token: {e}")
+            print(f"Wrote control API token to "
+                f"{config['control_token_file']}")
+    except (ConfigError, AccountError) as e:
+        print(f"Bad configuration: {e}", file=sys.stderr)
+        return EXIT_BAD_CONFIG
+    if config["metrics_port"] is not None:
+        import metrics
+        metrics.serve(config["metrics_port"])
+    dumper = None
+    if config["metrics_filename"] is not None:
+        import metrics
+        dumper = metrics.MetricsDumper(config["metrics_filename"])
+        dumper.start()
+    server = serve(daemon, config["control_port"], token)
+    print(f"Watching {len(daemon.accounts)} account(s); control API at "
+        f"http://127.0.0.1:{config['control_port']}/accounts")
+
+    if options.get("outbox") is not None:
+        from outbox import DeliveryWorker
+        DeliveryWorker(options["outbox"], daemon.accounts).start()
+    digester = None
+    if options.get("digest") is not None:
+        from digest import DigestWorker
+        digester = DigestWorker(options["digest"],
+            config["digest_interval"] * 60)
+        digester.start()
+    # stop cleanly (letting checks under way finish) when asked to
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: scheduler.stop())
+    scheduler.run()
+    server.shutdown()
+    if digester is not None:
+        digester.stop()
+    if dumper is not None:
+        dumper.stop()
+    return EXIT_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+compare old and new transcripts, for one degree or for a whole cohort at once
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+from collections import namedtuple
+
+
+class ChangeSet(namedtuple("ChangeSet", "old_wam new_wam changed added removed")):
+    """
+    The differences between two `records.Transcript`s: the old and new WAM
+    text (or None), a tuple of (old, new) `records.Result` pairs for subjects
+    whose results changed, and tuples of the `records.Result`s for subjects
+    that were added and removed.
+    """
+    __slots__ = ()
+
+    def wam_changed(self):
+        return self.old_wam != self.new_wam
+
+    def wam_delta(self):
+        """:return: The new WAM minus the old WAM, or None if either is missing."""
+        if self.old_wam is None or self.new_wam is None:
+            return None
+        return float(self.new_wam) - float(self.old_wam)
+
+    def is_empty(self):
+        """Are the two transcripts the same (as far as WAM and results go)?"""
+        return not (self.wam_changed() or self.changed or self.added
+            or self.removed)
+
+
+def key(result):
+    """Identify a subject result (a subject can be taken more than once)."""
+    return (result.subject, result.date)
+
+
+def diff(old, new):
+    """
+    Compare two `records.Transcript`s.
+
+    Results pages list subjects in a stable order, and between two checks
+    usually only a few rows differ. So we first skip past the rows at either
+    end that line up exactly (cheap, since their fields are interned strings
+    that compare by identity), and only key and match up the rows in between.
+
+    :return: A `ChangeSet`.
+    """
+    if old is new or old.results is new.results:
+        # e.g. a transcript that came back from the scraper unchanged (the
+        # very same object, see `scrape.scrape_results`)
+        return ChangeSet(old.wam, new.wam, (), (), ())
+    old_rows = old.results
+    new_rows = new.results
+    # skip the common prefix and suffix
+    n = min(len(old_rows), len(new_rows))
+    start = 0
+    while start < n and old_rows[start] == new_rows[start]:
+        start += 1
+    end = 0
+    while end < n - start and old_rows[-1-end] == new_rows[-1-end]:
+        end += 1
+    old_rows = old_rows[start:len(old_rows)-end]
+    new_rows = new_rows[start:len(new_rows)-end]
+    # match up the remaining rows by subject
+    old_subjects = {key(result): result for result in old_rows}
+    changed = []
+    added = []
+    for new_result in new_rows:
+        old_result = old_subjects.pop(key(new_result), None)
+        if old_result is None:
+            added.append(new_result)
+        elif old_result != new_result:
+            changed.append((old_result, new_result))
+    removed = old_subjects.values()
+    return ChangeSet(old.wam, new.wam, tuple(changed), tuple(added),
+        tuple(removed))
+
+
+def diff_all(pairs):
+    """
+    Compare many (old, new) `records.Transcript` pairs at once, e.g. all of
+    the degrees checked in a sweep of a cohort. Most of these will be
+    unchanged, and cost next to nothing to compare.
+
+    :return: A list of `ChangeSet`s, one for each pair, in order.
+    """
+    return [diff(old, new) for old, new in pairs]
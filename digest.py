@@ -0,0 +1,139 @@
+"""
+batch up the notifications produced over a cycle of checks, and send them
+combined, one message per notification channel
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import functools
+import threading
+
+import messages
+from outbox import channels
+from notify.by_multiple import MultiNotifier
+
+
+class Digest:
+    """
+    Collects messages (instead of sending them straight away), and then, when
+    flushed, sends each notification channel a single message combining all
+    of the messages collected for it since the last flush.
+
+    Accounts can share a channel (e.g. a Slack webhook for a whole cohort, see
+    `accounts.make_accounts`), in which case the channel gets one message
+    covering all of those accounts.
+
+    By the time a digest is flushed, the changes it reports have already
+    been saved, so messages that can't be sent (without an outbox to retry
+    them) are kept, and sent again at the next flush.
+    """
+    def __init__(self):
+        self.collected = []
+        self.lock = threading.Lock()
+
+    def wrap(self, task):
+        """
+        :return: A version of `task` (e.g. `accounts.poll_and_notify`) which
+                 flushes the digest once it's done, so that each check sends
+                 at most one message per channel, however many degrees
+                 changed.
+        """
+        @functools.wraps(task)
+        def flushing(account):
+            try:
+                return task(account)
+            finally:
+                self.flush()
+        return flushing
+
+    def add(self, account, subject, text, change=None):
+        """
+        :param change: Identifies the change the message reports (see
+                       `outbox.Outbox.enqueue`), if known.
+        """
+        with self.lock:
+            for name, notifier in channels(account.notifier).items():
+                self.collected.append((account, name, notifier, subject,
+                    text, change))
+
+    def flush(self):
+        """
+        Send everything collected so far (through each account's outbox, if
+        it has one).
+
+        :return: The number of combined messages sent (or queued).
+        """
+        with self.lock:
+            collected, self.collected = self.collected, []
+        # group the messages by channel, remembering the first account to
+        # use each channel (the combined message is sent on its behalf)
+        groups = {}
+        for item in collected:
+            account, name, notifier, _, _, _ = item
+            if id(notifier) not in groups:
+                groups[id(notifier)] = (account, name, notifier, [])
+            groups[id(notifier)][3].append(item)
+        for account, name, notifier, group in groups.values():
+            if len(group) == 1:
+                _, _, _, subject, text, change = group[0]
+            else:
+                subject, text = messages.digest_message([(other.username,
+                    subject, text) for other, _, _, subject, text, _ in group])
+                changes = [change for _, _, _, _, _, change in group]
+                change = None if None in changes else "\0".join(changes)
+            if account.outbox is not None:
+                account.outbox.enqueue(account, subject, text, only=[name],
+                    change=change)
+                continue
+            try:
+                channel(account, notifier).notify(subject, text)
+            except Exception as e:
+                print(f"Sending digest via {name} failed (will retry):")
+                print(f"{e.__class__.__name__}: {e}")
+                with self.lock:
+                    self.collected.extend(group)
+        if groups:
+            print(f"Combined {len(collected)} notifications into {len(groups)}"
+                " digest messages.")
+        return len(groups)
+
+
+def channel(account, notifier):
+    """
+    :return: A notifier sending through just one of an account's channels,
+             with the same concurrency and deadline as the account's own
+             notifier (see `notify.by_multiple.MultiNotifier`).
+    """
+    multi = account.notifier
+    timeout = getattr(multi, "timeouts", {}).get(notifier,
+        getattr(multi, "timeout", None))
+    return MultiNotifier([notifier], concurrent=getattr(multi, "concurrent",
+        False), timeout=timeout)
+
+
+class DigestWorker:
+    """
+    A background thread which flushes a digest every `interval` seconds.
+    """
+    def __init__(self, digest, interval):
+        self.digest = digest
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """Stop flushing (after one last flush)."""
+        self.stopping.set()
+        self.thread.join()
+        self.digest.flush()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                self.digest.flush()
+            except Exception as e:
+                print("Exception encountered sending digest:")
+                print(f"{e.__class__.__name__}: {e}")
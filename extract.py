@@ -0,0 +1,526 @@
+"""
+extract the data we need (hidden form fields, page title, degree list, WAM and
+subject results) from the results pages, using one of several backends
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import os
+import re
+import html
+import functools
+import threading
+import multiprocessing
+from html.parser import HTMLParser
+from concurrent.futures import ProcessPoolExecutor
+
+from records import Result, Transcript
+
+
+# names and ids of the page elements we care about
+TITLE_ID = "ctl00_h1PageTitle"
+LOGIN_ERRORS_ID = "ctl00_Content_valErrors"
+USERNAME_FIELD = "ctl00$Content$txtUserName$txtText"
+DEGREES_TABLE_ID = "ctl00_Content_grdResultPlans"
+RESULTS_TABLE_ID = "ctl00_Content_grdResultDetails"
+WAM_CLASS = "UMWAMText"
+
+
+class Page:
+    """
+    The parts of a page that the scraper needs, however they were extracted.
+    """
+    def __init__(self):
+        self.title = None           # text of the page title, if any
+        self.hidden_fields = {}     # name: value for the hidden form inputs
+        self.login_form = False     # is there a username input?
+        self.login_errors = False   # are there login validation errors?
+        self.degree_names = None    # list of degrees, if it's the plan list
+        self.wam = None             # text of the published WAM, if any
+        self.result_rows = None     # list of lists of (stripped) cell texts
+                                    # for each non-header row of the results
+                                    # table, if any
+
+    def is_login_page(self):
+        """
+        Is this the login form (or the login form showing validation errors),
+        rather than a results page?
+        """
+        return self.login_form or self.login_errors
+
+    def results(self, fingerprint=None):
+        """
+        :param fingerprint: The page's fingerprint, to record alongside the
+                            results (see `scrape.fingerprint`).
+        :return: The WAM and subject results on this page, as a `Transcript`.
+        """
+        print("Extracting WAM")
+        if self.wam is None:
+            print("Couldn't find WAM (no WAM yet?)")
+        print("Extracting subject results")
+        results = []
+        if self.result_rows is None:
+            print("Couldn't find results (no results yet?)")
+        else:
+            results = [result_from_cells(cells) for cells in self.result_rows]
+        return Transcript(self.wam, results, fingerprint)
+
+
+def result_from_cells(cells):
+    # cells is a list of strings containing this result's details e.g.:
+    # ['2019', 'Semester 1', 'COMP90045', 'PLI', '2', '99', 'H1', '12.500']
+    # extract the relevant details:               (^ btw this is 'version')
+    return Result.make(
+        subject=f"{cells[2]} {cells[3]}",
+        date=f"{cells[0]}, {cells[1]}",
+        mark=cells[5],
+        grade=cells[6],
+        credits=cells[8]
+    )
+
+
+# prefix a parser name with this to read pages in a pool of worker processes
+PROCESSES_PREFIX = "processes:"
+
+
+@functools.lru_cache()
+def get_extractor(parser):
+    """
+    Choose an extraction backend based on the configured parser name.
+
+    :param parser: "fast" to pick out just the parts of the page we need with
+                   regular expressions, "stream" to use the standard
+                   library's HTML tokenizer without building a tree, or the
+                   name of any HTML parser supported by BeautifulSoup (such
+                   as "html.parser" or "lxml") to parse the whole page. Any
+                   of these can be prefixed with "processes:" (e.g.
+                   "processes:lxml") to have the pages read in a pool of
+                   worker processes, one per core (see `ProcessExtractor`).
+    """
+    if parser.startswith(PROCESSES_PREFIX):
+        return ProcessExtractor(parser[len(PROCESSES_PREFIX):])
+    if parser == "fast":
+        return RegexExtractor()
+    if parser == "stream":
+        return TokenizerExtractor()
+    return SoupExtractor(parser)
+
+
+def start_workers(parser):
+    """
+    Start the worker processes for the backend `parser`, if it has any (see
+    `ProcessExtractor.start`). Every script should call this before it starts
+    any threads, since the workers are forked.
+    """
+    extractor = get_extractor(parser)
+    if isinstance(extractor, ProcessExtractor):
+        extractor.start()
+
+
+class Extractor:
+    """
+    The interface shared by the backends: `read` extracts a `Page` from a
+    page's raw content.
+    """
+    def read(self, content):
+        raise NotImplementedError
+
+    def read_transcript(self, content, fingerprint=None):
+        """:return: Just the results on a page, as a `Transcript`."""
+        return self.read(content).results(fingerprint)
+
+
+# # #
+# BeautifulSoup backend
+#
+
+class SoupExtractor(Extractor):
+    """
+    Parses the whole page into a BeautifulSoup tree, then searches it.
+    """
+    def __init__(self, parser="html.parser"):
+        # (imported here, so that the other backends don't need to load
+        # BeautifulSoup at all, which is a noticeable part of start-up time)
+        from bs4 import BeautifulSoup
+        self.BeautifulSoup = BeautifulSoup
+        self.parser = parser
+
+    def read(self, content):
+        soup = self.BeautifulSoup(content, self.parser)
+        page = Page()
+        title = soup.find(id=TITLE_ID)
+        if title is not None:
+            page.title = title.text
+        hidden_fields = soup.find_all('input', type='hidden')
+        page.hidden_fields = {tag['name']: tag['value'] for tag in hidden_fields}
+        page.login_form = soup.find('input', attrs={'name': USERNAME_FIELD}) \
+            is not None
+        page.login_errors = soup.find(id=LOGIN_ERRORS_ID) is not None
+        grid = soup.find("table", id=DEGREES_TABLE_ID)
+        if grid is not None:
+            rows = grid.find_all("tr")[1:] # skip header
+            page.degree_names = [row.find_all("td")[2].text for row in rows]
+        page.wam = find_wam(soup)
+        page.result_rows = find_result_rows(soup)
+        return page
+
+
+def find_wam(soup):
+    wam_para = soup.find(class_=WAM_CLASS)
+    if wam_para is None:
+        return None
+    return wam_para.find('b').text
+
+
+def find_result_rows(soup):
+    results_table = soup.find("table", id=RESULTS_TABLE_ID)
+    if results_table is None:
+        return None
+    rows = results_table.find_all("tr")[1:] # skip header
+    return [[cell.text.strip() for cell in row.find_all("td")] for row in rows]
+
+
+def parse_page(soup):
+    """
+    Extract the WAM and subject results from an already-parsed results page.
+
+    :return: A `Transcript` (without a fingerprint).
+    """
+    page = Page()
+    page.wam = find_wam(soup)
+    page.result_rows = find_result_rows(soup)
+    return page.results()
+
+
+# # #
+# Regular expression backend
+#
+
+class RegexExtractor(Extractor):
+    """
+    Jumps straight to the few parts of the page we need with (precompiled)
+    regular expressions, and only looks at the markup inside them. This
+    relies on the pages being the well-formed markup that ASP.NET generates
+    (e.g. closed <td>s and no nested tables in the grids), and is many times
+    faster than building a tree.
+    """
+    INPUT = re.compile(r'<input\b[^>]*>', re.IGNORECASE)
+    ATTR = re.compile(r'([^\s=/>]+)(?:\s*=\s*("[^"]*"|\'[^\']*\'|[^\s>]+))?')
+    TITLE = re.compile(r'id="' + TITLE_ID + '"')
+    WAM_PARA = re.compile(r'class="[^"]*\b' + WAM_CLASS + r'\b')
+    BOLD = re.compile(r'<b\b[^>]*>(.*?)</b\s*>', re.IGNORECASE | re.DOTALL)
+    TAG_NAME = re.compile(r'<(\w+)')
+    # (these are "unrolled" versions of e.g. <tr>(.*?)</tr>, which avoid
+    # checking for the end tag at every character)
+    ROW = re.compile(r'<tr\b[^>]*>([^<]*(?:<(?!/tr\s*>)[^<]*)*)</tr\s*>',
+        re.IGNORECASE)
+    CELL = re.compile(r'<td\b[^>]*>([^<]*(?:<(?!/td\s*>)[^<]*)*)</td\s*>',
+        re.IGNORECASE)
+    TAG = re.compile(r'<!--.*?-->|<[^>]*>', re.DOTALL)
+
+    @classmethod
+    def table(cls, table_id):
+        return re.compile(r'<table\b[^>]*\bid="' + table_id +
+            r'"[^>]*>(.*?)</table\s*>', re.IGNORECASE | re.DOTALL)
+
+    def __init__(self):
+        self.degrees_table = self.table(DEGREES_TABLE_ID)
+        self.results_table = self.table(RESULTS_TABLE_ID)
+
+    def read(self, content):
+        text = decode(content)
+        page = Page()
+        for tag in self.INPUT.findall(text):
+            attrs = self.attrs(tag)
+            if attrs.get("type") == "hidden":
+                page.hidden_fields[attrs.get("name")] = attrs.get("value", "")
+            if attrs.get("name") == USERNAME_FIELD:
+                page.login_form = True
+        page.login_errors = f'id="{LOGIN_ERRORS_ID}"' in text
+        title = self.element(text, self.TITLE)
+        if title is not None:
+            page.title = self.text(title)
+        grid = self.degrees_table.search(text)
+        if grid is not None:
+            rows = self.rows(grid.group(1))
+            page.degree_names = [cells[2] for cells in rows]
+        wam_para = self.element(text, self.WAM_PARA)
+        if wam_para is not None:
+            bold = self.BOLD.search(wam_para)
+            if bold is not None:
+                page.wam = self.text(bold.group(1))
+        table = self.results_table.search(text)
+        if table is not None:
+            page.result_rows = [[cell.strip() for cell in cells]
+                for cells in self.rows(table.group(1))]
+        return page
+
+    def element(self, text, attr):
+        """
+        Find the first element with a start tag matching an attribute regex.
+
+        :return: The markup inside the element, or None if there is none.
+        """
+        # searching for the attribute first (rather than for a whole start
+        # tag) avoids trying a match at every '<' in the (huge) page
+        for match in attr.finditer(text):
+            if not text[match.start()-1:match.start()].isspace():
+                continue # part of some other attribute's name
+            start = text.rfind("<", 0, match.start())
+            if start == -1 or ">" in text[start:match.start()]:
+                continue # not inside a tag
+            tag = self.TAG_NAME.match(text, start)
+            end = text.find(">", match.end())
+            if tag is None or end == -1:
+                continue
+            close = text.find(f"</{tag.group(1)}", end)
+            return text[end+1:close if close != -1 else len(text)]
+        return None
+
+    def attrs(self, tag):
+        attrs = {}
+        # skip the '<input' itself, and match name(=value) pairs
+        for name, value in self.ATTR.findall(tag[6:].rstrip('/>')):
+            if value[:1] in {'"', "'"}:
+                value = value[1:-1]
+            attrs.setdefault(name.lower(), html.unescape(value))
+        return attrs
+
+    def rows(self, table):
+        """:return: Each non-header row's list of (unstripped) cell texts."""
+        rows = self.ROW.findall(table)[1:] # skip header
+        return [[self.text(cell) for cell in self.CELL.findall(row)]
+            for row in rows]
+
+    def text(self, markup):
+        """:return: The text content of some markup, as with Tag.text."""
+        if "<" in markup:
+            markup = self.TAG.sub("", markup)
+        if "&" in markup:
+            markup = html.unescape(markup)
+        return markup
+
+
+# # #
+# Streaming tokenizer backend
+#
+
+class TokenizerExtractor(Extractor):
+    """
+    Makes a single pass over the page's tags and text with the standard
+    library's HTML tokenizer, picking out only what we need, without ever
+    building a tree.
+    """
+    def read(self, content):
+        tokenizer = PageTokenizer()
+        tokenizer.feed(decode(content))
+        tokenizer.close()
+        return tokenizer.page
+
+
+def decode(content):
+    """Decode raw page content (the results pages are served as UTF-8)."""
+    if isinstance(content, str):
+        return content
+    try:
+        return content.decode("utf-8")
+    except UnicodeDecodeError:
+        return content.decode("windows-1252", errors="replace")
+
+
+class Element:
+    """
+    An element whose contents we're interested in, open until the end tag
+    matching its start tag (counting nested elements with the same name).
+    """
+    def __init__(self, name, tag):
+        self.name = name
+        self.tag = tag
+        self.depth = 1
+        self.text = []
+
+    def start(self, tag):
+        if tag == self.tag:
+            self.depth += 1
+
+    def end(self, tag):
+        """:return: True iff this end tag closes the element."""
+        if tag == self.tag:
+            self.depth -= 1
+        return self.depth == 0
+
+    def data(self, data):
+        self.text.append(data)
+
+
+class Grid(Element):
+    """A table element, collecting the text of the cells in each row."""
+    def __init__(self, name):
+        super().__init__(name, "table")
+        self.rows = []
+        self.cell = None
+
+    def start(self, tag):
+        super().start(tag)
+        if self.cell is not None:
+            self.cell.start(tag)
+        elif self.depth == 1 and tag == "tr":
+            self.rows.append([])
+        elif self.depth == 1 and tag == "td" and self.rows:
+            self.cell = Element("td", "td")
+            self.rows[-1].append(self.cell.text)
+
+    def end(self, tag):
+        if self.cell is not None and self.cell.end(tag):
+            self.cell = None
+        return super().end(tag)
+
+    def data(self, data):
+        if self.cell is not None:
+            self.cell.data(data)
+
+    def cells(self):
+        """:return: A list of the cell texts for each row after the header."""
+        return [["".join(cell) for cell in row] for row in self.rows[1:]]
+
+
+class PageTokenizer(HTMLParser):
+    """
+    Builds up a `Page` from a stream of tags and text. Like BeautifulSoup's
+    find(), only the first matching element of each kind is used.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.page = Page()
+        self.open = []      # elements we're currently inside (and capturing)
+        self.seen = set()   # names of elements we've already captured
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        for element in self.open:
+            element.start(tag)
+        element_id = attrs.get("id")
+        if tag == "input":
+            if attrs.get("type") == "hidden":
+                self.page.hidden_fields[attrs.get("name")] = \
+                    attrs.get("value") or ""
+            if attrs.get("name") == USERNAME_FIELD:
+                self.page.login_form = True
+        if element_id == LOGIN_ERRORS_ID:
+            self.page.login_errors = True
+        elif element_id == TITLE_ID:
+            self.capture(Element("title", tag))
+        elif tag == "table" and element_id in (DEGREES_TABLE_ID,
+                RESULTS_TABLE_ID):
+            self.capture(Grid(element_id))
+        if WAM_CLASS in (attrs.get("class") or "").split():
+            self.capture(Element("wam_para", tag))
+        elif tag == "b" and any(e.name == "wam_para" for e in self.open):
+            self.capture(Element("wam", tag))
+
+    def capture(self, element):
+        if element.name not in self.seen:
+            self.seen.add(element.name)
+            self.open.append(element)
+
+    def handle_endtag(self, tag):
+        still_open = []
+        for element in self.open:
+            if element.end(tag):
+                self.finish(element)
+            else:
+                still_open.append(element)
+        self.open = still_open
+
+    def handle_data(self, data):
+        for element in self.open:
+            element.data(data)
+
+    def finish(self, element):
+        if element.name == "title":
+            self.page.title = "".join(element.text)
+        elif element.name == "wam":
+            self.page.wam = "".join(element.text)
+        elif element.name == DEGREES_TABLE_ID:
+            self.page.degree_names = [row[2] for row in element.cells()]
+        elif element.name == RESULTS_TABLE_ID:
+            self.page.result_rows = [[cell.strip() for cell in row]
+                for row in element.cells()]
+
+
+# # #
+# Worker process pool (wrapping any of the above)
+#
+
+class ProcessExtractor(Extractor):
+    """
+    Sends the raw pages to a pool of worker processes to be read by another
+    backend, so that parsing (which holds the GIL) for many accounts at once
+    can use every core, rather than one core shared by all of the checking
+    threads.
+
+    Only what the scraper needs comes back from the workers: for results
+    pages, just the `Transcript` (see `read_transcript`), not the page's
+    (large) hidden form fields.
+    """
+    def __init__(self, parser, workers=None):
+        """
+        :param parser: The backend for the workers to use (see
+                       `get_extractor`).
+        :param workers: The number of worker processes (default: one per
+                        core).
+        """
+        self.parser = parser
+        self.workers = workers or os.cpu_count()
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Start the worker processes. Where new processes are forked, they must
+        be started before starting any threads (see `start_workers`), since
+        a forked worker only inherits the thread that forked it, and any
+        locks held by the others at the time would stay locked forever.
+        Otherwise, this happens the first time a page is read.
+        """
+        with self.lock:
+            if self.pool is None:
+                if threading.active_count() > 1:
+                    print("Warning: starting parser worker processes after "
+                        "other threads have started (see start_workers)")
+                # fork where we can, since otherwise each worker re-runs the
+                # script's configuration (prompts and all) as it starts up
+                context = None
+                if "fork" in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context("fork")
+                self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                    mp_context=context)
+                # (the workers are started on the first submission)
+                self.pool.submit(get_extractor, self.parser).result()
+        return self.pool
+
+    def stop(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+
+    def read(self, content):
+        return self.start().submit(read_page, self.parser, content).result()
+
+    def read_transcript(self, content, fingerprint=None):
+        transcript = self.start().submit(read_transcript, self.parser, content,
+            fingerprint).result()
+        # (strings arrive from the workers as fresh copies, so intern them)
+        return Transcript(transcript.wam, [Result.make(*result)
+            for result in transcript.results], transcript.fingerprint)
+
+
+def read_page(parser, content):
+    """Read a page (in a worker process)."""
+    return get_extractor(parser).read(content)
+
+
+def read_transcript(parser, content, fingerprint=None):
+    """Read a results page's results (in a worker process)."""
+    return get_extractor(parser).read_transcript(content, fingerprint)
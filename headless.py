@@ -0,0 +1,343 @@
+"""
+run WAM Spam without any prompts (e.g. from cron, or as a service), configured
+by a JSON file and/or environment variables
+
+usage: python3 headless.py [--config wamspam.json] [--once] [--hello]
+
+the config file holds a JSON object with any of the settings in SETTINGS
+(lowercase versions of the constants in settings.py), and either the
+details of one student's account (as for an entry of an accounts file, see
+`accounts.load_accounts`), or an "accounts_file" naming a whole accounts file.
+for example:
+
+    {
+        "username": "mfarrugia",
+        "notifiers": [{"method": "slack", "hook_url": "https://..."}],
+        "delay_between_checks": 30
+    }
+
+every setting can also be given in an environment variable named after it,
+e.g. WAMSPAM_DELAY_BETWEEN_CHECKS=30 (or WAMSPAM_PASSWORD, to keep a password
+out of the config file). environment variables take precedence.
+
+with --once, each account is checked once, and the script exits with status
+0 if nothing changed, 3 if a change was found (and notified), or 1 if any
+check failed (2 means the configuration is bad)
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+
+STARTED = time.perf_counter()
+
+from accounts import make_accounts, notify_all, poll_and_notify, sweep
+import settings
+
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_BAD_CONFIG = 2
+EXIT_CHANGED = 3
+
+# settings with a different name here than in settings.py (lowercase aside)
+RENAMED = {"BS4_PARSER": "parser"}
+
+# the settings, and their defaults: those shared with the other scripts (see
+# settings.py, where each is described), in lowercase, plus a few of this
+# script's (and daemon.py's) own
+SETTINGS = {RENAMED.get(name, name.lower()): value
+    for name, value in vars(settings).items() if name.isupper()}
+SETTINGS.update({
+    "accounts_file": None,
+    "record_cassette": None,
+    "replay_cassette": None,
+    "control_port": 8765, # daemon.py only
+    "control_token": None, # daemon.py only
+    "control_token_file": "control-token", # daemon.py only
+})
+
+# the details of a single account (see `accounts.load_accounts`)
+ACCOUNT_KEYS = ["username", "password", "results_filename", "degrees",
+    "default_degree_name", "notifiers"]
+
+ENV_PREFIX = "WAMSPAM_"
+
+
+class ConfigError(Exception):
+    """Represent a problem with the configuration"""
+
+
+def load_config(filename=None, environ=os.environ):
+    """
+    Read the configuration from a JSON file (if given) and the environment.
+
+    :return: A dict with every setting from SETTINGS, plus any account keys.
+    """
+    config = dict(SETTINGS)
+    if filename is not None:
+        try:
+            with open(filename) as configfile:
+                overrides = json.load(configfile)
+        except (OSError, ValueError) as e:
+            raise ConfigError(f"Couldn't read config file {filename}: {e}")
+        if not isinstance(overrides, dict):
+            raise ConfigError(f"Config file {filename} should hold an object")
+        config.update(overrides)
+    for key in list(SETTINGS) + ACCOUNT_KEYS:
+        value = environ.get(ENV_PREFIX + key.upper())
+        if value is None:
+            continue
+        if key in {"username", "password"}:
+            config[key] = value
+        else:
+            try:
+                config[key] = json.loads(value)
+            except ValueError:
+                # a plain string (e.g. a filename)
+                config[key] = value
+    unknown = config.keys() - SETTINGS.keys() - set(ACCOUNT_KEYS)
+    if unknown:
+        raise ConfigError(f"Unknown settings: {', '.join(sorted(unknown))}")
+    if config["accounts_file"] is None and "username" not in config:
+        raise ConfigError("Configure a username (or an accounts_file)")
+    if config["accounts_file"] is None and "password" not in config:
+        raise ConfigError("Configure a password (e.g. in WAMSPAM_PASSWORD)")
+    return config
+
+
+def make_everything(config):
+    """
+    Set up the accounts (and their shared stores, sessions, etc.) from a
+    configuration. Optional components are only imported if they're used.
+
+    :return: (accounts, outbox, digest), where outbox and digest may be
+             None.
+    """
+    entries = load_entries(config)
+    cassette = make_cassette(config)
+    options, notify_options = make_options(config, cassette)
+    try:
+        if cassette is not None:
+            entries = cassette.prepare_entries(entries)
+        accounts = make_accounts(entries, **notify_options, **options)
+    except (ValueError, KeyError, TypeError, ImportError) as e:
+        raise ConfigError(f"Couldn't set up accounts: "
+            f"{e.__class__.__name__}: {e}")
+    return accounts, options.get("outbox"), options.get("digest")
+
+
+def load_entries(config):
+    """
+    :return: The accounts configured, as a list of accounts file entries
+             (see `accounts.load_accounts`).
+    """
+    if config["accounts_file"] is None:
+        return [{key: config[key] for key in ACCOUNT_KEYS if key in config}]
+    try:
+        with open(config["accounts_file"]) as accountsfile:
+            return json.load(accountsfile)
+    except (OSError, ValueError) as e:
+        raise ConfigError(f"Couldn't read accounts file: {e}")
+
+
+def make_cassette(config):
+    """
+    :return: A `cassette.Cassette` to record the checks' HTTP traffic to (or
+             to replay it from), or None.
+    """
+    if config["record_cassette"] and config["replay_cassette"]:
+        raise ConfigError("Set record_cassette or replay_cassette, not both")
+    if not (config["record_cassette"] or config["replay_cassette"]):
+        return None
+    from cassette import Cassette
+    try:
+        if config["record_cassette"]:
+            return Cassette(config["record_cassette"], "record")
+        return Cassette(config["replay_cassette"], "replay")
+    except (OSError, ValueError) as e:
+        raise ConfigError(f"Couldn't read cassette: {e}")
+
+
+def make_options(config, cassette=None):
+    """
+    Set up the stores, sessions, etc. shared by all of the accounts.
+
+    :param cassette: A `cassette.Cassette` to send all of the accounts' (and
+                     notifiers') HTTP requests through, or None.
+    :return: (options, notify_options), the keyword arguments to pass to
+             `accounts.make_accounts` (options may include an "outbox" and a
+             "digest").
+    """
+    from session import SessionManager
+    from store import FileStore
+    from extract import PROCESSES_PREFIX, start_workers
+    parser = config["parser"]
+    if config["parse_in_processes"]:
+        parser = PROCESSES_PREFIX + parser
+    # (any worker processes are started now, before any threads)
+    start_workers(parser)
+    options = {
+        "parser": parser,
+        "sessions": SessionManager(config["cookie_dir"],
+            transport=cassette and cassette.adapter),
+        "base_url": config["base_url"],
+        "stream": config["stream_pages"],
+        "store": FileStore(),
+    }
+    if config["results_database"]:
+        from store import SQLiteStore
+        options["store"] = SQLiteStore(config["results_database"])
+    if config["outbox_filename"]:
+        from outbox import Outbox
+        options["outbox"] = Outbox(config["outbox_filename"])
+    if config["digest_interval"] is not None:
+        from digest import Digest
+        options["digest"] = Digest()
+    from ratelimit import RateLimiter
+    from notify.connections import set_timeout
+    rate = config["max_requests_per_second"]
+    timeout = (config["connect_timeout"], config["read_timeout"])
+    options["limiter"] = RateLimiter(rate=rate, burst=rate or 1,
+        max_in_flight=config["max_requests_in_flight"],
+        endpoints={"login": (config["max_logins_per_second"], 1)},
+        timeout=timeout, hedge=config["hedge_requests"])
+    set_timeout(*timeout)
+    if cassette is not None:
+        from cassette import NOTIFIERS_TRACK
+        from notify.connections import wrap_adapter
+        wrap_adapter(lambda adapter: cassette.adapter(NOTIFIERS_TRACK,
+            adapter))
+    notify_options = {
+        "notify_concurrently": config["notify_concurrently"],
+        "notify_timeout": config["notify_timeout"],
+    }
+    return options, notify_options
+
+
+def make_hello(config):
+    """:return: The test message, describing the configured schedule."""
+    import messages
+    return messages.hello_message(delay=config["delay_between_checks"],
+        max_delay=config["max_delay_between_checks"],
+        stable_after=config["stable_after"],
+        release_windows=config["release_windows"],
+        release_delay=config["delay_during_release"])
+
+
+def make_task(config):
+    """
+    :return: The check to run for each account: `accounts.poll_and_notify`,
+             profiled as configured (see `profiling.Profiler`). Must be
+             called from the main thread, to listen for the signal to start
+             profiling.
+    """
+    if not (config["profile_cycles"] or config["profile_cycles_on_signal"]):
+        return poll_and_notify
+    from profiling import Profiler
+    profiler = Profiler(config["profile_dir"], cycles=config["profile_cycles"],
+        memory_top=config["profile_memory_top"])
+    if config["profile_cycles_on_signal"]:
+        profiler.install_signal_handler(config["profile_cycles_on_signal"])
+    return profiler.wrap(poll_and_notify)
+
+
+def make_scheduler(config, task=poll_and_notify):
+    from scheduler import Scheduler
+    windows = [(parse_time(start), parse_time(end))
+        for start, end in config["release_windows"]]
+    return Scheduler(task=task,
+        delay=config["delay_between_checks"] * 60,
+        max_delay=config["max_delay_between_checks"] * 60,
+        stable_after=config["stable_after"] * 60 * 60,
+        release_windows=windows,
+        release_delay=config["delay_during_release"] * 60,
+        max_workers=config["max_workers"])
+
+
+def parse_time(text):
+    if isinstance(text, datetime):
+        # (a default from settings.py)
+        return text
+    try:
+        return datetime.strptime(text, "%Y-%m-%d %H:%M")
+    except ValueError as e:
+        raise ConfigError(f"Bad release window time {text!r}: {e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--config", default=os.environ.get("WAMSPAM_CONFIG"),
+        help="JSON config file (default: $WAMSPAM_CONFIG, if set)")
+    parser.add_argument("--once", action="store_true",
+        help="check each account once, then exit with status 0 (no changes), "
+        "3 (changes found) or 1 (a check failed)")
+    parser.add_argument("--hello", action="store_true",
+        help="start by sending everyone a test message")
+    args = parser.parse_args(argv)
+
+    try:
+        config = load_config(args.config)
+        accounts, outbox, digest = make_everything(config)
+        task = make_task(config)
+        scheduler = None if args.once else make_scheduler(config, task)
+    except ConfigError as e:
+        print(f"Bad configuration: {e}", file=sys.stderr)
+        return EXIT_BAD_CONFIG
+    if config["metrics_port"] is not None:
+        import metrics
+        metrics.serve(config["metrics_port"])
+    if config["metrics_filename"] is not None:
+        import metrics
+        dumper = metrics.MetricsDumper(config["metrics_filename"])
+        dumper.start()
+    print(f"Ready to check {len(accounts)} account(s) after "
+        f"{(time.perf_counter() - STARTED) * 1000:.0f} ms")
+
+    if args.hello:
+        hello = make_hello(config)
+        notify_all(accounts, *hello, max_workers=config["max_workers"])
+
+    if args.once:
+        changed = []
+        def check(account):
+            if task(account):
+                changed.append(account)
+        failures = sweep(accounts, task=check,
+            max_workers=config["max_workers"])
+        for account, e in failures.items():
+            print(f"Exception encountered for {account.username}:")
+            print(f"{e.__class__.__name__}: {e}")
+        # send everything collected in the digest, and give any queued
+        # messages a chance to go out before we stop
+        if digest is not None:
+            digest.flush()
+        if outbox is not None:
+            outbox.deliver_due(accounts)
+        if config["metrics_filename"] is not None:
+            dumper.stop()
+        if failures:
+            return EXIT_FAILED
+        if changed:
+            return EXIT_CHANGED
+        return EXIT_OK
+
+    if outbox is not None:
+        from outbox import DeliveryWorker
+        DeliveryWorker(outbox, accounts).start()
+    if digest is not None:
+        from digest import DigestWorker
+        DigestWorker(digest, config["digest_interval"] * 60).start()
+    for account in accounts:
+        scheduler.add(account)
+    scheduler.run()
+    return EXIT_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,18 +7,44 @@ HELLO_MESSAGE = (
     "Hello there!\n"
     "\n"
     "I'm WAM Spammer. This is just a message to let you know I'm running and "
-    "to test our notification configuration. I'll check for changes to your "
-    "results once every {delay} minutes---unless I crash! Every now and then, "
-    "you should probably check on me to make sure nothing has gone wrong.\n"
+    "to test our notification configuration. {schedule}---unless I crash! "
+    "Every now and then, you should probably check on me to make sure nothing "
+    "has gone wrong.\n"
     "\n"
     "Love,\n"
     "WAM Spammer"
 )
+HELLO_SCHEDULE = "I'll check for changes to your results every {delay} minutes"
+HELLO_BACKOFF = (
+    " at first. Once they've stayed the same for {stable_after} "
+    "hours, I'll gradually check less often, down to once every {max_delay} "
+    "minutes, and go back to every {delay} minutes as soon as they change"
+)
+HELLO_RELEASE = (
+    ". During the release times you gave me, I'll check at least every "
+    "{release_delay} minutes"
+)
 
-def hello_message(delay):
+def hello_message(delay, max_delay=None, stable_after=None,
+        release_windows=(), release_delay=None):
+    """
+    :param delay: The usual minutes between checks.
+    :param max_delay: The most minutes between checks, once the results have
+                      stayed the same for `stable_after` hours (None if the
+                      checks don't back off).
+    :param release_windows: The (start, end) times when results are likely
+                            to be released, if any, during which the checks
+                            happen at least every `release_delay` minutes.
+    """
+    schedule = HELLO_SCHEDULE.format(delay=delay)
+    if max_delay is not None and max_delay > delay:
+        schedule += HELLO_BACKOFF.format(delay=delay, max_delay=max_delay,
+            stable_after=stable_after)
+    if release_windows:
+        schedule += HELLO_RELEASE.format(release_delay=release_delay)
     return (
         HELLO_SUBJECT,
-        HELLO_MESSAGE.format(delay=delay)
+        HELLO_MESSAGE.format(schedule=schedule)
     )
 
 
@@ -46,18 +72,23 @@ def initial_message(degree, results_data):
 
 RESULT_LINE = "* {pre}{mark:>3} {grade:>3} - {subject} ({date}, {credits}pts){post}\n"
 
-def flatten_results(results_data):
-    lines = []
-    lines.append(f"Published WAM: {results_data['wam']}\n")
-    if results_data["results"]:
-        lines.append("Results:\n")
-    for result in results_data['results']:
-        if "pre" in result and "post" in result:
-            lines.append(RESULT_LINE.format(**result))
-        else:
-            lines.append(RESULT_LINE.format(pre='', post='', **result))
-    return "".join(lines)
+def flatten_results(transcript):
+    return flatten_lines(transcript.wam,
+        [("", result, "") for result in transcript.results])
 
+def flatten_lines(wam, lines):
+    """
+    :param wam: The WAM text to show.
+    :param lines: A list of (pre, result, post) tuples, where pre and post are
+                  annotations to show either side of the `records.Result`.
+    """
+    text = []
+    text.append(f"Published WAM: {wam}\n")
+    if lines:
+        text.append("Results:\n")
+    for pre, result, post in lines:
+        text.append(RESULT_LINE.format(pre=pre, post=post, **result._asdict()))
+    return "".join(text)
 
 UPDATE_SUBJECT = "Results update detected - {degree}"
 UPDATE_MESSAGE = (
@@ -87,67 +118,61 @@ MOOD_NEUTRAL = (
     "holiday break!\n"
 )
 
-def update_message(degree, before, after):
-    diff, mood = results_diff(before, after)
-    results_change = flatten_results(diff)
+def update_message(degree, changes):
+    """
+    :param changes: A `diff.ChangeSet` of the degree's results.
+    """
+    results_change = flatten_changes(changes)
     return (
         UPDATE_SUBJECT.format(degree=degree),
         UPDATE_MESSAGE.format(
             degree=degree,
             results_change=results_change,
-            mood=mood
+            mood=changes_mood(changes)
         )
     )
 
-def results_diff(before, after):
-    diff = {}
-    mood = MOOD_NEUTRAL
+def changes_mood(changes):
+    delta = changes.wam_delta()
+    if delta is None or not changes.wam_changed():
+        return MOOD_NEUTRAL
+    if delta > 0:
+        return MOOD_INCREASE
+    else: # new < old (we know they differ)
+        return MOOD_DECREASE
+
+def flatten_changes(changes):
     # difference in wam:
-    if before["wam"] != after["wam"]:
-        if before["wam"] is None:
-            diff["wam"] = f'(new) {after["wam"]}'
-        elif after["wam"] is None:
-            diff["wam"] = f'(removed: {before["wam"]})'
-        else:     
-            old = float(before["wam"])
-            new = float(after["wam"])
-            if new > old:
-                mood = MOOD_INCREASE
-            else: # new < old (we know they differ)
-                mood = MOOD_DECREASE
-            diff["wam"] = f'{after["wam"]} (was: {before["wam"]})'
+    if not changes.wam_changed():
+        wam = f'{changes.new_wam} (no change)'
+    elif changes.old_wam is None:
+        wam = f'(new) {changes.new_wam}'
+    elif changes.new_wam is None:
+        wam = f'(removed: {changes.old_wam})'
     else:
-        diff["wam"] = f'{after["wam"]} (no change)'
+        wam = f'{changes.new_wam} (was: {changes.old_wam})'
     # difference in subject results:
-    diff_results = []
-    old_results = before["results"]
-    new_results = after["results"]
-    old_subjects = {r["subject"] + " " + r["date"]: r for r in old_results}
-    new_subjects = {r["subject"] + " " + r["date"]: r for r in new_results}
-    old_set = set(old_subjects)
-    new_set = set(new_subjects)
-    # subjects changed:
-    for subject in old_set & new_set:
-        old_result = old_subjects[subject]
-        new_result = new_subjects[subject]
-        if old_result != new_result:
-            result = new_result.copy()
-            result["pre"] = ""
-            result["post"] = f' (was: {old_result["mark"]} {old_result["grade"]})'
-            diff_results.append(result)
-    # subjects added:
-    for subject in new_set - old_set:
-        new_result = new_subjects[subject]
-        result = new_result.copy()
-        result["pre"] = "(new) "
-        result["post"] = ""
-        diff_results.append(result)
-    # subjects removed:
-    for subject in old_set - new_set:
-        old_result = old_subjects[subject]
-        result = old_result.copy()
-        result["pre"] = "(removed: "
-        result["post"] = ")"
-        diff_results.append(result)
-    diff["results"] = diff_results
-    return diff, mood
+    lines = []
+    for old_result, new_result in changes.changed:
+        post = f' (was: {old_result.mark} {old_result.grade})'
+        lines.append(("", new_result, post))
+    for result in changes.added:
+        lines.append(("(new) ", result, ""))
+    for result in changes.removed:
+        lines.append(("(removed: ", result, ")"))
+    return flatten_lines(wam, lines)
+
+DIGEST_SUBJECT = "{n} results updates detected"
+DIGEST_SECTION = "=== {username}: {subject} ===\n\n{text}\n"
+
+def digest_message(messages):
+    """
+    Combine several messages into one (see `digest.Digest`).
+
+    :param messages: A list of (username, subject, text) tuples.
+    """
+    return (
+        DIGEST_SUBJECT.format(n=len(messages)),
+        "\n".join(DIGEST_SECTION.format(username=username, subject=subject,
+            text=text) for username, subject, text in messages)
+    )
@@ -0,0 +1,213 @@
+"""
+timings and counts of what the script has been doing, to help find the slow
+parts, exposed in Prometheus' text format over HTTP or dumped as JSON
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import os
+import json
+import time
+import bisect
+import tempfile
+import threading
+import contextlib
+
+
+# the upper bounds of the timing histograms' buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+    5.0, 10.0, 30.0, 60.0)
+
+# all of the metrics' names start with this
+PREFIX = "wamspam_"
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last is for +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """:return: (upper bound, count) pairs, as Prometheus expects."""
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+
+class Metrics:
+    """
+    A collection of counters and timing histograms, each identified by a
+    name and some labels (e.g. `timer("stage_seconds", stage="login")`).
+    """
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def count(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Time the body of a with statement (whether or not it succeeds)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def prometheus(self):
+        """:return: The metrics, in Prometheus' text exposition format."""
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+                for (other, labels), value in sorted(self.counters.items()):
+                    if other == name:
+                        lines.append(f"{PREFIX}{name}{format_labels(labels)} "
+                            f"{value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                for (other, labels), histogram in \
+                        sorted(self.histograms.items()):
+                    if other != name:
+                        continue
+                    for bound, count in histogram.cumulative():
+                        le = labels + (("le", "+Inf" if bound == float("inf")
+                            else repr(bound)),)
+                        lines.append(f"{PREFIX}{name}_bucket"
+                            f"{format_labels(le)} {count}")
+                    lines.append(f"{PREFIX}{name}_sum{format_labels(labels)} "
+                        f"{histogram.sum}")
+                    lines.append(f"{PREFIX}{name}_count"
+                        f"{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_json(self):
+        """:return: The metrics, in a JSON-serialisable form."""
+        with self.lock:
+            return {
+                "time": time.time(),
+                "counters": [{"name": name, "labels": dict(labels),
+                    "value": value}
+                    for (name, labels), value in self.counters.items()],
+                "histograms": [{"name": name, "labels": dict(labels),
+                    "count": histogram.count, "sum": histogram.sum,
+                    "buckets": [[bound, count] for bound, count in
+                        histogram.cumulative() if bound != float("inf")]}
+                    for (name, labels), histogram in self.histograms.items()],
+            }
+
+    def dump(self, filename):
+        """Write the metrics to a JSON file (replacing it atomically)."""
+        directory = os.path.dirname(os.path.abspath(filename))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+        try:
+            with os.fdopen(fd, 'w') as metricsfile:
+                json.dump(self.to_json(), metricsfile, indent=2)
+            os.replace(tmp, filename)
+        except:
+            os.remove(tmp)
+            raise
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) \
+        + "}"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"') \
+        .replace("\n", "\\n")
+
+
+# the metrics for this process, shared by everything that records them
+METRICS = Metrics()
+count = METRICS.count
+observe = METRICS.observe
+timer = METRICS.timer
+
+
+def serve(port, address="127.0.0.1", metrics=METRICS):
+    """
+    Serve the metrics at http://{address}:{port}/metrics (Prometheus' text
+    format) and /metrics.json, from a background thread.
+
+    :return: The server (call its `shutdown` method to stop it).
+    """
+    # (imported here, since most runs don't serve metrics, and http.server
+    # takes a while to import)
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = metrics.prometheus().encode()
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            elif self.path == "/metrics.json":
+                body = json.dumps(metrics.to_json()).encode()
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # don't clutter the script's own output
+
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class MetricsDumper:
+    """
+    A background thread which dumps the metrics to a JSON file every
+    `interval` seconds.
+    """
+    def __init__(self, filename, interval=60, metrics=METRICS):
+        self.filename = filename
+        self.interval = interval
+        self.metrics = metrics
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+        self.metrics.dump(self.filename)
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                self.metrics.dump(self.filename)
+            except Exception as e:
+                print("Exception encountered dumping metrics:")
+                print(f"{e.__class__.__name__}: {e}")
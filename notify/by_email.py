@@ -4,18 +4,28 @@ SMTP-based Gmail notifier
 :author: Matthew Farrugia-Roberts
 """
 
+import time
 import getpass
 import smtplib
+import threading
 from email.mime.text import MIMEText
 
 
 GMAIL_SMTP_HOST = "smtp.gmail.com"
 GMAIL_SMTP_PORT = 587
 
+# servers tend to drop connections that have been idle for a while, so we
+# reconnect rather than reuse a connection that's been idle for this long
+SMTP_IDLE_TIMEOUT = 60 # seconds
+
+# give up on an unresponsive SMTP server after this long
+SMTP_TIMEOUT = 30 # seconds
+
 
 class SMTPGmailNotifier:
     def __init__(self, address, password, smtp_host=GMAIL_SMTP_HOST,
-                    smtp_port=GMAIL_SMTP_PORT, debug=False):
+                    smtp_port=GMAIL_SMTP_PORT, debug=False,
+                    timeout=SMTP_TIMEOUT):
         """
         :param address: The email address to use (as all three of SMTP login 
                         username, email sender, and email recipient).
@@ -23,6 +33,8 @@ class SMTPGmailNotifier:
         :param smtp_host: Name of the SMTP server.
         :param smtp_port: Port of the SMTP server.
         :param debug: Set True to inhibit sending actual messages
+        :param timeout: Seconds to wait on the SMTP server (for connecting,
+                        or for any reply) before giving up.
         """
         print("Configuring SMTP Gmail Notifier...")
         self.address = address
@@ -30,6 +42,11 @@ class SMTPGmailNotifier:
         self.host = smtp_host
         self.port = smtp_port
         self.debug = debug
+        self.timeout = timeout
+        # a logged-in connection, kept open between messages
+        self.smtp = None
+        self.last_used = None
+        self.lock = threading.Lock()
 
     def notify(self, subject: str, text: str) -> None:
         """
@@ -54,10 +71,44 @@ class SMTPGmailNotifier:
             print("(Debug mode. Not sending)")
             return
 
-        # log into the SMTP server to send it
-        s = smtplib.SMTP(self.host, self.port)
-        s.ehlo(); s.starttls()
-        s.login(self.address, self.password)
-        s.sendmail(self.address, [self.address], msg.as_string())
-        s.quit()
+        # send it through our SMTP server connection
+        with self.lock:
+            try:
+                self.connection().sendmail(self.address, [self.address],
+                    msg.as_string())
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                # the server must have dropped the connection. try once more
+                # with a fresh one
+                print("Lost SMTP connection. Reconnecting...")
+                self.disconnect()
+                self.connection().sendmail(self.address, [self.address],
+                    msg.as_string())
+            self.last_used = time.monotonic()
         print("Sent!")
+
+    def connection(self):
+        """
+        Get a logged-in SMTP connection, reusing the one from last time unless
+        it has been idle for too long.
+        """
+        if self.smtp is not None and \
+                time.monotonic() - self.last_used > SMTP_IDLE_TIMEOUT:
+            self.disconnect()
+        if self.smtp is None:
+            # log into the SMTP server
+            s = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            s.ehlo(); s.starttls()
+            s.login(self.address, self.password)
+            self.smtp = s
+            self.last_used = time.monotonic()
+        return self.smtp
+
+    def disconnect(self):
+        """Close the SMTP connection (if it's open)."""
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                # it's probably already closed
+                pass
+            self.smtp = None
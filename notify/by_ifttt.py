@@ -4,7 +4,7 @@ IFTTT Webbhook-based notifier
 :author: blueset
 """
 
-import requests
+from notify.connections import http_session
 
 
 class IFTTTWebhookNotifier:
@@ -28,7 +28,7 @@ class IFTTTWebhookNotifier:
             "value2": text
         }
 
-        r = requests.post(self.entry_point, json=data)
+        r = http_session().post(self.entry_point, json=data)
         if r.status_code != 200:
             raise Exception(r.status_code, r.text)
         
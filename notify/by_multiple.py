@@ -4,27 +4,97 @@ Multiple-method notifier
 :author: Matthew Farrugia-Roberts
 """
 
+import time
+from concurrent import futures
+
+import metrics
+
+
 class MultiNotifier:
-    def __init__(self, notifiers=None):
+    def __init__(self, notifiers=None, concurrent=False, timeout=None):
+        """
+        :param notifiers: Initial list of notifiers to send messages through.
+        :param concurrent: Set True to send through all of the notifiers at
+                           once, rather than one after another.
+        :param timeout: In concurrent mode, the default number of seconds to
+                        wait for each notifier before counting it as failed
+                        (None to wait as long as it takes).
+        """
         if notifiers is not None:
             self.notifiers = notifiers
         else:
             self.notifiers = []
+        self.concurrent = concurrent
+        self.timeout = timeout
+        self.timeouts = {}
 
-    def add_notifier(self, notifier):
+    def add_notifier(self, notifier, timeout=None):
+        """
+        :param notifier: The notifier to add.
+        :param timeout: In concurrent mode, seconds to wait for this notifier
+                        in particular (default: the multi-notifier's timeout).
+        """
         self.notifiers.append(notifier)
+        if timeout is not None:
+            self.timeouts[notifier] = timeout
 
     def notify(self, subject: str, text: str) -> None:
         print("Triggering all notification methods...")
+        if self.concurrent:
+            problems = self.notify_concurrently(subject, text)
+        else:
+            problems = []
+            for notifier in self.notifiers:
+                try:
+                    send(notifier, subject, text)
+                except Exception as e:
+                    problems.append((notifier, e))
+        for notifier, _ in problems:
+            metrics.count("notify_failures_total", method=method(notifier))
+        nfail = len(problems)
+        nsuccess = len(self.notifiers) - nfail
+        print(f"{nsuccess} notification methods triggered, {nfail} failed.")
+        if problems != []:
+            raise Exception("Some notification methods failed.", *problems)
+
+    def notify_concurrently(self, subject, text):
+        """
+        Send through every notifier at once, waiting for each only until its
+        deadline. A notifier that misses its deadline is counted as failed
+        (though it can't be stopped, so its message may still arrive later).
+
+        :return: A list of (notifier, exception) pairs for the failures.
+        """
         problems = []
-        nsuccess, nfail = 0, 0
-        for notifier in self.notifiers:
+        if not self.notifiers:
+            return problems
+        start = time.monotonic()
+        pool = futures.ThreadPoolExecutor(max_workers=len(self.notifiers))
+        sends = [(notifier, pool.submit(send, notifier, subject, text))
+            for notifier in self.notifiers]
+        # don't wait for stragglers once we've given up on them
+        pool.shutdown(wait=False)
+        for notifier, future in sends:
+            timeout = self.timeouts.get(notifier, self.timeout)
+            if timeout is not None:
+                timeout = max(0, start + timeout - time.monotonic())
             try:
-                notifier.notify(subject, text)
-                nsuccess += 1
+                future.result(timeout=timeout)
+            except futures.TimeoutError:
+                problems.append((notifier, TimeoutError(
+                    f"Notification method timed out after "
+                    f"{self.timeouts.get(notifier, self.timeout)} seconds")))
             except Exception as e:
                 problems.append((notifier, e))
-                nfail += 1
-        print(f"{nsuccess} notification methods triggered, {nfail} failed.")
-        if problems != []:
-            raise Exception("Some notification methods failed.", *problems)
+        return problems
+
+
+def send(notifier, subject, text):
+    """Send a message through a notifier, timing how long it takes."""
+    with metrics.timer("notify_seconds", method=method(notifier)):
+        notifier.notify(subject, text)
+
+
+def method(notifier):
+    """Name a notifier's method, for the metrics."""
+    return type(notifier).__name__
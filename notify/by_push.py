@@ -4,7 +4,7 @@ pushbullet-based notifier
 :author: CaviarChen and josephsurin
 """
 
-import requests
+from notify.connections import http_session
 
 
 class PushbulletNotifier:
@@ -26,7 +26,7 @@ class PushbulletNotifier:
             "body": text
         }
 
-        r = requests.post("https://api.pushbullet.com/v2/pushes",
+        r = http_session().post("https://api.pushbullet.com/v2/pushes",
             auth=(self.token, ''), json=data)
         if r.status_code != 200:
             raise Exception(r.status_code, r.text)
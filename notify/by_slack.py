@@ -4,7 +4,7 @@ Slack app notifier for incoming webhooks
 :author: abhinavcreed13
 """
 import json
-import requests
+from notify.connections import http_session
 
 
 class SlackAppNotifier:
@@ -50,9 +50,9 @@ class SlackAppNotifier:
         }
 
         # post to the webhook
-        r = requests.post(self.hook_url,
-                          data=json.dumps(slack_data),
-                          headers={'Content-Type': 'application/json'})
+        r = http_session().post(self.hook_url,
+                                data=json.dumps(slack_data),
+                                headers={'Content-Type': 'application/json'})
 
         # handling post error
         if r.status_code != 200:
@@ -4,7 +4,7 @@ Telegram bot-based telegram notifier
 :author: blueset
 """
 
-import requests
+from notify.connections import http_session
 
 
 class TelegramBotNotifier:
@@ -29,7 +29,7 @@ class TelegramBotNotifier:
             "disable_web_page_preview": True
         }
 
-        r = requests.post(self.entry_point, json=data)
+        r = http_session().post(self.entry_point, json=data)
         if r.status_code != 200:
             raise Exception(r.status_code, r.text)
         
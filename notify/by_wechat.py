@@ -4,7 +4,7 @@ serverchan-based wechat notifier
 :author: CaviarChen
 """
 
-import requests
+from notify.connections import http_session
 
 
 class ServerChanNotifier:
@@ -24,7 +24,7 @@ class ServerChanNotifier:
                 "text": subject,
                 "desp": text
         }
-        r = requests.get(self.api, params=data)
+        r = http_session().get(self.api, params=data)
         if r.json()["errno"] != 0:
             raise Exception(r.text)
         
@@ -0,0 +1,68 @@
+"""
+shared, pooled HTTP connections for the web-based notifiers
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# how many keep-alive connections to hold open to each host
+POOL_SIZE = 32
+
+# give up on connecting after this many seconds, and on a response after this
+# many seconds without hearing anything (unless a notifier sets its own)
+TIMEOUT = (10, 30) # (connect, read) seconds
+
+_session = None
+_lock = threading.Lock()
+
+
+def http_session():
+    """
+    Get the `requests.Session` shared by all of the HTTP notifiers. Reusing
+    one session keeps connections (and their TLS handshakes) alive between
+    messages, rather than opening a new connection for every message.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = TimeoutAdapter(pool_connections=POOL_SIZE,
+                pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def wrap_adapter(wrap):
+    """
+    Send all of the HTTP notifiers' requests through another transport
+    adapter, made by calling `wrap` with the current one (e.g. to record them
+    to a cassette, see `cassette.Cassette.adapter`).
+    """
+    session = http_session()
+    adapter = wrap(session.get_adapter("https://"))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+
+def set_timeout(connect, read):
+    """Change the timeouts (in seconds) for all of the HTTP notifiers."""
+    global TIMEOUT
+    TIMEOUT = (connect, read)
+
+
+class TimeoutAdapter(HTTPAdapter):
+    """
+    An adapter that gives every request a timeout (requests otherwise waits
+    forever on a stalled connection, holding up the whole check).
+    """
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = TIMEOUT
+        return super().send(request, timeout=timeout, **kwargs)
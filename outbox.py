@@ -0,0 +1,212 @@
+"""
+a durable, local outbox of notifications, so that no results change goes
+unreported just because a notification method was down at the time
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+
+import metrics
+from notify.by_multiple import send, method
+
+
+# retry failed deliveries after BACKOFF_BASE seconds, doubling each time up
+# to BACKOFF_MAX, and give up after MAX_ATTEMPTS attempts
+BACKOFF_BASE = 30 # seconds
+BACKOFF_MAX = 60 * 60 # seconds
+MAX_ATTEMPTS = 20
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE NOT NULL,       -- idempotency key
+    account TEXT NOT NULL,          -- username
+    channel TEXT NOT NULL,          -- which of the account's notifiers
+    subject TEXT NOT NULL,
+    text TEXT NOT NULL,
+    created REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    last_error TEXT,
+    delivered REAL
+);
+CREATE INDEX IF NOT EXISTS pending ON messages (delivered, next_attempt);
+CREATE INDEX IF NOT EXISTS latest ON messages (account, channel, subject,
+    created);
+"""
+
+
+def channels(notifier):
+    """
+    Split an account's notifier into its separately retried channels, as a
+    dict from channel names to notifiers.
+    """
+    notifiers = getattr(notifier, "notifiers", [notifier])
+    return {f"{i}:{type(n).__name__}": n for i, n in enumerate(notifiers)}
+
+
+class Outbox:
+    """
+    An SQLite-backed queue of messages waiting to be delivered, one row per
+    message per notification channel, each retried with exponential backoff
+    until it is delivered.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.executescript(SCHEMA)
+
+    def enqueue(self, account, subject, text, only=None, change=None):
+        """
+        Queue a message for delivery through each of an account's channels
+        (or just those named in `only`, see `channels`).
+
+        A message for the same change as the last message queued with the
+        same subject (i.e. about the same degree) is a repeat, e.g. from a
+        check re-run after a crash before its results were saved, and isn't
+        queued again, however long ago that was. The same message for a
+        later change (e.g. a result that went back and forth) is queued
+        afresh.
+
+        :param change: Identifies the change the message reports (see
+                       `accounts.change_key`), if known. Otherwise, the
+                       message's text stands in for it.
+        """
+        now = time.time()
+        queued = False
+        with self.lock, self.db:
+            for channel in channels(account.notifier):
+                if only is not None and channel not in only:
+                    continue
+                key = hashlib.sha256("\0".join([account.username, channel,
+                    subject, text, change or ""]).encode()).hexdigest()
+                exists = self.db.execute("SELECT 1 FROM messages WHERE "
+                    "key = ?", (key,)).fetchone()
+                if exists is None:
+                    self.db.execute("INSERT INTO messages (key, account, "
+                        "channel, subject, text, created, next_attempt) VALUES "
+                        "(?, ?, ?, ?, ?, ?, ?)", (key, account.username,
+                        channel, subject, text, now, now))
+                    queued = True
+                    continue
+                latest, = self.db.execute("SELECT key FROM messages WHERE "
+                    "account = ? AND channel = ? AND subject = ? ORDER BY "
+                    "created DESC, id DESC LIMIT 1", (account.username,
+                    channel, subject)).fetchone()
+                if latest == key:
+                    continue
+                # the same message as an old one, for a new change: queue it
+                # again (reusing the old row, since the key is unique)
+                self.db.execute("UPDATE messages SET created = ?, attempts = 0,"
+                    " next_attempt = ?, last_error = NULL, delivered = NULL "
+                    "WHERE key = ?", (now, now, key))
+                queued = True
+        if queued:
+            print("Queued notification:", subject)
+
+    def due(self, limit=100):
+        """:return: Up to `limit` undelivered messages that are due a try."""
+        with self.lock:
+            return self.db.execute("SELECT id, account, channel, subject, text,"
+                " attempts FROM messages WHERE delivered IS NULL AND "
+                "next_attempt <= ? AND attempts < ? ORDER BY next_attempt "
+                "LIMIT ?", (time.time(), MAX_ATTEMPTS, limit)).fetchall()
+
+    def pending(self):
+        """:return: The number of messages not yet delivered."""
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM messages WHERE "
+                "delivered IS NULL AND attempts < ?", (MAX_ATTEMPTS,)
+                ).fetchone()[0]
+
+    def delivered(self, message_id):
+        with self.lock, self.db:
+            self.db.execute("UPDATE messages SET delivered = ?, attempts = "
+                "attempts + 1 WHERE id = ?", (time.time(), message_id))
+
+    def failed(self, message_id, attempts, error):
+        # back off exponentially, with some jitter so that retries of
+        # messages that failed together don't all happen together again
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempts)
+        delay *= random.uniform(0.5, 1.0)
+        with self.lock, self.db:
+            self.db.execute("UPDATE messages SET attempts = attempts + 1, "
+                "next_attempt = ?, last_error = ? WHERE id = ?",
+                (time.time() + delay, f"{error.__class__.__name__}: {error}",
+                message_id))
+
+    def deliver_due(self, accounts):
+        """
+        Try to deliver every message that's due.
+
+        :param accounts: The accounts whose messages to deliver (messages
+                         for other accounts are left in the outbox).
+        :return: (number delivered, number failed).
+        """
+        notifiers = {account.username: channels(account.notifier)
+            for account in accounts}
+        ndelivered, nfailed = 0, 0
+        for message_id, username, channel, subject, text, attempts \
+                in self.due():
+            notifier = notifiers.get(username, {}).get(channel)
+            if notifier is None:
+                continue
+            try:
+                send(notifier, subject, text)
+            except Exception as e:
+                metrics.count("notify_failures_total", method=method(notifier))
+                print(f"Delivery via {channel} failed (attempt "
+                    f"{attempts+1}): {e.__class__.__name__}: {e}")
+                self.failed(message_id, attempts, e)
+                nfailed += 1
+            else:
+                self.delivered(message_id)
+                ndelivered += 1
+        return ndelivered, nfailed
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class DeliveryWorker:
+    """
+    A background thread which keeps draining an outbox, independently of
+    (and so without holding up) the results checks.
+    """
+    def __init__(self, outbox, accounts, interval=5):
+        """
+        :param outbox: The outbox to drain.
+        :param accounts: The accounts whose messages to deliver.
+        :param interval: Seconds to wait between delivery rounds.
+        """
+        self.outbox = outbox
+        self.accounts = accounts
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                self.outbox.deliver_due(self.accounts)
+            except Exception as e:
+                print("Exception encountered delivering notifications:")
+                print(f"{e.__class__.__name__}: {e}")
+            self.stopping.wait(self.interval)
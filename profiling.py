@@ -0,0 +1,218 @@
+"""
+opt-in profiling of results checks, for finding out what's slow (or what's
+using up memory) on a running host, without editing any code
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import os
+import sys
+import time
+import signal
+import cProfile
+import functools
+import threading
+import tracemalloc
+from collections import Counter
+
+
+class Profiler:
+    """
+    Profiles the next few checks, once asked to (with `request`, or with a
+    signal, see `install_signal_handler`). For each profiled check, writes:
+
+    * a cProfile dump (cycle-{n}-{username}.prof, for pstats, snakeviz, etc.);
+    * if `memory_top` is set, the files and lines of code responsible for
+      the most memory allocated during the check, from tracemalloc, both at
+      (about) the check's peak memory use, and at its end
+      (cycle-{n}-{username}-memory.txt).
+
+    Meanwhile, the stacks of all threads are sampled every `sample_interval`
+    seconds, and the samples from all checks so far are written to
+    stacks.folded, in the collapsed-stack format read by flamegraph tools.
+    Each stack is rooted at the name of its thread, with the profiled check's
+    own thread called "check", so that work the check hands off to other
+    threads (e.g. notifiers, or a process pool's feeder) still shows up.
+
+    Only one check is profiled at a time (other checks go ahead unprofiled).
+    Note that cProfile only sees the profiled check's own thread, and that
+    tracemalloc traces the whole process, so allocations made by any checks
+    running alongside the profiled one are counted too: for a clean memory
+    profile, profile with only one check running at a time (e.g. with
+    cohort.py's MAX_WORKERS, or headless.py's "max_workers", set to 1;
+    wamspam.py only checks one account).
+    """
+    def __init__(self, directory="profiles", cycles=0, memory_top=0,
+            sample_interval=0.005):
+        """
+        :param directory: Where to write the profiles.
+        :param cycles: The number of checks to profile from the start.
+        :param memory_top: How many of the top allocating lines of code to
+                           record (0 to skip tracing memory allocations,
+                           which slows the check down a lot).
+        :param sample_interval: Seconds between stack samples (None to skip
+                                sampling).
+        """
+        self.directory = directory
+        self.memory_top = memory_top
+        self.sample_interval = sample_interval
+        self.remaining = cycles
+        self.cycle = 0
+        self.stacks = Counter()
+        self.lock = threading.Lock()
+        self.profiling = threading.Lock()
+
+    def request(self, cycles):
+        """Profile the next `cycles` checks."""
+        # (no lock, since this may be called from a signal handler, which
+        # could interrupt a thread that's holding it)
+        self.remaining = cycles
+        print(f"Profiling the next {cycles} checks (into {self.directory})")
+
+    def install_signal_handler(self, cycles, signum=getattr(signal, "SIGUSR1",
+            None)):
+        """
+        Profile the next `cycles` checks whenever the script gets a signal
+        (by default SIGUSR1, e.g. `kill -USR1 {pid}`, where supported). Must
+        be called from the main thread.
+        """
+        if signum is None:
+            return
+        signal.signal(signum, lambda signum, frame: self.request(cycles))
+
+    def wrap(self, task):
+        """
+        :return: A version of `task` (e.g. `accounts.poll_and_notify`) which
+                 is profiled when requested.
+        """
+        @functools.wraps(task)
+        def profiled(account):
+            with self.lock:
+                take = self.remaining > 0 and self.profiling.acquire(False)
+                if take:
+                    self.remaining -= 1
+                    self.cycle += 1
+                    cycle = self.cycle
+            if not take:
+                return task(account)
+            try:
+                return self.profile(cycle, task, account)
+            finally:
+                self.profiling.release()
+        return profiled
+
+    def profile(self, cycle, task, account):
+        os.makedirs(self.directory, exist_ok=True)
+        name = os.path.join(self.directory,
+            f"cycle-{cycle:04d}-{account.username}")
+        if self.memory_top:
+            tracemalloc.start(25)
+        sampler = None
+        if self.sample_interval:
+            sampler = Sampler(threading.get_ident(), self.sample_interval,
+                memory=bool(self.memory_top))
+            sampler.start()
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(task, account)
+        finally:
+            profile.dump_stats(name + ".prof")
+            if sampler is not None:
+                self.stacks.update(sampler.stop())
+                write_folded(os.path.join(self.directory, "stacks.folded"),
+                    self.stacks)
+            if self.memory_top:
+                snapshots = [("at the end of the check",
+                    tracemalloc.take_snapshot())]
+                if sampler is not None and sampler.peak is not None:
+                    snapshots.insert(0, ("at peak", sampler.peak))
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                write_memory_top(name + "-memory.txt", snapshots, peak,
+                    self.memory_top)
+            print(f"Wrote profile for {account.username} to {name}.prof")
+
+
+class Sampler:
+    """
+    A thread which periodically samples the stacks of all other threads,
+    rooting those of the thread `thread_id` at "check" (and, if `memory` is
+    set, keeps a tracemalloc snapshot from around the time that the most
+    memory was in use).
+    """
+    def __init__(self, thread_id, interval, memory=False):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.memory = memory
+        self.stacks = Counter()
+        self.peak = None
+        self.peak_size = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """:return: A Counter of the stacks seen (see `collapse`)."""
+        self.stopping.set()
+        self.thread.join()
+        return self.stacks
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            names = {thread.ident: thread.name
+                for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.thread.ident:
+                    continue
+                if thread_id == self.thread_id:
+                    name = "check"
+                else:
+                    name = names.get(thread_id, str(thread_id))
+                self.stacks[f"{name};{collapse(frame)}"] += 1
+            del frame
+            if self.memory:
+                size, _ = tracemalloc.get_traced_memory()
+                # (snapshots are slow, so only take one on a sizeable rise)
+                if size > self.peak_size * 1.25:
+                    self.peak = tracemalloc.take_snapshot()
+                    self.peak_size = size
+
+
+def collapse(frame):
+    """:return: A stack as "outermost;...;innermost" function names."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def write_folded(filename, stacks):
+    with open(filename, 'w') as foldedfile:
+        for stack, count in stacks.most_common():
+            foldedfile.write(f"{stack} {count}\n")
+
+
+def write_memory_top(filename, snapshots, peak, top):
+    """
+    :param snapshots: A list of (description, tracemalloc snapshot) pairs.
+    :param peak: The peak traced memory use (bytes).
+    """
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__)]
+    with open(filename, 'w') as memoryfile:
+        memoryfile.write(f"# {time.strftime('%Y-%m-%d %H:%M:%S')}, peak "
+            f"traced memory {peak / 1024:.1f} KiB\n")
+        memoryfile.write("# (traced across the whole process, including "
+            "any other checks running at the same time)\n")
+        for description, snapshot in snapshots:
+            snapshot = snapshot.filter_traces(ignore)
+            memoryfile.write(f"\n# top {top} files, {description}\n")
+            for stat in snapshot.statistics("filename")[:top]:
+                memoryfile.write(f"{stat}\n")
+            memoryfile.write(f"\n# top {top} lines, {description}\n")
+            for stat in snapshot.statistics("lineno")[:top]:
+                memoryfile.write(f"{stat}\n")
@@ -0,0 +1,348 @@
+"""
+limits on how hard we hit the student portal (and how long we wait on it),
+shared between every check running in this process
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import time
+import functools
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+
+import metrics
+
+
+# responses that mean the portal wants us to slow down
+THROTTLED_STATUSES = {429, 503}
+
+# if a throttled response doesn't say how long to wait (with Retry-After),
+# wait RETRY_DELAY seconds, doubling with each retry, up to RETRIES retries
+RETRY_DELAY = 5 # seconds
+RETRIES = 3
+
+# give up on connecting to the portal after this many seconds, and on a
+# response after this many seconds without hearing anything from the portal
+TIMEOUT = (10, 30) # (connect, read) seconds
+
+# once this many requests to the same host fail in a row, stop sending it
+# requests for BREAKER_COOLDOWN seconds (then try one, and so on)
+BREAKER_FAILURES = 5
+BREAKER_COOLDOWN = 60 # seconds
+
+
+class CircuitOpenError(Exception):
+    """Represent a request not sent, because its host keeps failing"""
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second on average, in bursts of up to `burst`
+    requests. When throttled, the rate is halved (down to `min_rate`), and it
+    then creeps back up with each successful request.
+    """
+    def __init__(self, rate, burst=1, min_rate=None):
+        self.max_rate = rate
+        self.min_rate = rate / 16 if min_rate is None else min_rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Wait for (and take) a token."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst,
+                    self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def slow_down(self):
+        with self.lock:
+            self.rate = max(self.rate / 2, self.min_rate)
+
+    def speed_up(self):
+        with self.lock:
+            self.rate = min(self.rate + self.max_rate / 16, self.max_rate)
+
+
+class RateLimiter:
+    """
+    Wraps requests to the portal with an overall rate limit, per-endpoint
+    rate limits (e.g. for logins, which are heavier on the portal than
+    loading a results page), and a limit on the number of requests in flight
+    at once. Throttled responses (429 or 503) slow everyone down, and pause
+    all requests for as long as the portal's Retry-After asks, before the
+    request is retried.
+
+    By default, there are no limits at all, but throttled responses are still
+    honoured.
+    """
+    def __init__(self, rate=None, burst=1, max_in_flight=None, endpoints=None,
+            timeout=TIMEOUT, hedge=False, breaker=None):
+        """
+        :param rate: The overall number of requests per second (None for no
+                     limit).
+        :param burst: The number of requests allowed at once, after a lull.
+        :param max_in_flight: The number of requests allowed to be waiting on
+                              a response at once (None for no limit).
+        :param endpoints: A dict mapping endpoint names ("login", "results"
+                          or "postback", see `scrape.scrape_results`) to
+                          (rate, burst) limits for that endpoint in particular.
+        :param timeout: (connect, read) timeouts in seconds for each request
+                        (see `requests.request`), or None to wait forever.
+        :param hedge: If True, when a GET hasn't been answered within the
+                      usual (95th percentile) time for its endpoint, send
+                      the same request again, and use whichever response
+                      comes back first (see `Hedger`).
+        :param breaker: A `CircuitBreaker` to stop sending requests to a host
+                        that keeps failing (by default, a new one), or False
+                        to keep trying regardless.
+        """
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.endpoints = {endpoint: TokenBucket(rate, burst)
+            for endpoint, (rate, burst) in (endpoints or {}).items() if rate}
+        if max_in_flight:
+            self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        else:
+            self.in_flight = None
+        self.paused_until = 0
+        self.lock = threading.Lock()
+        self.timeout = timeout
+        self.hedger = Hedger() if hedge else None
+        if breaker is None:
+            breaker = CircuitBreaker()
+        self.breaker = breaker or None
+
+    def get(self, session, endpoint, url, **kwargs):
+        if self.hedger is not None:
+            # (GETs are safe to send twice)
+            send = functools.partial(self.hedger.send, session.get, endpoint)
+            return self.request(send, endpoint, url, **kwargs)
+        return self.request(session.get, endpoint, url, **kwargs)
+
+    def post(self, session, endpoint, url, **kwargs):
+        return self.request(session.post, endpoint, url, **kwargs)
+
+    def request(self, send, endpoint, url, **kwargs):
+        """
+        Make a request (with `send`, e.g. a `requests.Session`'s `get`
+        method), within the limits for `endpoint`.
+
+        :raises requests.HTTPError: If the portal is still throttling us after
+                                    RETRIES retries.
+        :raises CircuitOpenError: If the portal has been failing consistently.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        host = urlsplit(url).netloc
+        buckets = [self.bucket, self.endpoints.get(endpoint)]
+        buckets = [bucket for bucket in buckets if bucket is not None]
+        for attempt in range(RETRIES + 1):
+            if self.breaker is not None:
+                self.breaker.check(host)
+            self.wait(buckets)
+            try:
+                with metrics.timer("request_seconds", endpoint=endpoint):
+                    if self.in_flight is not None:
+                        with self.in_flight:
+                            response = send(url, **kwargs)
+                    else:
+                        response = send(url, **kwargs)
+            except requests.RequestException:
+                if self.breaker is not None:
+                    self.breaker.failed(host)
+                raise
+            if self.breaker is not None:
+                # (being throttled doesn't count either way)
+                status = response.status_code
+                if status >= 500 and status not in THROTTLED_STATUSES:
+                    self.breaker.failed(host)
+                elif status not in THROTTLED_STATUSES:
+                    self.breaker.succeeded(host)
+            metrics.count("requests_total", endpoint=endpoint,
+                status=response.status_code)
+            if not kwargs.get("stream"):
+                # (streamed responses are counted as they're read instead)
+                metrics.count("bytes_downloaded_total", len(response.content))
+            if response.status_code not in THROTTLED_STATUSES:
+                for bucket in buckets:
+                    bucket.speed_up()
+                return response
+            for bucket in buckets:
+                bucket.slow_down()
+            response.close()
+            if attempt == RETRIES:
+                break
+            delay = retry_after(response, RETRY_DELAY * 2**attempt)
+            print(f"Portal responded {response.status_code} to {endpoint} "
+                f"request, slowing down (retrying in {delay:.0f} seconds)")
+            with self.lock:
+                self.paused_until = max(self.paused_until,
+                    time.monotonic() + delay)
+        response.raise_for_status()
+
+    def wait(self, buckets):
+        """Wait out any pause, then for a token from each bucket."""
+        while True:
+            with self.lock:
+                wait = self.paused_until - time.monotonic()
+            if wait <= 0:
+                break
+            time.sleep(wait)
+        for bucket in buckets:
+            bucket.acquire()
+
+
+def retry_after(response, default):
+    """
+    :return: The number of seconds a response's Retry-After header asks us
+             to wait (or `default`, if it doesn't say).
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return default
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        when = None
+    if when is None:
+        return default
+    return max(0, when.timestamp() - time.time())
+
+
+class CircuitBreaker:
+    """
+    Keeps track of which hosts are failing. After `failures` failed requests
+    in a row to a host, the circuit "opens", and further requests to that
+    host fail straight away (with `CircuitOpenError`) for `cooldown` seconds.
+    Then, one request at a time is let through to try the host again, until
+    one succeeds and the circuit closes.
+    """
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.failed_in_a_row = {}
+        self.open_until = {}
+        self.lock = threading.Lock()
+
+    def check(self, host):
+        """:raises CircuitOpenError: If requests to `host` shouldn't be sent."""
+        with self.lock:
+            until = self.open_until.get(host)
+            if until is None:
+                return
+            now = time.monotonic()
+            if now < until:
+                metrics.count("circuit_open_total", host=host)
+                raise CircuitOpenError(f"{host} has failed {self.failures}+ "
+                    f"times in a row, not trying again for "
+                    f"{until - now:.0f} seconds")
+            # let this one request through to try the host again (and hold
+            # the rest back until it's done)
+            self.open_until[host] = now + self.cooldown
+
+    def succeeded(self, host):
+        with self.lock:
+            self.failed_in_a_row.pop(host, None)
+            if self.open_until.pop(host, None) is not None:
+                print(f"Requests to {host} are succeeding again")
+
+    def failed(self, host):
+        with self.lock:
+            self.failed_in_a_row[host] = self.failed_in_a_row.get(host, 0) + 1
+            if self.failed_in_a_row[host] >= self.failures:
+                if host not in self.open_until:
+                    print(f"Requests to {host} keep failing, pausing them for "
+                        f"{self.cooldown} seconds")
+                self.open_until[host] = time.monotonic() + self.cooldown
+
+
+class Hedger:
+    """
+    Sends "hedged" requests: if a request hasn't been answered within the
+    `percentile` latency of the last `window` requests to the same endpoint,
+    the same request is sent again, and whichever response comes back first
+    is used (the other is discarded). This cuts off the long tail of slow
+    responses (e.g. from a stalled connection) at the cost of (by design) a
+    few percent more requests. Only for requests that are safe to repeat!
+    """
+    def __init__(self, percentile=0.95, window=200, min_samples=20,
+            max_workers=32):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        self.latencies = {}
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def delay(self, endpoint):
+        """:return: How long to wait before hedging (None for no hedging)."""
+        with self.lock:
+            latencies = sorted(self.latencies.get(endpoint, ()))
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[int(self.percentile * (len(latencies) - 1))]
+
+    def observe(self, endpoint, seconds):
+        with self.lock:
+            if endpoint not in self.latencies:
+                self.latencies[endpoint] = deque(maxlen=self.window)
+            self.latencies[endpoint].append(seconds)
+
+    def send(self, send, endpoint, url, **kwargs):
+        """Make a request with `send` (e.g. `session.get`), hedging it."""
+        start = time.perf_counter()
+        response = self.race(send, endpoint, url, **kwargs)
+        # (the latency as it turned out, with any hedging, so that about
+        # 1 - `percentile` of requests are hedged, however slow the tail is)
+        self.observe(endpoint, time.perf_counter() - start)
+        return response
+
+    def race(self, send, endpoint, url, **kwargs):
+        delay = self.delay(endpoint)
+        if delay is None:
+            return send(url, **kwargs)
+        first = self.pool.submit(send, url, **kwargs)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+        metrics.count("hedged_requests_total", endpoint=endpoint)
+        second = self.pool.submit(send, url, **kwargs)
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            succeeded = [future for future in done
+                if future.exception() is None]
+            if succeeded:
+                winner = succeeded[0]
+                # discard the other response, whenever it arrives
+                for other in {first, second} - {winner}:
+                    other.add_done_callback(discard)
+                if winner is second:
+                    metrics.count("hedged_requests_won_total",
+                        endpoint=endpoint)
+                return winner.result()
+        # both failed
+        return first.result()
+
+
+def discard(future):
+    """Close the response of a request that lost a hedged race."""
+    if future.exception() is None:
+        future.result().close()
@@ -0,0 +1,60 @@
+"""
+compact records for subject results and transcripts, shared by the parser,
+the differ, and the results stores
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import sys
+from collections import namedtuple
+
+
+# the same few strings (years and study periods, marks, grades, credit points,
+# and even subjects, across a cohort) turn up over and over in transcripts, so
+# we intern them to keep only one copy of each in memory
+intern = sys.intern
+
+
+class Result(namedtuple("Result", "subject date mark grade credits")):
+    """A subject result, e.g. ("COMP90045 PLI", "2019, Semester 1", ...)."""
+    __slots__ = ()
+
+    @classmethod
+    def make(cls, subject, date, mark, grade, credits):
+        """Make a result, interning its fields."""
+        return cls(intern(subject), intern(date), intern(mark), intern(grade),
+            intern(credits))
+
+
+class Transcript(namedtuple("Transcript", "wam results fingerprint")):
+    """
+    A degree's results: the WAM text (or None), a tuple of `Result`s, and the
+    fingerprint of the results page they came from (or None).
+    """
+    __slots__ = ()
+
+    def __new__(cls, wam=None, results=(), fingerprint=None):
+        return super().__new__(cls, wam, tuple(results), fingerprint)
+
+    def to_json(self):
+        """:return: A JSON-serialisable form of the transcript."""
+        return {
+            "wam": self.wam,
+            "results": [list(result) for result in self.results],
+            "fingerprint": self.fingerprint,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Restore a transcript from its JSON-serialisable form (including the
+        older form, with a dict for each result).
+        """
+        results = []
+        for result in data["results"]:
+            if isinstance(result, dict):
+                results.append(Result.make(result["subject"], result["date"],
+                    result["mark"], result["grade"], result["credits"]))
+            else:
+                results.append(Result.make(*result))
+        return cls(data["wam"], results, data.get("fingerprint"))
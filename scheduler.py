@@ -0,0 +1,244 @@
+"""
+an adaptive schedule for checking accounts' results: often while results are
+being released, and less and less often while they stay the same
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import time
+import heapq
+import random
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from accounts import poll_and_notify
+
+
+class Scheduler:
+    """
+    Keeps each account's next check time in a priority queue, and checks
+    accounts (using a pool of threads) as they come due.
+
+    After each check, the account's delay until its next check is:
+
+    * reset to `delay`, if its results changed;
+    * multiplied by `backoff` (up to `max_delay`), if its results have not
+      changed for at least `stable_after` seconds; or
+    * left alone, otherwise (including if the check failed).
+
+    During a release window, no account waits longer than `release_delay`
+    between checks, and no account's wait runs past the start of the next
+    window. Each wait is also randomly stretched or shrunk by up to `jitter`
+    (as a fraction), so that accounts don't all end up checked at once.
+
+    Accounts can be added, removed, paused, resumed, or checked straight
+    away, while the scheduler is running. An account is never checked twice
+    at once: asking for a check while one is under way checks the account
+    again as soon as it's done.
+    """
+    def __init__(self, task=poll_and_notify, delay=60*60, max_delay=6*60*60,
+            backoff=1.5, stable_after=24*60*60, release_windows=(),
+            release_delay=5*60, jitter=0.1, max_workers=8):
+        """
+        :param task: The check to run for each account. Should return True
+                     if the account's results changed.
+        :param delay: The usual delay between an account's checks (seconds).
+        :param max_delay: The longest delay to back off to (seconds).
+        :param backoff: What to multiply the delay by when backing off.
+        :param stable_after: How long (seconds) an account's results must go
+                             unchanged before backing off.
+        :param release_windows: A list of (start, end) datetimes during which
+                                results are likely to be released.
+        :param release_delay: The longest delay (seconds) between an account's
+                              checks during a release window.
+        :param jitter: The fraction by which to randomly vary each delay.
+        :param max_workers: The maximum number of accounts to check at once.
+        """
+        self.task = task
+        self.delay = delay
+        self.max_delay = max(delay, max_delay)
+        self.backoff = backoff
+        self.stable_after = stable_after
+        self.release_windows = sorted((start.timestamp(), end.timestamp())
+            for start, end in release_windows)
+        self.release_delay = release_delay
+        self.jitter = jitter
+        self.max_workers = max_workers
+        self.queue = []  # (time, tiebreaker, account) triples
+        self.tiebreaker = itertools.count()
+        self.due = {}  # account: time of its next check (the live entry)
+        self.paused = set()
+        self.checking = set()
+        self.again = set()  # accounts to check again once their check is done
+        self.removed = set()  # accounts removed while they were being checked
+        self.delays = {}  # (the accounts being scheduled)
+        self.last_changes = {}
+        self.condition = threading.Condition()
+        self.stopping = False
+
+    def add(self, account, when=None):
+        """Schedule an account's first check (by default, straight away)."""
+        now = time.time()
+        with self.condition:
+            self.removed.discard(account)
+            self.delays.setdefault(account, self.delay)
+            self.last_changes.setdefault(account, now)
+            if account in self.checking:
+                self.again.add(account)
+            else:
+                self.push(account, now if when is None else when)
+
+    def schedule(self, account, changed, now=None):
+        """
+        Schedule an account's next check, after a check that found its
+        results `changed` (True), unchanged (False) or failed (None). An
+        account that isn't scheduled yet (e.g. after a first check made
+        before starting the scheduler) is added.
+
+        :return: The time of the next check (None if there won't be one,
+                 because the account has been paused or removed).
+        """
+        if now is None:
+            now = time.time()
+        with self.condition:
+            self.checking.discard(account)
+            if account in self.removed:
+                # (it was removed while it was being checked)
+                self.removed.discard(account)
+                self.again.discard(account)
+                return None
+            delay = self.delays.get(account, self.delay)
+            last_change = self.last_changes.get(account, now)
+            if changed:
+                last_change = now
+                delay = self.delay
+            elif changed is not None and now - last_change >= self.stable_after:
+                delay = min(delay * self.backoff, self.max_delay)
+            self.delays[account] = delay
+            self.last_changes[account] = last_change
+            if account in self.again:
+                # (asked for another check while this one was under way)
+                self.again.discard(account)
+                when = now
+            elif account in self.paused:
+                return None
+            else:
+                when = self.next_check(now, delay)
+            self.push(account, when)
+            return when
+
+    def next_check(self, now, delay):
+        """When should an account with this `delay` next be checked?"""
+        if self.in_release_window(now):
+            delay = min(delay, self.release_delay)
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        when = now + delay
+        for start, end in self.release_windows:
+            if now < start < when:
+                # don't sleep through the start of a release window (but
+                # don't have everyone wake up at the same moment, either)
+                return start + random.uniform(0, self.jitter*self.release_delay)
+        return when
+
+    def in_release_window(self, now):
+        return any(start <= now < end for start, end in self.release_windows)
+
+    def push(self, account, when):
+        # (any earlier entry for the account is left in the queue, but it's
+        # skipped when it comes up, since it's no longer the account's due
+        # time. if such entries pile up, they're cleared out)
+        self.due[account] = when
+        heapq.heappush(self.queue, (when, next(self.tiebreaker), account))
+        if len(self.queue) > 2 * len(self.due) + 64:
+            self.queue = [entry for entry in self.queue
+                if self.due.get(entry[2]) == entry[0]]
+            heapq.heapify(self.queue)
+        self.condition.notify()
+
+    def remove(self, account):
+        """Stop checking an account (after any check already under way)."""
+        with self.condition:
+            if account in self.checking:
+                self.removed.add(account)
+            self.due.pop(account, None)
+            self.delays.pop(account, None)
+            self.last_changes.pop(account, None)
+            self.paused.discard(account)
+            self.again.discard(account)
+
+    def pause(self, account):
+        """Stop checking an account until it's resumed."""
+        with self.condition:
+            self.paused.add(account)
+            self.due.pop(account, None)
+
+    def resume(self, account):
+        """Resume checking a paused account, starting straight away."""
+        with self.condition:
+            if account in self.paused:
+                self.paused.discard(account)
+                if account in self.checking:
+                    self.again.add(account)
+                else:
+                    self.push(account, time.time())
+
+    def check_now(self, account):
+        """
+        Check an account straight away (even if it's paused, in which case
+        it stays paused afterwards), or, if it's being checked right now, as
+        soon as that check is done.
+        """
+        with self.condition:
+            if account not in self.delays:
+                return
+            if account in self.checking:
+                self.again.add(account)
+            else:
+                self.push(account, time.time())
+
+    def next_check_time(self, account):
+        """:return: When an account is next due a check (None if never)."""
+        with self.condition:
+            return self.due.get(account)
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+
+    def run(self):
+        """Check accounts as they come due, until stopped."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while True:
+                with self.condition:
+                    while not self.stopping:
+                        now = time.time()
+                        if self.queue and self.queue[0][0] <= now:
+                            break
+                        timeout = self.queue[0][0] - now if self.queue else None
+                        self.condition.wait(timeout)
+                    if self.stopping:
+                        return
+                    when, _, account = heapq.heappop(self.queue)
+                    if self.due.get(account) != when:
+                        # removed, paused, or rescheduled since
+                        continue
+                    del self.due[account]
+                    self.checking.add(account)
+                pool.submit(self.check, account)
+
+    def check(self, account):
+        """Check an account, and schedule its next check."""
+        print("Checking", account.username, "at",
+            time.strftime("%H:%M:%S"))
+        try:
+            changed = bool(self.task(account))
+        except Exception as e:
+            print(f"Exception encountered for {account.username}:")
+            print(f"{e.__class__.__name__}: {e}")
+            changed = None
+        when = self.schedule(account, changed)
+        if when is not None:
+            print("Next check for", account.username, "at",
+                time.strftime("%H:%M:%S", time.localtime(when)))
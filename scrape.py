@@ -0,0 +1,321 @@
+"""
+log in to the my.unimelb results page and scrape a student's transcript
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import re
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import metrics
+from extract import get_extractor
+from ratelimit import RateLimiter
+
+
+class InvalidLoginException(Exception):
+    """Represent a login form validation error"""
+
+
+# the student portal, its results page, and the login form that guards it
+BASE_URL = "https://prod.ss.unimelb.edu.au"
+RESULTS_PATH = "/student/SM/ResultsDtls10.aspx?f=$S1.EST.RSLTDTLS.WEB"
+LOGIN_PATH = ("/student/login.aspx?f=$S1.EST.RSLTDTLS.WEB&ReturnUrl="
+    "%2fstudent%2fSM%2fResultsDtls10.aspx%3ff%3d%24S1.EST.RSLTDTLS.WEB")
+
+
+def scrape_results(username, password, degrees_to_watch="all",
+        default_degree_name="degree", parser="html.parser", session=None,
+        previous=None, base_url=BASE_URL, limiter=None, stream=False,
+        forms=None):
+    """
+    Log in as a student and collect their results for each degree.
+
+    :param username: The student's unimelb username.
+    :param password: The student's unimelb password.
+    :param degrees_to_watch: "all", or a set of degree indexes (based on the
+                             order from the results page, starting with 0).
+    :param default_degree_name: Name to use for students with only a single
+                                degree (we can't scrape it in that case).
+    :param parser: The extraction backend to use (see `extract.get_extractor`).
+    :param session: A `requests.Session` to use (e.g. one that's already
+                    logged in, from a `session.SessionManager`). By default,
+                    a fresh session is used (and closed afterwards).
+    :param previous: The transcript from the last check, if any. For degrees
+                     whose results pages have the same fingerprint as last
+                     time, this transcript's entries are returned as-is
+                     (the very same objects), without parsing the page.
+    :param base_url: The address of the student portal (e.g. to test against
+                     the stand-in portal in bench/portal.py).
+    :param limiter: A `ratelimit.RateLimiter` to make every request through
+                    (e.g. one shared between all the accounts being checked).
+                    By default, requests are only limited by the portal's own
+                    requests to slow down.
+    :param stream: If True, download the pages bit by bit, and stop as soon
+                   as a results page's WAM and results table have come in
+                   (see `read_content`).
+    :param forms: A `session.FormCache` of the portal's forms from earlier
+                  checks, to submit directly instead of loading them again
+                  (usually, shared with all the other students). By default,
+                  every form is loaded before it is submitted.
+    :return: A dict mapping degree names to `records.Transcript`s.
+    """
+    if session is None:
+        with requests.Session() as session:
+            return scrape_results(username, password, degrees_to_watch,
+                default_degree_name, parser, session, previous, base_url,
+                limiter, stream, forms)
+    if previous is None:
+        previous = {}
+    if limiter is None:
+        limiter = RateLimiter()
+    results_url = base_url + RESULTS_PATH
+    extractor = get_extractor(parser)
+
+    def walk(page):
+        return walk_degrees(page, degrees_to_watch, parser, session, previous,
+            results_url, limiter, stream)
+
+    # first, the shortcuts. if we've seen this student's (multi-degree) study
+    # plan page before, and they're still logged in, go straight to their
+    # degrees' postbacks, without loading the study plan page again
+    plans = None
+    if forms is not None and session.cookies:
+        plans = forms.get(("plans", username))
+    if plans is not None:
+        print("Already logged in, reusing the study plan form")
+        try:
+            return walk(plans)
+        except StaleFormError:
+            print("Study plan form rejected, reloading it")
+            forms.discard(("plans", username))
+
+    # or, if the session is fresh, it's bound to be shown the login page, so
+    # if we've seen the login form before, skip loading it and log in directly
+    page = None
+    login = None
+    if forms is not None and not session.cookies:
+        login = forms.get(("login", base_url))
+    if login is not None:
+        print("Logging in to the results page (reusing the login form)")
+        try:
+            page, content = log_in(username, password, login, extractor,
+                session, base_url, limiter, stream)
+        except StaleFormError:
+            page = None
+        if page is not None and page.login_errors:
+            # the form was fine, but the details weren't. don't try them
+            # again (that would risk locking the student's account)
+            raise InvalidLoginException("Your login attempt was not "
+                "successful. Please check your details and try again.")
+        if page is None or page.is_login_page():
+            # the portal didn't accept the old form state any more
+            print("Login form rejected, reloading it")
+            forms.discard(("login", base_url))
+            session.cookies.clear()
+            page = None
+
+    if page is None:
+        # step 1. load the results page. if the session is already logged
+        # in, this is all we need. otherwise, we'll be shown the login page
+        response = limiter.get(session, "results", results_url, stream=stream)
+        content = read_content(response, stream)
+        if unchanged(content, previous.get(default_degree_name)):
+            # it's the (only) degree's results page, and nothing has changed
+            print("Already logged in, and no change to results page")
+            return {default_degree_name: previous[default_degree_name]}
+        with metrics.timer("stage_seconds", stage="parse"):
+            page = extractor.read(content)
+
+        if page.is_login_page():
+            # step 2. fill in login form and authenticate, reaching results
+            print("Logging in to the results page")
+            if forms is not None and not page.login_errors:
+                forms.put(("login", base_url), page)
+            page, content = log_in(username, password, page, extractor,
+                session, base_url, limiter, stream)
+            # detect a potential failed login
+            if page.login_errors:
+                raise InvalidLoginException("Your login attempt was not "
+                    "successful. Please check your details and try again.")
+        else:
+            print("Already logged in to the results page")
+
+    # now `page` should be the results page or multi-degree page...
+    # step 3. either way, we are ready to start building the transcript!
+    if page.title == "Results > Choose a Study Plan":
+        print("Multiple degrees detected. Walking results pages...")
+        if forms is not None:
+            forms.put(("plans", username), page)
+        return walk(page)
+
+    print("Single degree detected. Parsing results page directly...")
+    # in this case `page` is already the results page for the only degree
+    return {default_degree_name: page.results(fingerprint(content))}
+
+
+class StaleFormError(Exception):
+    """Represent a form submission rejected by the portal"""
+
+
+def log_in(username, password, login_page, extractor, session, base_url,
+        limiter, stream=False):
+    """
+    Fill in the login form and submit it.
+
+    :raises StaleFormError: If the portal refuses the form outright.
+    :return: (page, content), where page is the `extract.Page` we end up on
+             (hopefully the results page or study plan page), and content is
+             its raw content.
+    """
+    # get the form's hidden field values into the POST data
+    login_form = dict(login_page.hidden_fields)
+    # simulate filling in the form with username and password,
+    # and pressing the login button
+    login_form['ctl00$Content$txtUserName$txtText'] = username
+    login_form['ctl00$Content$txtPassword$txtText'] = password
+    login_form['__EVENTTARGET'] = "ctl00$Content$cmdLogin"
+    # post the form, with a URL that will take us back to the results page
+    response = limiter.post(session, "login", base_url + LOGIN_PATH,
+        data=login_form, stream=stream)
+    if response.status_code >= 400:
+        response.close()
+        raise StaleFormError(f"Login form rejected ({response.status_code})")
+    content = read_content(response, stream)
+    with metrics.timer("stage_seconds", stage="parse"):
+        page = extractor.read(content)
+    return page, content
+
+
+def walk_degrees(page, degrees_to_watch, parser, session, previous,
+        results_url, limiter, stream=False):
+    """
+    Load the results page of each (watched) degree from a study plan page.
+
+    :raises StaleFormError: If the portal rejects the study plan form (e.g.
+                            because the session has expired).
+    :return: A dict mapping degree names to `records.Transcript`s.
+    """
+    degrees = []
+    for degree_index, degree_name in enumerate(page.degree_names):
+        if degrees_to_watch != "all":
+            if degree_index not in degrees_to_watch:
+                print(f"Skipping degree {degree_index}: {degree_name}")
+                continue
+        degrees.append((degree_index, degree_name))
+
+    def load_degree(degree_index, degree_name):
+        print(f"Loading results for {degree_index}: {degree_name}")
+        # get the form's hidden field values into the POST data. each
+        # degree's postback replays the same (degree list) form state,
+        # so they don't depend on each other and can be made at once
+        degree_form = dict(page.hidden_fields)
+        # now simulate pressing the required degree button
+        degree_form['__EVENTTARGET'] = "ctl00$Content$grdResultPlans"
+        degree_form['__EVENTARGUMENT'] = f"ViewResults${degree_index}"
+        # post the form, to take us to the results page proper
+        response = limiter.post(session, "postback", results_url,
+            data=degree_form, stream=stream, allow_redirects=False)
+        # if we're sent anywhere else (i.e. back to the login page), or the
+        # postback is refused, the form state is no good
+        if response.status_code >= 300:
+            response.close()
+            raise StaleFormError(f"Postback for {degree_name} rejected")
+        # now `response` should be the results page for this degree
+        return read_results_page(read_content(response, stream), parser,
+            previous.get(degree_name))
+
+    transcript = {}
+    if len(degrees) == 1:
+        transcript[degrees[0][1]] = load_degree(*degrees[0])
+    elif degrees:
+        with ThreadPoolExecutor(max_workers=len(degrees)) as pool:
+            futures = [(degree_name, pool.submit(load_degree, degree_index,
+                degree_name)) for degree_index, degree_name in degrees]
+            for degree_name, future in futures:
+                transcript[degree_name] = future.result()
+    return transcript
+
+
+# the parts of a results page that we actually care about (the rest, such as
+# the __VIEWSTATE, can change from one request to the next)
+FINGERPRINT_REGIONS = [
+    re.compile(rb'<p[^>]*class="[^"]*\bUMWAMText\b.*?</p>', re.DOTALL),
+    re.compile(rb'<table[^>]*id="ctl00_Content_grdResultDetails".*?</table>',
+        re.DOTALL),
+]
+
+# when streaming, read the pages in chunks of this many bytes
+CHUNK_SIZE = 16 * 1024
+
+def read_content(response, stream=False):
+    """
+    Read a response's content. When streaming, stop reading (and close the
+    connection) as soon as the WAM and the results table have both come in,
+    skipping the rest of the page (the tail of the form, scripts, etc.),
+    which we don't need from a results page. Other pages (e.g. the login
+    page, whose hidden fields we do need) are read in full.
+
+    :return: The content (or the part of it that was read), as bytes.
+    """
+    if not stream:
+        return response.content
+    content = bytearray()
+    waiting = list(FINGERPRINT_REGIONS)
+    try:
+        for chunk in response.iter_content(CHUNK_SIZE):
+            content += chunk
+            waiting = [regex for regex in waiting if not regex.search(content)]
+            if not waiting:
+                break
+    finally:
+        response.close()
+    metrics.count("bytes_downloaded_total", len(content))
+    if not waiting:
+        metrics.count("streams_stopped_early_total")
+    return bytes(content)
+
+
+def fingerprint(content):
+    """
+    Hash the WAM and results table regions of a results page's raw content.
+
+    :return: A hex digest, or None if the page has neither region (e.g. it's
+             the login page, or there are no results yet).
+    """
+    regions = [regex.search(content) for regex in FINGERPRINT_REGIONS]
+    if not any(regions):
+        return None
+    digest = hashlib.sha256()
+    for region in regions:
+        if region is not None:
+            digest.update(region.group())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def unchanged(content, previous_results):
+    """
+    Is this raw results page content the same (as far as the WAM and results
+    are concerned) as the page that `previous_results` were read from?
+    """
+    if previous_results is None or previous_results.fingerprint is None:
+        return False
+    digest = fingerprint(content)
+    return digest is not None and digest == previous_results.fingerprint
+
+
+def read_results_page(content, parser, previous_results=None):
+    """
+    Extract results from a results page's raw content, or, if the page is
+    unchanged since `previous_results` were read from it, skip the parsing
+    and return `previous_results` itself.
+    """
+    if unchanged(content, previous_results):
+        print("No change to results page")
+        return previous_results
+    with metrics.timer("stage_seconds", stage="parse"):
+        return get_extractor(parser).read_transcript(content,
+            fingerprint(content))
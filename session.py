@@ -0,0 +1,149 @@
+"""
+keep students' logged-in sessions alive between checks, so that we don't have
+to log in to the results page afresh every time
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import os
+import time
+import pickle
+import threading
+from contextlib import contextmanager
+
+import requests
+
+from scrape import InvalidLoginException, StaleFormError
+
+
+class SessionManager:
+    """
+    Keeps one `requests.Session` (and so one cookie jar) per student between
+    checks, optionally saving the cookies to disk so that they also survive
+    restarts of the script.
+    """
+    def __init__(self, cookie_dir=None, forms=None, transport=None):
+        """
+        :param cookie_dir: Directory in which to save each student's cookies
+                           (as {username}.cookies), or None to keep them in
+                           memory only.
+        :param forms: A `FormCache` to keep the portal's forms in between
+                      checks (by default, a new one), or False to load each
+                      form every time.
+        :param transport: A function making the `requests` transport adapter
+                          for a student's session, given their username
+                          (e.g. a `cassette.Cassette`'s `adapter` method), or
+                          None to use the usual one.
+        """
+        self.cookie_dir = cookie_dir
+        self.transport = transport
+        if forms is None:
+            forms = FormCache()
+        self.forms = forms or None
+        self.sessions = {}
+        self.lock = threading.Lock()
+        if cookie_dir is not None:
+            os.makedirs(cookie_dir, exist_ok=True)
+
+    def cookie_path(self, username):
+        return os.path.join(self.cookie_dir, f"{username}.cookies")
+
+    def session(self, username):
+        """
+        Get the session for this student, creating it (and restoring any saved
+        cookies) if necessary.
+        """
+        with self.lock:
+            if username not in self.sessions:
+                session = requests.Session()
+                if self.transport is not None:
+                    adapter = self.transport(username)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                if self.cookie_dir is not None:
+                    try:
+                        with open(self.cookie_path(username), 'rb') as f:
+                            session.cookies.update(pickle.load(f))
+                    except (OSError, pickle.UnpicklingError, EOFError):
+                        # no saved cookies (or unreadable ones), log in afresh
+                        pass
+                self.sessions[username] = session
+            return self.sessions[username]
+
+    def save(self, username):
+        """Save this student's cookies to disk (if configured)."""
+        if self.cookie_dir is None:
+            return
+        session = self.session(username)
+        path = self.cookie_path(username)
+        # the cookies are as good as a password, keep them private
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(session.cookies, f)
+
+    def forget(self, username):
+        """Drop this student's session and any saved cookies."""
+        with self.lock:
+            session = self.sessions.pop(username, None)
+        if session is not None:
+            session.close()
+        if self.forms is not None:
+            # (the student's saved study plan form belonged to that session)
+            self.forms.discard(("plans", username))
+        if self.cookie_dir is not None:
+            try:
+                os.remove(self.cookie_path(username))
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def use(self, username):
+        """
+        Use this student's session for a check. If the check succeeds, its
+        cookies are saved for next time. If it fails because the session is
+        no good any more (the login was refused, or the portal rejected a
+        form, e.g. by redirecting a postback to the login page), the session
+        is dropped so that the next check will start from a fresh login. Any
+        other failure (e.g. a timeout, or the portal being down) leaves the
+        session alone, so that an outage doesn't log everyone out at once.
+        """
+        try:
+            yield self.session(username)
+        except (InvalidLoginException, StaleFormError):
+            self.forget(username)
+            raise
+        self.save(username)
+
+
+class FormCache:
+    """
+    Remembers the portal's forms (the `extract.Page`s they're on, with their
+    hidden fields) between checks, so that they can be submitted again
+    without first loading them again: the login form, per portal, and each
+    logged-in student's study plan form (which belongs to their session).
+    Forms are forgotten after `max_age` seconds, or when the portal rejects
+    them (see `scrape.scrape_results`).
+    """
+    def __init__(self, max_age=60 * 60):
+        self.max_age = max_age
+        self.forms = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """:return: The form saved under `key`, or None."""
+        with self.lock:
+            saved, page = self.forms.get(key, (None, None))
+            if page is None:
+                return None
+            if time.monotonic() - saved > self.max_age:
+                del self.forms[key]
+                return None
+            return page
+
+    def put(self, key, page):
+        with self.lock:
+            self.forms[key] = (time.monotonic(), page)
+
+    def discard(self, key):
+        with self.lock:
+            self.forms.pop(key, None)
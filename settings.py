@@ -0,0 +1,148 @@
+"""
+the settings shared by the scripts (wamspam.py, cohort.py, and, as the
+lowercase keys of its SETTINGS, headless.py and daemon.py), with their
+defaults. change them here to change them for every script, or set any of
+them again atop one script (or in headless.py's config) to change them just
+there
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+from datetime import datetime # (for RELEASE_WINDOWS)
+
+from scrape import BASE_URL
+
+
+# # #
+# CHECKING CONFIGURATION
+#
+
+# if the script checks repeatedly, this is the delay between checks of each
+# student's results, in minutes
+DELAY_BETWEEN_CHECKS = 60 # minutes
+
+# while a student's results stay the same for a long time (STABLE_AFTER
+# hours), the script gradually checks their results less often, down to once
+# every MAX_DELAY_BETWEEN_CHECKS minutes. as soon as they change, it goes back
+# to checking every DELAY_BETWEEN_CHECKS minutes
+MAX_DELAY_BETWEEN_CHECKS = 6 * 60 # minutes
+STABLE_AFTER = 24 # hours
+
+# if you know when results are likely to be released, list those times here
+# as (start, end) pairs, and the script will check at least every
+# DELAY_DURING_RELEASE minutes during them. for example:
+# RELEASE_WINDOWS = [(datetime(2026, 12, 4, 9), datetime(2026, 12, 4, 17))]
+# (in headless.py's config, write each time as a "YYYY-MM-DD HH:MM" string)
+RELEASE_WINDOWS = []
+DELAY_DURING_RELEASE = 5 # minutes
+
+# by default, each student's results are stored in their own results file (see
+# README). set this to the name of an SQLite database file (e.g. "results.db")
+# to store everyone's results there instead, which scales better to many
+# students
+RESULTS_DATABASE = None
+
+# the maximum number of accounts to check at the same time (wamspam.py only
+# ever checks one)
+MAX_WORKERS = 16
+
+
+# # #
+# NOTIFICATION CONFIGURATION
+#
+
+# by default, each student's notification methods are triggered one after
+# another. set this to True to trigger them all at once, so that one slow
+# method doesn't hold up the others
+NOTIFY_CONCURRENTLY = False
+# when triggering them all at once, give up waiting on any method that takes
+# longer than this many seconds to send a message (None to wait forever). you
+# can also set a "timeout" for individual notifiers in an accounts file
+NOTIFY_TIMEOUT = 30 # seconds
+
+# by default, if a notification method fails, the notification is lost. set
+# this to the name of a file (e.g. "outbox.db") to instead keep notifications
+# in a local outbox, and keep retrying each method until it succeeds
+OUTBOX_FILENAME = None
+
+# by default, each change is notified as soon as it's found, one message per
+# student per changed degree. to instead collect the messages, and send each
+# notification channel one combined message every so often (e.g. one message
+# per sweep to a Slack webhook shared by the whole cohort, rather than one per
+# student), set this to the number of minutes between messages (wamspam.py
+# has its own DIGEST setting instead)
+DIGEST_INTERVAL = None # minutes
+
+
+# # #
+# WEB SCRAPING CONFIGURATION
+#
+
+# select the HTML parser for BeautifulSoup to use. in most cases, you won't
+# have to touch this. alternatively, use "fast" to skip BeautifulSoup and pick
+# out only the parts of the page the script needs (much faster, which helps
+# when checking many accounts), or "stream" for a middle ground
+BS4_PARSER = "html.parser"
+# parsing pages takes up a lot of CPU time, and with many accounts, the parser
+# can only keep one core busy. set this to True to parse pages in a pool of
+# worker processes instead, one per core
+PARSE_IN_PROCESSES = False
+
+# the address of the student portal (BASE_URL, imported above) shouldn't need
+# changing, except to test the script against a stand-in portal (see
+# bench/portal.py)
+
+# the script stays logged in to each student's results page between checks,
+# rather than logging in afresh every time. to also stay logged in between
+# runs of the script, set this to the name of a directory in which to save the
+# login cookies (keep it private, the cookies are as good as passwords!)
+COOKIE_DIR = None
+
+# most of a results page comes after the results themselves (the rest of the
+# form state, scripts, etc.). set this to True to stop downloading each results
+# page as soon as the WAM and results have come in (the connection has to be
+# closed to do so, which means a fresh connection for the next request)
+STREAM_PAGES = False
+
+# limits on how hard the script may hit the student portal, across all of the
+# students being checked: at most MAX_REQUESTS_PER_SECOND requests a second
+# (of which at most MAX_LOGINS_PER_SECOND may be logins), and at most
+# MAX_REQUESTS_IN_FLIGHT requests waiting on a response at once. use None for
+# no limit. either way, if the portal asks the script to slow down, it will
+MAX_REQUESTS_PER_SECOND = 5
+MAX_LOGINS_PER_SECOND = 1
+MAX_REQUESTS_IN_FLIGHT = 8
+
+# give up on any request (to the portal, or to send a notification) that can't
+# connect within CONNECT_TIMEOUT seconds, or that hears nothing back for
+# READ_TIMEOUT seconds, rather than risk waiting on a stalled connection forever
+CONNECT_TIMEOUT = 10 # seconds
+READ_TIMEOUT = 30 # seconds
+# set this to True to send a second copy of any request for a results page
+# that's taking longer than usual (longer than the slowest 5% of requests),
+# and use whichever answer comes back first
+HEDGE_REQUESTS = False
+
+
+# # #
+# PERFORMANCE CONFIGURATION
+#
+
+# to see where the script spends its time (logging in, parsing, notifying,
+# etc.), set METRICS_PORT to a port number (e.g. 9100) to serve timing
+# histograms and counters at http://127.0.0.1:{port}/metrics (in Prometheus'
+# text format), and/or set METRICS_FILENAME to the name of a JSON file to
+# dump them to every few minutes
+METRICS_PORT = None
+METRICS_FILENAME = None
+
+# to find out what's slowing the script down, set PROFILE_CYCLES to profile
+# the first few checks (see profiling.py), writing the profiles to PROFILE_DIR.
+# or, while the script is running, send it a SIGUSR1 signal (e.g. with
+# `kill -USR1 <pid>`) to profile the next PROFILE_CYCLES_ON_SIGNAL checks. to
+# also record which lines of code allocate the most memory during a profiled
+# check, set PROFILE_MEMORY_TOP to the number of lines to record
+PROFILE_CYCLES = 0
+PROFILE_CYCLES_ON_SIGNAL = 3
+PROFILE_MEMORY_TOP = 0
+PROFILE_DIR = "profiles"
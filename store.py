@@ -0,0 +1,99 @@
+"""
+storage for students' results between checks
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import os
+import json
+import sqlite3
+import tempfile
+import threading
+
+from records import Transcript
+
+
+class CorruptResultsException(Exception):
+    """Represent a results store that can't be read"""
+
+
+class FileStore:
+    """
+    Stores each student's results as JSON in their own results file (the
+    account's `results_filename`), which is replaced atomically on writes so
+    that a crash mid-write can't leave it half-written.
+    """
+    def load(self, account):
+        """
+        :return: The stored results for each of the account's degrees (empty
+                 if there are none yet).
+        """
+        try:
+            with open(account.results_filename) as resultsfile:
+                data = json.load(resultsfile)
+            return {degree: Transcript.from_json(transcript)
+                for degree, transcript in data.items()}
+        except FileNotFoundError:
+            # the first run, there probably won't be such a file
+            return {}
+        except (ValueError, KeyError, TypeError) as e:
+            # don't pretend it's the first run (and resend everything)
+            raise CorruptResultsException(f"Couldn't read results from "
+                f"{account.results_filename}: {e}") from e
+
+    def save(self, account, results, changed):
+        """
+        :param results: All of the account's latest results, by degree.
+        :param changed: The names of the degrees whose results changed (this
+                        store rewrites the whole file regardless).
+        """
+        directory = os.path.dirname(os.path.abspath(account.results_filename))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".results-")
+        try:
+            with os.fdopen(fd, 'w') as resultsfile:
+                json.dump({degree: transcript.to_json()
+                    for degree, transcript in results.items()}, resultsfile,
+                    indent=2)
+                resultsfile.flush()
+                os.fsync(resultsfile.fileno())
+            os.replace(tmp, account.results_filename)
+        except:
+            os.remove(tmp)
+            raise
+
+
+class SQLiteStore:
+    """
+    Stores everyone's results in one SQLite database, with a row per account
+    per degree, so that each check reads only its own account's rows, and
+    writes only the rows for degrees that changed, in one transaction.
+    """
+    def __init__(self, filename):
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS results ("
+                "account TEXT NOT NULL, degree TEXT NOT NULL, "
+                "data TEXT NOT NULL, PRIMARY KEY (account, degree))")
+
+    def load(self, account):
+        with self.lock:
+            rows = self.db.execute("SELECT degree, data FROM results WHERE "
+                "account = ?", (account.username,)).fetchall()
+        try:
+            return {degree: Transcript.from_json(json.loads(data))
+                for degree, data in rows}
+        except (ValueError, KeyError, TypeError) as e:
+            raise CorruptResultsException(f"Couldn't read results for "
+                f"{account.username}: {e}") from e
+
+    def save(self, account, results, changed):
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO results (account, "
+                "degree, data) VALUES (?, ?, ?)", [(account.username, degree,
+                json.dumps(results[degree].to_json())) for degree in changed])
+
+    def close(self):
+        with self.lock:
+            self.db.close()
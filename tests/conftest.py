@@ -0,0 +1,11 @@
+"""
+the scripts' modules live at the top of the repository (and aren't
+installed), so make them importable from the tests, however pytest is run
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
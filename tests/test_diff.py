@@ -0,0 +1,70 @@
+"""
+tests for comparing transcripts (diff.py)
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+from diff import diff, diff_all
+from records import Result, Transcript
+
+
+def result(subject, mark="", grade="", date="2026, Semester 2"):
+    return Result.make(subject, date, mark, grade, "12.5")
+
+
+def transcript(wam, *results):
+    return Transcript(wam, results)
+
+
+OLD = transcript("80.000",
+    result("COMP10001 Foundations of Computing", "85", "H1"),
+    result("COMP10002 Foundations of Algorithms"),
+    result("MAST10006 Calculus 2", "75", "H2A"),
+    result("PHYC10003 Physics 1", "70", "H2B"))
+
+
+def test_same_transcript_is_empty():
+    assert diff(OLD, OLD).is_empty()
+    # (an equal but separately parsed transcript, too)
+    assert diff(OLD, transcript(OLD.wam, *OLD.results)).is_empty()
+
+
+def test_changed_result():
+    new_result = result("COMP10002 Foundations of Algorithms", "90", "H1")
+    new = transcript("81.250", OLD.results[0], new_result, *OLD.results[2:])
+    changes = diff(OLD, new)
+    assert changes.changed == ((OLD.results[1], new_result),)
+    assert changes.added == changes.removed == ()
+    assert changes.wam_changed()
+    assert changes.wam_delta() == 1.25
+
+
+def test_added_and_removed_results():
+    added = result("COMP20003 Algorithms and Data Structures")
+    new = transcript(OLD.wam, OLD.results[0], *OLD.results[2:], added)
+    changes = diff(OLD, new)
+    assert changes.changed == ()
+    assert changes.added == (added,)
+    assert changes.removed == (OLD.results[1],)
+    assert not changes.wam_changed()
+
+
+def test_subject_retaken():
+    # (the same subject in another study period is another result)
+    retaken = result("MAST10006 Calculus 2", date="2027, Semester 1")
+    new = transcript(OLD.wam, *OLD.results, retaken)
+    changes = diff(OLD, new)
+    assert changes.added == (retaken,)
+    assert changes.changed == changes.removed == ()
+
+
+def test_missing_wam():
+    changes = diff(transcript(None), transcript("75.000"))
+    assert changes.wam_changed()
+    assert changes.wam_delta() is None
+
+
+def test_diff_all():
+    new = transcript("81.000", *OLD.results)
+    assert [c.is_empty() for c in diff_all([(OLD, OLD), (OLD, new)])] \
+        == [True, False]
@@ -0,0 +1,15 @@
+"""
+tests that every extractor backend reads the benchmark fixtures the same way
+(see bench/run.py)
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+from bench.run import DEFAULT_BACKENDS, available_backends, disagreements
+
+
+def test_backends_agree():
+    backends = available_backends(DEFAULT_BACKENDS)
+    # (lxml is optional, but these need nothing beyond BeautifulSoup)
+    assert {"html.parser", "fast", "stream"} <= set(backends)
+    assert disagreements(backends) == []
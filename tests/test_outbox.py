@@ -0,0 +1,89 @@
+"""
+tests for the outbox's de-duplication of repeated messages (outbox.py)
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import pytest
+
+from outbox import Outbox
+
+
+class SlackNotifier:
+    pass
+
+
+class EmailNotifier:
+    pass
+
+
+class MultiNotifier:
+    def __init__(self, *notifiers):
+        self.notifiers = list(notifiers)
+
+
+class Account:
+    """A stand-in for `accounts.Account` (the outbox needs its notifier)"""
+    def __init__(self, username, notifier):
+        self.username = username
+        self.notifier = notifier
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.db"))
+    yield outbox
+    outbox.close()
+
+
+@pytest.fixture
+def account():
+    return Account("alice", MultiNotifier(SlackNotifier(), EmailNotifier()))
+
+
+def deliver_all(outbox):
+    for message in outbox.due():
+        outbox.delivered(message[0])
+
+
+def test_one_message_per_channel(outbox, account):
+    outbox.enqueue(account, "Results", "new results")
+    assert outbox.pending() == 2
+    outbox.enqueue(account, "Results", "new results", only={"1:EmailNotifier"})
+    assert outbox.pending() == 2
+
+
+def test_repeat_of_a_change_is_skipped(outbox, account):
+    outbox.enqueue(account, "Results", "new results", change="a")
+    deliver_all(outbox)
+    # (e.g. the check re-run after a crash before its results were saved)
+    outbox.enqueue(account, "Results", "new results", change="a")
+    assert outbox.pending() == 0
+
+
+def test_new_change_with_the_same_text_is_queued(outbox, account):
+    outbox.enqueue(account, "Results", "new results", change="a")
+    deliver_all(outbox)
+    outbox.enqueue(account, "Results", "new results", change="b")
+    assert outbox.pending() == 2
+
+
+def test_change_back_is_queued_again(outbox, account):
+    # (without a change key, the message's text stands in for it)
+    outbox.enqueue(account, "Results", "mark: 80")
+    outbox.enqueue(account, "Results", "mark: 85")
+    deliver_all(outbox)
+    outbox.enqueue(account, "Results", "mark: 80")
+    assert outbox.pending() == 2
+    # (but repeating that is still a repeat)
+    deliver_all(outbox)
+    outbox.enqueue(account, "Results", "mark: 80")
+    assert outbox.pending() == 0
+
+
+def test_subjects_and_accounts_are_separate(outbox, account):
+    outbox.enqueue(account, "Results - BSc", "new results", change="a")
+    outbox.enqueue(account, "Results - Dip", "new results", change="a")
+    other = Account("bob", SlackNotifier())
+    outbox.enqueue(other, "Results - BSc", "new results", change="a")
+    assert outbox.pending() == 5
@@ -0,0 +1,84 @@
+"""
+tests for Retry-After handling and the circuit breaker (ratelimit.py)
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import time
+from email.utils import formatdate
+
+import pytest
+
+import ratelimit
+from ratelimit import retry_after, CircuitBreaker, CircuitOpenError
+
+
+class Response:
+    """A stand-in for `requests.Response` (with just its headers)"""
+    def __init__(self, **headers):
+        self.headers = {name.replace("_", "-"): value
+            for name, value in headers.items()}
+
+
+def test_retry_after_seconds():
+    assert retry_after(Response(Retry_After="120"), default=5) == 120
+    assert retry_after(Response(Retry_After="-3"), default=5) == 0
+
+
+def test_retry_after_date():
+    when = formatdate(time.time() + 60, usegmt=True)
+    assert 55 <= retry_after(Response(Retry_After=when), default=5) <= 60
+    past = formatdate(time.time() - 60, usegmt=True)
+    assert retry_after(Response(Retry_After=past), default=5) == 0
+
+
+def test_retry_after_default():
+    assert retry_after(Response(), default=5) == 5
+    assert retry_after(Response(Retry_After="soon"), default=5) == 5
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Control the time as the circuit breaker sees it."""
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_circuit_opens_after_failures_in_a_row(clock):
+    breaker = CircuitBreaker(failures=3, cooldown=60)
+    breaker.failed("portal")
+    breaker.failed("portal")
+    breaker.succeeded("portal")
+    breaker.failed("portal")
+    breaker.failed("portal")
+    breaker.check("portal")
+    breaker.failed("portal")
+    with pytest.raises(CircuitOpenError):
+        breaker.check("portal")
+    # (other hosts are unaffected)
+    breaker.check("smtp")
+
+
+def test_circuit_lets_one_request_through_after_cooldown(clock):
+    breaker = CircuitBreaker(failures=1, cooldown=60)
+    breaker.failed("portal")
+    clock[0] += 61
+    breaker.check("portal")
+    # (the rest are held back until that one's done)
+    with pytest.raises(CircuitOpenError):
+        breaker.check("portal")
+    breaker.succeeded("portal")
+    breaker.check("portal")
+    breaker.check("portal")
+
+
+def test_circuit_reopens_if_trial_request_fails(clock):
+    breaker = CircuitBreaker(failures=1, cooldown=60)
+    breaker.failed("portal")
+    clock[0] += 61
+    breaker.check("portal")
+    breaker.failed("portal")
+    clock[0] += 30
+    with pytest.raises(CircuitOpenError):
+        breaker.check("portal")
@@ -0,0 +1,154 @@
+"""
+tests for the adaptive check schedule (scheduler.py)
+
+:author: Matthew Farrugia-Roberts and contributors
+"""
+
+import time
+import threading
+from datetime import datetime
+
+from scheduler import Scheduler
+
+
+class Account:
+    """A stand-in for `accounts.Account` (the scheduler only needs a name)"""
+    def __init__(self, username):
+        self.username = username
+
+
+def make_scheduler(**kwargs):
+    kwargs.setdefault("task", lambda account: False)
+    kwargs.setdefault("stable_after", 24*60*60)
+    return Scheduler(delay=60, max_delay=240, backoff=2, jitter=0, **kwargs)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_add_schedules_first_check_straight_away():
+    scheduler = make_scheduler()
+    account = Account("alice")
+    before = time.time()
+    scheduler.add(account)
+    assert before <= scheduler.next_check_time(account) <= time.time()
+    other = Account("bob")
+    scheduler.add(other, when=before + 1000)
+    assert scheduler.next_check_time(other) == before + 1000
+
+
+def test_schedule_adds_unknown_account():
+    # (e.g. wamspam.py and cohort.py check everyone once before scheduling)
+    scheduler = make_scheduler()
+    account = Account("alice")
+    assert scheduler.schedule(account, changed=False, now=1000) == 1060
+    assert scheduler.next_check_time(account) == 1060
+
+
+def test_schedule_backs_off_while_stable_and_resets_on_change():
+    # (stable from the first check on)
+    scheduler = make_scheduler(stable_after=0)
+    account = Account("alice")
+    assert scheduler.schedule(account, changed=False, now=1000) == 1120
+    assert scheduler.schedule(account, changed=False, now=2000) == 2240
+    # (up to max_delay)
+    assert scheduler.schedule(account, changed=False, now=3000) == 3240
+    # a failed check leaves the delay alone
+    assert scheduler.schedule(account, changed=None, now=4000) == 4240
+    assert scheduler.schedule(account, changed=True, now=5000) == 5060
+
+
+def test_release_window_shortens_delay():
+    start, end = datetime(2026, 12, 4, 9), datetime(2026, 12, 4, 17)
+    scheduler = make_scheduler(release_windows=[(start, end)],
+        release_delay=5)
+    account = Account("alice")
+    during = start.timestamp() + 60
+    assert scheduler.schedule(account, changed=False, now=during) \
+        == during + 5
+    # don't sleep through the start of a window
+    before = start.timestamp() - 30
+    assert scheduler.schedule(account, changed=False, now=before) \
+        == start.timestamp()
+
+
+def test_pause_and_resume():
+    scheduler = make_scheduler()
+    account = Account("alice")
+    scheduler.add(account, when=1000)
+    scheduler.pause(account)
+    assert scheduler.next_check_time(account) is None
+    assert scheduler.schedule(account, changed=False, now=1000) is None
+    before = time.time()
+    scheduler.resume(account)
+    assert scheduler.next_check_time(account) >= before
+
+
+def test_check_now():
+    scheduler = make_scheduler()
+    account = Account("alice")
+    # (an account the scheduler doesn't know about is ignored)
+    scheduler.check_now(account)
+    assert scheduler.next_check_time(account) is None
+    scheduler.add(account, when=time.time() + 1000)
+    scheduler.pause(account)
+    before = time.time()
+    scheduler.check_now(account)
+    assert before <= scheduler.next_check_time(account) <= time.time()
+    # (it stays paused afterwards)
+    assert scheduler.schedule(account, changed=False) is None
+
+
+def test_remove():
+    scheduler = make_scheduler()
+    account = Account("alice")
+    scheduler.add(account)
+    scheduler.remove(account)
+    assert scheduler.next_check_time(account) is None
+    scheduler.check_now(account)
+    assert scheduler.next_check_time(account) is None
+
+
+def test_run_checks_accounts_scheduled_without_add():
+    checked = threading.Event()
+    scheduler = make_scheduler(task=lambda account: checked.set())
+    account = Account("alice")
+    scheduler.schedule(account, changed=False, now=time.time() - 60)
+    thread = threading.Thread(target=scheduler.run)
+    thread.start()
+    try:
+        assert checked.wait(5)
+    finally:
+        scheduler.stop()
+        thread.join()
+
+
+def test_remove_during_check_stops_rescheduling():
+    started = threading.Event()
+    release = threading.Event()
+    def task(account):
+        started.set()
+        release.wait(5)
+        return False
+    scheduler = make_scheduler(task=task)
+    account = Account("alice")
+    scheduler.add(account)
+    thread = threading.Thread(target=scheduler.run)
+    thread.start()
+    try:
+        assert started.wait(5)
+        scheduler.remove(account)
+        release.set()
+        wait_for(lambda: account not in scheduler.checking)
+        assert scheduler.next_check_time(account) is None
+        # (and it can be added back afterwards)
+        scheduler.add(account, when=time.time() + 1000)
+        assert scheduler.next_check_time(account) is not None
+    finally:
+        release.set()
+        scheduler.stop()
+        thread.join()